@@ -82,6 +82,23 @@ CREATE TABLE IF NOT EXISTS wrinfo_survey
 
 
 
+CREATE TABLE IF NOT EXISTS wrinfo_slice
+	(radio_if_id INT,
+	frequency INT,
+	slice_start BIGINT,
+	samples INT,
+	in_use INT,
+	time BIGINT,
+	busy BIGINT,
+	busy_time BIGINT,
+	rx BIGINT,
+	rx_time BIGINT,
+	tx BIGINT,
+	tx_time BIGINT,
+	PRIMARY KEY (radio_if_id, frequency, slice_start));
+
+
+
 CREATE TABLE IF NOT EXISTS wrinfo_errors
 	(id INT AUTO_INCREMENT UNIQUE PRIMARY KEY,
 	wrinfo_id INT,
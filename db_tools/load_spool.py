@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+
+"""
+Bulk loader of the wrinfo spool.
+
+Loads the results that run_wrinfo.py -S appended to a spool file (see
+spool.py) into the DB, as run_wrinfo.py would have stored them:  the
+wrinfo rows are inserted with multi-row INSERTs, the rows of the
+wrinfo_meta, wrinfo_interface, wrinfo_scan, wrinfo_survey and
+wrinfo_errors tables with LOAD DATA LOCAL INFILE, and the slice
+rollups, TX fraction histograms and edges are updated once for all the
+runs of a load.  Each spool file claimed is loaded in one transaction,
+and deleted once committed.  Records that can't be loaded (missing an
+item, say) are skipped.  A file whose load fails on a DB error, or on
+an error writing the temporary files, is left for the next try; one
+whose rows the DB refuses is renamed to .bad, and set aside.
+
+The LOAD DATA LOCAL statements need local_infile to be enabled on the
+server, which it is by default on MariaDB.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import mysql.connector as db
+
+import metrics
+import rollup
+import run_wrinfo
+import spool
+
+# Number of wrinfo rows per INSERT
+_insert_batch = 1000
+
+# Number of seconds the DB ids of the spool's rungroups are kept after
+# the rungroup's start, for runs spooled after a claim
+_rungroup_keep = 86400
+
+# The errors of a load that retrying won't fix:  values the columns
+# don't take, or that don't compute.  The records are checked for their
+# items before loading, so that a bad one is skipped rather than setting
+# aside its whole file.
+_bad_file_errors = (KeyError, ValueError, db.DataError, db.IntegrityError)
+
+def _tsv_value(v):
+    """Format a value for LOAD DATA, with its default escaping."""
+    if v is None:
+        return "\\N"
+    if v is True or v is False:
+        return "1" if v else "0"
+    if isinstance(v, str):
+        return v.replace("\\", "\\\\").replace("\t", "\\t") \
+                .replace("\n", "\\n").replace("\0", "\\0")
+    return str(v)
+
+def _load_data(cursor, table, cols, rows, tmpdir=None):
+    """Load rows into table with LOAD DATA LOCAL INFILE."""
+    if len(rows) == 0:
+        return
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".tsv",
+                                     dir=tmpdir, delete=False) as f:
+        for row in rows:
+            f.write("\t".join(_tsv_value(v) for v in row) + "\n")
+    try:
+        cursor.execute("LOAD DATA LOCAL INFILE %%s INTO TABLE %s"
+                       " CHARACTER SET utf8mb4 (%s)"
+                       % (table, ", ".join(cols)), (f.name,))
+    finally:
+        os.remove(f.name)
+
+def _insert_runs(cursor, rows):
+    """Insert the wrinfo rows.
+
+    With innodb_autoinc_lock_mode 0 or 1 (the default) and an
+    auto_increment_increment of 1, the rows of a multi-row INSERT get
+    consecutive wrinfo_ids; otherwise (with interleaved locks, or the
+    increments set for replication), they're inserted one at a time.
+
+    @return list of the wrinfo_ids of the rows.
+    """
+    cursor.execute("SELECT @@innodb_autoinc_lock_mode,"
+                   " @@auto_increment_increment")
+    lock_mode, increment = list(cursor)[0]
+    consecutive = lock_mode != 2 and increment == 1
+    sql = "INSERT INTO wrinfo" \
+          " (radio_if_id, status, exit_code, servertime, rungroup_id)" \
+          " VALUES (%s, %s, %s, %s, %s)"
+    ids = []
+    for i in range(0, len(rows), _insert_batch):
+        batch = rows[i:i + _insert_batch]
+        if consecutive:
+            cursor.executemany(sql, batch)
+            first = cursor.getlastrowid()
+            ids.extend(range(first, first + len(batch)))
+        else:
+            for row in batch:
+                cursor.execute(sql, row)
+                ids.append(cursor.getlastrowid())
+    return ids
+
+def _sections(D):
+    """The sections of a parsed wrinfo output that are valid, as
+    _store_result_rows() checks them.
+
+    @return Tuple (sections, ok), with sections a dict name -> section,
+            and ok whether all of them are valid.
+    """
+    if type(D) != dict:
+        return ({}, False)
+    sections = {}
+    for (name, tp) in (("interface", dict), ("meta", dict), ("scan", list),
+                       ("survey", list)):
+        if type(D.get(name)) == tp:
+            sections[name] = D[name]
+    return (sections, len(sections) == 4)
+
+def _valid_rungroup_info(info):
+    """Whether the rungroup items of a spool record are valid."""
+    return type(info) == dict and type(info.get("cmd")) == str \
+           and type(info.get("servertime")) == int \
+           and (info.get("tag") is None or type(info["tag"]) == str)
+
+def _valid_record(r):
+    """Whether a spool record has the items load() needs, of the types
+    it needs."""
+    if type(r) != dict or type(r.get("rungroup")) != str:
+        return False
+    if r.get("kind") == "rungroup":
+        return _valid_rungroup_info(r)
+    if r.get("kind") != "run" or "output" not in r:
+        return False
+    info = r.get("rungroup_info")
+    if (info is not None and not _valid_rungroup_info(info)) \
+      or type(r.get("if_id")) != int or type(r.get("status")) != int \
+      or (r.get("exit_code") is not None and type(r["exit_code"]) != int) \
+      or type(r.get("servertime")) != int or type(r.get("stderr")) != str:
+        return False
+    S = _sections(r["output"])[0]
+    return all(type(E) == dict
+               for E in S.get("scan", []) + S.get("survey", []))
+
+def load(conn, cursor, records, tmpdir=None, rungroup_ids=None):
+    """Load the records of a spool file, and commit.
+
+    @param  rungroup_ids
+            dict mapping the spool-local ids of the rungroups already
+            loaded to tuples (DB id, servertime), shared by the loads of
+            a loader; updated with the rungroups of the records once
+            committed.  The runs of a rungroup that isn't known (its
+            record was in a file loaded by another loader process, or
+            set aside) get a new one, from the rungroup items repeated
+            in their record.
+
+    @return the number of wrinfo runs loaded.
+    """
+    if rungroup_ids is None:
+        rungroup_ids = {}
+    n_bad = len(records)
+    records = [ r for r in records if _valid_record(r) ]
+    n_bad -= len(records)
+    if n_bad > 0:
+        sys.stderr.write("Warning:  %d invalid records, skipped.\n"
+                         % (n_bad,))
+    new_ids = {}
+    def add_rungroup(spool_id, info):
+        cursor.execute(
+          "INSERT INTO rungroup (cmd, servertime, tag) "
+          + "VALUES (%s, %s, %s)",
+          (info["cmd"], info["servertime"], info["tag"]))
+        new_ids[spool_id] = (cursor.getlastrowid(), info["servertime"])
+    def get_rungroup(r):
+        spool_id = r["rungroup"]
+        if spool_id not in new_ids and spool_id not in rungroup_ids:
+            if r.get("rungroup_info") is None:
+                sys.stderr.write("Warning:  Unknown rungroup %s, runs"
+                                 " loaded without one.\n" % (spool_id,))
+                new_ids[spool_id] = (None, r["servertime"])
+            else:
+                add_rungroup(spool_id, r["rungroup_info"])
+        return new_ids.get(spool_id, rungroup_ids.get(spool_id))[0]
+
+    # Rungroups, mapped from their spool-local ids
+    for r in records:
+        if r.get("kind") == "rungroup" and r["rungroup"] not in rungroup_ids:
+            add_rungroup(r["rungroup"], r)
+
+    # The wrinfo rows; the status of a run whose output is incomplete
+    # or invalid is set to 3, as in _store_result_rows().
+    runs = [ r for r in records if r.get("kind") == "run" ]
+    sections = []
+    rows = []
+    for r in runs:
+        S, ok = _sections(r["output"])
+        sections.append(S)
+        status = r["status"]
+        if status == 0 and not ok:
+            status = 3
+        rows.append( (r["if_id"], status, r["exit_code"], r["servertime"],
+                      get_rungroup(r)) )
+    wrinfo_ids = _insert_runs(cursor, rows)
+
+    # The rows of the other tables, the edges and the rollups
+    cursor.execute("SELECT id, survey_type FROM radio_if")
+    survey_types = dict(cursor)
+    errors, meta, ifaces, scans, surveys = [], [], [], [], []
+    meta_cols = sorted(run_wrinfo._meta_cols)
+    if_cols = sorted(run_wrinfo._ifinfo_cols)
+    scan_cols = sorted(run_wrinfo._scan_cols)
+    survey_cols = sorted(run_wrinfo._survey_cols)
+    edges = {}
+    slices, hists = {}, {}
+    prev = {}
+    for (r, S, wrinfo_id) in zip(runs, sections, wrinfo_ids):
+        if_id, servertime = r["if_id"], r["servertime"]
+        errors += [ (wrinfo_id, l) for l in r["stderr"].split('\n')
+                    if l != "" ]
+        if "meta" in S:
+            meta.append( (wrinfo_id,) + tuple(S["meta"].get(k)
+                                              for k in meta_cols) )
+        if "interface" in S:
+            ifaces.append( (wrinfo_id,) + tuple(S["interface"].get(k)
+                                                for k in if_cols) )
+        if "scan" in S:
+            scans += [ (wrinfo_id, servertime) + tuple(E.get(k)
+                                                       for k in scan_cols)
+                       for E in S["scan"] ]
+            mac = S.get("interface", {}).get("mac")
+            if mac is not None:
+                for bssid in set(E.get("bssid") for E in S["scan"]) - {None}:
+                    e = edges.get( (mac, bssid) )
+                    if e is None:
+                        edges[(mac, bssid)] = [ servertime, servertime, 1 ]
+                    else:
+                        e[0] = min(e[0], servertime)
+                        e[1] = max(e[1], servertime)
+                        e[2] += 1
+        if "survey" in S:
+            survey = S["survey"]
+            surveys += [ (wrinfo_id, servertime) + tuple(E.get(k)
+                                                         for k in survey_cols)
+                         for E in survey ]
+            survey_type = survey_types.get(if_id)
+            if if_id not in prev:
+                prev[if_id] = {}
+                if survey_type == 1:
+                    prev[if_id] = rollup.get_previous_survey(cursor, if_id,
+                                                             wrinfo_id)
+            rollup.accumulate(slices, survey_type, if_id, servertime,
+                              survey, prev[if_id])
+            rollup.accumulate_tx_hist(hists, survey_type, if_id, servertime,
+                                      survey, prev[if_id])
+            prev[if_id] = dict((E["frequency"], E) for E in survey
+                               if E.get("frequency") is not None)
+
+    _load_data(cursor, "wrinfo_errors", ("wrinfo_id", "msg"), errors, tmpdir)
+    _load_data(cursor, "wrinfo_meta", [ "wrinfo_id" ] + meta_cols, meta,
+               tmpdir)
+    _load_data(cursor, "wrinfo_interface", [ "wrinfo_id" ] + if_cols, ifaces,
+               tmpdir)
+    _load_data(cursor, "wrinfo_scan",
+               [ "wrinfo_id", "servertime" ] + scan_cols, scans, tmpdir)
+    _load_data(cursor, "wrinfo_survey",
+               [ "wrinfo_id", "servertime" ] + survey_cols, surveys, tmpdir)
+    if len(edges) > 0:
+        cursor.executemany(
+          "INSERT INTO wrinfo_edge"
+          + " (mac, bssid, first_seen, last_seen, sightings)"
+          + " VALUES (%s, %s, %s, %s, %s)"
+          + " ON DUPLICATE KEY UPDATE"
+          + " last_seen = GREATEST(last_seen, VALUES(last_seen)),"
+          + " sightings = sightings + VALUES(sightings)",
+          [ key + tuple(v) for (key, v) in sorted(edges.items()) ])
+    rollup.write_slices(cursor, slices)
+    rollup.write_tx_hist(cursor, hists)
+
+    conn.commit()
+    rungroup_ids.update(new_ids)
+    for row in rows:
+        metrics.registry.add("wrinfo_runs_total", status=row[1])
+    if n_bad > 0:
+        metrics.registry.add("spool_records_bad_total", n_bad)
+    return len(runs)
+
+def _rollback(conn):
+    try:
+        conn.rollback()
+    except db.Error:
+        pass
+
+def load_spool(conn, cursor, path, tmpdir=None, rungroup_ids=None):
+    """Claim the spool file at path and load it, along with the claimed
+    files left by earlier loads that failed.
+
+    The rungroups are resolved across the files, and, if rungroup_ids
+    is given (see load()), across the calls; its rungroups older than
+    _rungroup_keep are dropped.
+
+    On a DB error, or an error reading the file or writing the
+    temporary files, the file is kept and the load stops, to be
+    retried.  A file whose rows the DB refuses is renamed from .load to
+    .bad, and the load goes on with the next file.
+
+    @return True if all the files were loaded.
+    """
+    if rungroup_ids is None:
+        rungroup_ids = {}
+    cutoff = time.time() - _rungroup_keep
+    for (spool_id, (db_id, servertime)) in list(rungroup_ids.items()):
+        if servertime < cutoff:
+            del rungroup_ids[spool_id]
+
+    ok = True
+    for claimed in spool.claim(path):
+        t0 = time.monotonic()
+        try:
+            with metrics.registry.timer("spool_load"):
+                n = load(conn, cursor, spool.read(claimed), tmpdir,
+                         rungroup_ids)
+        except _bad_file_errors as e:
+            _rollback(conn)
+            bad = claimed[:-len(".load")] + ".bad"
+            os.rename(claimed, bad)
+            metrics.registry.add("spool_files_bad_total")
+            sys.stderr.write("Error:  Loading %s failed: %s: %s;"
+                             " moved to %s\n"
+                             % (claimed, type(e).__name__, e, bad))
+            ok = False
+            continue
+        except (db.Error, OSError) as e:
+            _rollback(conn)
+            sys.stderr.write("Error:  Loading %s failed: %s\n" % (claimed, e))
+            return False
+        os.remove(claimed)
+        metrics.registry.add("spool_runs_loaded_total", n)
+        print("Loaded %d runs from %s in %.1fs."
+              % (n, claimed, time.monotonic() - t0))
+    return ok
+
+def usage():
+    print(  "load_spool\n"
+            "\n"
+            "utility to load the wrinfo results spooled by run_wrinfo -S\n"
+            "into the database\n"
+            "\n"
+            "   -h         display help and exit\n"
+            "   -d <name>  connect to database with given name [wifispecman]\n"
+            "   -S <file>  spool file to load\n"
+            "   -l #       keep running, loading the spool every # seconds\n"
+            "   -D <dir>   directory for the temporary LOAD DATA files\n"
+            "   -m <file>  write metrics to the file, see run_wrinfo.py\n"
+    )
+
+if __name__ == "__main__":
+    import getopt
+
+    # Default settings
+    dbname = "wifispecman"
+    spool_path = None
+    interval = 0
+    tmpdir = None
+    metrics_path = None
+
+    # Parse cmdline args
+    opts, args = getopt.getopt(sys.argv[1:], "hd:S:l:D:m:")
+    for k, v in opts:
+        if k == '-h':
+            usage()
+            sys.exit(0)
+        elif k == '-d':
+            dbname = v
+        elif k == '-S':
+            spool_path = v
+        elif k == '-l':
+            interval = float(v)
+        elif k == '-D':
+            tmpdir = v
+        elif k == '-m':
+            metrics_path = v
+        else:
+            sys.exit(1)
+
+    if spool_path is None:
+        sys.stderr.write("Error:  Missing spool file (specify it with -S)\n")
+        sys.exit(1)
+
+    rungroup_ids = {}
+    while True:
+        t_start = time.monotonic()
+        ok = False
+        try:
+            conn = db.connect(user='wifispecman',
+                              password='password',
+                              database=dbname,
+                              allow_local_infile=True)
+        except db.Error as e:
+            sys.stderr.write("Error:  Can't connect to the DB: %s\n" % (e,))
+        else:
+            cursor = metrics.CountingCursor(conn.cursor())
+            ok = load_spool(conn, cursor, spool_path, tmpdir, rungroup_ids)
+            conn.close()
+        if metrics_path is not None:
+            metrics.registry.write(metrics_path, program="load_spool")
+        if interval <= 0:
+            sys.exit(0 if ok else 1)
+        time.sleep(max(0, interval - (time.monotonic() - t_start)))
@@ -0,0 +1,183 @@
+"""
+Run metrics.
+
+Counters and timers recorded during a run of run_wrinfo.py or
+optimizer.py:  the time spent in SSH, JSON parsing, DB inserts and the
+collector functions, the number of SQL statements and rows, the solver
+iterations and the best score found over time.  At the end of the run,
+they are written either in the Prometheus text format (to be picked up
+by the node_exporter textfile collector) or as one JSON line appended
+to a log, so that slow APs and runaway queries can be alerted on.
+
+The metrics are recorded into the module level registry, so that the
+instrumented functions need no extra parameters.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+def _key(name, labels):
+    return (name, tuple(sorted((k, str(v)) for (k, v) in labels.items())))
+
+class Metrics(object):
+    """Registry of named, labeled values and time series.
+
+    Values are counters or gauges; series are lists of (t, value)
+    points, with t the number of seconds since the registry was
+    created.  Series are only included in the JSON output.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.values = {}
+        self.series = {}
+        self._t0 = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, name, value=1, **labels):
+        """Add value to a counter."""
+        key = _key(name, labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge."""
+        with self._lock:
+            self.values[_key(name, labels)] = value
+
+    def point(self, name, value, **labels):
+        """Append a point to a series."""
+        t = time.monotonic() - self._t0
+        with self._lock:
+            self.series.setdefault(_key(name, labels), []) \
+                .append( (t, value) )
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Time a block; adds to the <name>_seconds_total and
+        <name>_calls_total counters."""
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name + "_seconds_total", time.monotonic() - t0,
+                     **labels)
+            self.add(name + "_calls_total", 1, **labels)
+
+    def dump(self):
+        """Return the contents as a picklable, JSON serializable list."""
+        with self._lock:
+            return [ [ "value", name, dict(labels), v ]
+                        for ((name, labels), v) in self.values.items() ] \
+                 + [ [ "series", name, dict(labels), pts ]
+                        for ((name, labels), pts) in self.series.items() ]
+
+    def merge(self, dump, **labels):
+        """Add the contents of another registry, as returned by its
+        dump(), with the given labels added.  Counters are summed; the
+        series are appended."""
+        for (kind, name, l, v) in dump:
+            l = dict(l, **labels)
+            if kind == "value":
+                self.add(name, v, **l)
+            else:
+                with self._lock:
+                    self.series.setdefault(_key(name, l), []).extend(v)
+
+    def to_json(self, **extra):
+        D = dict(extra, start=self.start, metrics=self.dump())
+        return json.dumps(D, sort_keys=True)
+
+    def to_prometheus(self):
+        lines = []
+        last = None
+        for ((name, labels), v) in sorted(self.values.items()):
+            if name != last:
+                kind = "counter" if name.endswith("_total") else "gauge"
+                lines.append("# TYPE %s %s" % (name, kind))
+                last = name
+            if len(labels) > 0:
+                name = "%s{%s}" % (name, ",".join('%s="%s"' %
+                            (k, x.replace("\\", "\\\\").replace('"', '\\"'))
+                            for (k, x) in labels))
+            lines.append("%s %r" % (name, float(v)))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, **extra):
+        """Write the metrics to path.
+
+        If path ends in ".prom", it is replaced by the metrics in the
+        Prometheus text format; otherwise, a JSON line with the metrics
+        and the extra items is appended to it.
+        """
+        if path.endswith(".prom"):
+            tmp = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmp, "w") as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp, path)
+        else:
+            with open(path, "a") as f:
+                f.write(self.to_json(**extra) + "\n")
+
+# The metrics of this run
+registry = Metrics()
+
+def timed(name):
+    """Decorator timing each call of a function into the registry, with
+    the function name as the function label."""
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with registry.timer(name, function=f.__qualname__):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorate
+
+class CountingCursor(object):
+    """Cursor wrapper counting the SQL statements executed and the rows
+    read or written, by kind of statement (select, insert, ...), into
+    the registry."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self._kind = None
+
+    def _count(self, sql, rows):
+        self._kind = sql.split(None, 1)[0].lower() if sql.strip() else ""
+        registry.add("sql_statements_total", kind=self._kind)
+        if rows is not None:
+            registry.add("sql_rows_total", rows, kind=self._kind)
+
+    def execute(self, sql, params=None):
+        if params is None:
+            ret = self.cursor.execute(sql)
+        else:
+            ret = self.cursor.execute(sql, params)
+        rowcount = getattr(self.cursor, "rowcount", -1)
+        self._count(sql, rowcount if sql.lstrip()[:6].lower() != "select"
+                                     and rowcount >= 0 else None)
+        return ret
+
+    def executemany(self, sql, seq):
+        seq = list(seq)
+        ret = self.cursor.executemany(sql, seq)
+        self._count(sql, len(seq))
+        return ret
+
+    def __iter__(self):
+        kind, rows = self._kind, 0
+        try:
+            for row in self.cursor:
+                rows += 1
+                yield row
+        finally:
+            registry.add("sql_rows_total", rows, kind=kind)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+# vim:sts=4:et
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+"""
+Schema migrations.
+
+create_tables.sh creates the tables with their primary keys only.  The
+changes to the schema made since are kept here as a list of numbered
+migrations; the schema_version table records which of them have been
+applied to a database, so that running this utility brings any database
+up to date.
+
+The utility can also check, with EXPLAIN PARTITIONS, whether the
+queries the collector makes are served by indexes, or need to scan
+tables whose size grows with the history, and whether they read only
+the partitions of their time window.
+"""
+
+import os
+import sys
+import time
+
+import mysql.connector as db
+
+# The migrations, as tuples (version, description, statements), in the
+# order they are to be applied.
+migrations = [
+  (1, "indexes for the collector queries", [
+    # Runs of an interface in a time window (ChannelStatsRows,
+    # SurveyData, get_tx_value, get_current_frequencies), and the
+    # latest run of an interface (rollup.get_previous_survey).
+    "CREATE INDEX wrinfo_radio_if_time ON wrinfo"
+    " (radio_if_id, servertime, wrinfo_id)",
+    "CREATE INDEX wrinfo_radio_if_id ON wrinfo (radio_if_id, wrinfo_id)",
+    # Runs in a time window, regardless of the interface
+    # (rollup.rebuild_slices).
+    "CREATE INDEX wrinfo_servertime ON wrinfo (servertime)",
+    # The survey entries of a run, with the columns filtered on.
+    "CREATE INDEX wrinfo_survey_wrinfo_id ON wrinfo_survey"
+    " (wrinfo_id, frequency, in_use)",
+    # The scan results of a run (get_graph); covers the query.
+    "CREATE INDEX wrinfo_scan_wrinfo_id ON wrinfo_scan (wrinfo_id, bssid)",
+  ]),
+  (2, "partition wrinfo_survey and wrinfo_scan by servertime", [
+    # The servertime of the run is copied into the rows, as the
+    # partitioning key.  It has to be part of every unique key.
+    "ALTER TABLE wrinfo_survey ADD COLUMN servertime BIGINT NOT NULL"
+    " DEFAULT 0",
+    "UPDATE wrinfo_survey, wrinfo SET wrinfo_survey.servertime ="
+    " wrinfo.servertime WHERE wrinfo_survey.wrinfo_id = wrinfo.wrinfo_id",
+    "ALTER TABLE wrinfo_survey DROP PRIMARY KEY, DROP INDEX id,"
+    " ADD PRIMARY KEY (id, servertime)",
+    "ALTER TABLE wrinfo_survey PARTITION BY RANGE (servertime)"
+    " (PARTITION p_future VALUES LESS THAN MAXVALUE)",
+    "ALTER TABLE wrinfo_scan ADD COLUMN servertime BIGINT NOT NULL"
+    " DEFAULT 0",
+    "UPDATE wrinfo_scan, wrinfo SET wrinfo_scan.servertime ="
+    " wrinfo.servertime WHERE wrinfo_scan.wrinfo_id = wrinfo.wrinfo_id",
+    "ALTER TABLE wrinfo_scan DROP PRIMARY KEY, DROP INDEX id,"
+    " ADD PRIMARY KEY (id, servertime)",
+    "ALTER TABLE wrinfo_scan PARTITION BY RANGE (servertime)"
+    " (PARTITION p_future VALUES LESS THAN MAXVALUE)",
+  ]),
+  (3, "wrinfo_edge table of the interference graph", [
+    # Maintained by run_wrinfo as scans arrive; get_graph reads the
+    # edges seen in a time window off the last_seen index.
+    """CREATE TABLE wrinfo_edge
+        (mac VARCHAR(18),
+        bssid VARCHAR(18),
+        first_seen BIGINT,
+        last_seen BIGINT,
+        sightings INT,
+        PRIMARY KEY (mac, bssid),
+        INDEX wrinfo_edge_last_seen (last_seen, mac, bssid))""",
+    """INSERT INTO wrinfo_edge
+        (mac, bssid, first_seen, last_seen, sightings)
+        SELECT mac, bssid, MIN(wrinfo_scan.servertime),
+          MAX(wrinfo_scan.servertime), COUNT(DISTINCT wrinfo_scan.wrinfo_id)
+        FROM wrinfo_interface, wrinfo_scan
+        WHERE wrinfo_interface.wrinfo_id = wrinfo_scan.wrinfo_id
+        AND mac IS NOT NULL
+        AND bssid IS NOT NULL
+        GROUP BY mac, bssid""",
+  ]),
+  (4, "wrinfo_tx_hist table of TX fraction histograms", [
+    # Maintained by run_wrinfo along with the slices; SliceData sums
+    # the counts of a time window per radio and bin.  Backfilled by
+    # rollup.py.
+    """CREATE TABLE wrinfo_tx_hist
+        (radio_if_id INT,
+        frequency INT,
+        bucket_start BIGINT,
+        bin SMALLINT,
+        count INT,
+        PRIMARY KEY (radio_if_id, frequency, bucket_start, bin))""",
+  ]),
+]
+
+# Tables whose size grows with the history; scanning these in full is
+# what the check reports.
+_history_tables = ( "wrinfo", "wrinfo_meta", "wrinfo_interface",
+                    "wrinfo_scan", "wrinfo_survey", "wrinfo_slice",
+                    "wrinfo_errors", "wrinfo_edge", "wrinfo_tx_hist" )
+
+def get_version(conn, cursor):
+    """Get the schema version of the database, creating the
+    schema_version table if needed."""
+    cursor.execute("""CREATE TABLE IF NOT EXISTS schema_version
+        (version INT UNIQUE PRIMARY KEY,
+        description VARCHAR(128),
+        servertime BIGINT)""")
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    v = list(cursor)[0][0]
+    return 0 if v is None else v
+
+def migrate(conn, cursor, target=None, verbose=True):
+    """Apply the migrations not applied yet, up to version target.
+
+    The DDL statements of MariaDB commit implicitly, so a migration
+    that fails halfway is not rolled back; the statements it did
+    complete need to be undone by hand before retrying.
+
+    @return the schema version after migrating.
+    """
+    version = get_version(conn, cursor)
+    for (v, description, statements) in migrations:
+        if v <= version or (target is not None and v > target):
+            continue
+        if verbose:
+            print("Migrating to version %d: %s" % (v, description))
+        t0 = time.monotonic()
+        for sql in statements:
+            cursor.execute(sql)
+        cursor.execute("INSERT INTO schema_version"
+                       " (version, description, servertime)"
+                       " VALUES (%s, %s, %s)",
+                       (v, description, int(time.time())))
+        conn.commit()
+        if verbose:
+            print("  done in %.1fs" % (time.monotonic() - t0,))
+        version = v
+    return version
+
+class _RecordingCursor(object):
+    """Cursor wrapper recording the statements executed."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append( (sql, params) )
+        if params is None:
+            return self.cursor.execute(sql)
+        return self.cursor.execute(sql, params)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+def collector_queries(conn, cursor, channels):
+    """Run the collector on the database, recording its queries.
+
+    @return list of tuples (name, sql, params), one for each distinct
+            query.
+    """
+    sys.path.insert(1, os.path.join(os.path.dirname(
+                            os.path.abspath(__file__)), "..", "optimizer"))
+    import collector
+
+    rec = _RecordingCursor(cursor)
+    ret = []
+    def run(name, f):
+        rec.statements = []
+        result = f()
+        for (sql, params) in rec.statements:
+            if (name, sql, params) not in ret:
+                ret.append( (name, sql, params) )
+        return result
+
+    nodes = run("get_nodes", lambda: collector.get_nodes(conn, rec))
+    if_ids = [ ifid for (ifid, mac) in nodes ]
+    time_cutoff = collector.get_time_cutoff()
+    run("get_graph", lambda: collector.get_graph(conn, rec, nodes))
+    run("get_current_frequencies",
+        lambda: collector.get_current_frequencies(conn, rec, nodes))
+    run("SurveyData", lambda: collector.SurveyData(conn, rec, if_ids,
+                                                   channels, time_cutoff))
+    run("SliceData", lambda: collector.SliceData(conn, rec, if_ids,
+                                                 channels, time_cutoff))
+    if len(nodes) > 0 and len(channels) > 0:
+        run("ChannelStatsRows", lambda: collector.ChannelStatsRows(conn,
+                rec, if_ids[0], channels[0], time_cutoff))
+        run("get_tx_value",
+            lambda: collector.get_tx_value(conn, rec, nodes, 0))
+    return ret
+
+def explain(cursor, sql, params=None):
+    """EXPLAIN a query.
+
+    @return list of tuples (table, access type, key, rows, partitions),
+            one per table accessed; the access type is None unless it's
+            a full table ("ALL") or full index ("index") scan of a
+            history table, and partitions is the list of the partitions
+            read, None if the table isn't partitioned.
+    """
+    cursor.execute("EXPLAIN PARTITIONS " + sql.strip().rstrip(";"), params)
+    cols = cursor.column_names
+    ret = []
+    for row in list(cursor):
+        r = dict(zip(cols, row))
+        scan = None
+        if r["table"] in _history_tables and r["type"] in ("ALL", "index"):
+            scan = r["type"]
+        partitions = r.get("partitions")
+        if partitions is not None:
+            partitions = partitions.split(",")
+        ret.append( (r["table"], scan, r["key"], r["rows"], partitions) )
+    return ret
+
+def check(conn, cursor, channels):
+    """Report whether the collector queries are served by indexes, and
+    read only the partitions of their time window.
+
+    @return True if none of them scans a history table in full, or
+            reads all the partitions of a table that has more than one.
+    """
+    import retention
+
+    n_partitions = {}
+    all_ok = True
+    for (name, sql, params) in collector_queries(conn, cursor, channels):
+        plan = explain(cursor, sql, params)
+        ok = True
+        lines = []
+        for (table, scan, key, rows, partitions) in plan:
+            pruned = ""
+            if partitions is not None:
+                if table not in n_partitions:
+                    n_partitions[table] = \
+                        len(retention.get_partitions(cursor, table))
+                n = n_partitions[table]
+                pruned = "partitions=%d/%d" % (len(partitions), n)
+                if len(partitions) == n and n > 1:
+                    ok = False
+                    pruned += " (not pruned)"
+            ok = ok and scan is None
+            lines.append("    %-18s %-12s key=%s rows=%s %s" % (table,
+                    "full " + ("table" if scan == "ALL" else "index")
+                        if scan is not None else "",
+                    key, rows, pruned))
+        all_ok = all_ok and ok
+        print("%-24s %s" % (name, "ok" if ok else "SCAN"))
+        for l in lines:
+            print(l.rstrip())
+    return all_ok
+
+def usage():
+    print(  "migrate\n"
+            "\n"
+            "utility to bring the database schema up to date, and to check\n"
+            "that the collector queries are served by indexes\n"
+            "\n"
+            "   -h         display help and exit\n"
+            "   -d <name>  connect to database with given name [wifispecman]\n"
+            "   -v #       migrate up to the given version only\n"
+            "   -n         don't migrate, only print the schema version\n"
+            "   -c         EXPLAIN the collector queries, reporting those\n"
+            "              that scan history tables or all their\n"
+            "              partitions in full\n"
+            "   -f #       channel frequencies for -c, comma separated\n"
+            "              [5180,5200,5220]\n"
+    )
+
+if __name__ == "__main__":
+    import getopt
+
+    # Default settings
+    dbname = "wifispecman"
+    target = None
+    do_migrate = True
+    do_check = False
+    channels = [ 5180, 5200, 5220 ]
+
+    # Parse cmdline args
+    opts, args = getopt.getopt(sys.argv[1:], "hd:v:ncf:")
+    for k, v in opts:
+        if k == '-h':
+            usage()
+            sys.exit(0)
+        elif k == '-d':
+            dbname = v
+        elif k == '-v':
+            target = int(v)
+        elif k == '-n':
+            do_migrate = False
+        elif k == '-c':
+            do_check = True
+        elif k == '-f':
+            channels = [ int(x) for x in v.split(",") ]
+        else:
+            sys.exit(1)
+
+    conn = db.connect(user='wifispecman',
+                      password='password',
+                      database=dbname)
+    cursor = conn.cursor()
+    if do_migrate:
+        version = migrate(conn, cursor, target)
+    else:
+        version = get_version(conn, cursor)
+    print("Schema version %d (latest %d)" % (version, migrations[-1][0]))
+    ok = True
+    if do_check:
+        ok = check(conn, cursor, channels)
+    conn.close()
+    sys.exit(0 if ok else 2)
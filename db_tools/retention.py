@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+"""
+Retention of the survey and scan data.
+
+The wrinfo_survey and wrinfo_scan tables are partitioned by servertime
+into one partition per day (UTC), plus a catch-all p_future partition
+(see migration 2 in migrate.py).  This utility, meant to be run daily,
+
+  (1) splits the days ahead off p_future, so that new rows land in
+      daily partitions;
+
+  (2) compacts the slices of the wrinfo_slice table older than a given
+      age into coarse slices of coarse_length seconds, and the TX
+      fraction histograms of the wrinfo_tx_hist table into buckets of
+      tx_hist_coarse_length seconds, so that the collector's slice
+      rollups (collector.py -R) cover long history windows with a
+      bounded number of rows;
+
+  (3) drops the daily partitions of raw survey and scan data older than
+      their retention periods, which is cheap compared to deleting the
+      rows one by one.
+
+The slice rollups must be up to date (see rollup.py) before the raw
+survey data is dropped, as they're not rebuilt from it afterwards.
+"""
+
+import sys
+import time
+
+import mysql.connector as db
+
+import rollup
+
+# Length of the coarse slices, in seconds.  Must be a multiple of
+# rollup.slice_length.
+coarse_length = 3600
+
+# Length of the coarse TX fraction histogram buckets, in seconds.  Must
+# be a multiple of rollup.tx_hist_length.
+tx_hist_coarse_length = 86400
+
+_day = 86400
+
+def _partition_name(day_start):
+    return "p" + time.strftime("%Y%m%d", time.gmtime(day_start))
+
+def get_partitions(cursor, table):
+    """Get the partitions of a table.
+
+    @return list of tuples (name, bound), in order; bound is the
+            VALUES LESS THAN value, None for MAXVALUE.
+    """
+    cursor.execute("""SELECT partition_name, partition_description
+    FROM information_schema.partitions
+    WHERE table_schema = DATABASE()
+    AND table_name = %s
+    AND partition_name IS NOT NULL
+    ORDER BY partition_ordinal_position""", (table,))
+    ret = []
+    for (name, bound) in list(cursor):
+        ret.append( (name, None if bound == "MAXVALUE" else int(bound)) )
+    return ret
+
+def add_partitions(cursor, table, until, verbose=True):
+    """Split daily partitions off p_future, up to time until.
+
+    The first run on a table also splits the existing rows into daily
+    partitions.
+    """
+    bounds = [ b for (name, b) in get_partitions(cursor, table)
+               if b is not None ]
+    if len(bounds) > 0:
+        start = bounds[-1]
+    else:
+        cursor.execute("SELECT MIN(servertime) FROM %s WHERE servertime > 0"
+                       % (table,))
+        first = list(cursor)[0][0]
+        start = int(time.time()) if first is None else first
+        start -= start % _day
+    parts = []
+    while start < until:
+        parts.append("PARTITION %s VALUES LESS THAN (%d)" %
+                     (_partition_name(start), start + _day))
+        start += _day
+    if len(parts) == 0:
+        return
+    if verbose:
+        print("%s: adding %d partitions" % (table, len(parts)))
+    cursor.execute("ALTER TABLE %s REORGANIZE PARTITION p_future INTO (%s,"
+                   " PARTITION p_future VALUES LESS THAN MAXVALUE)"
+                   % (table, ", ".join(parts)))
+
+def drop_partitions(cursor, table, time_cutoff, verbose=True):
+    """Drop the partitions holding only rows older than time_cutoff."""
+    names = [ name for (name, b) in get_partitions(cursor, table)
+              if b is not None and b <= time_cutoff ]
+    if len(names) == 0:
+        return
+    if verbose:
+        print("%s: dropping partitions %s" % (table, ", ".join(names)))
+    cursor.execute("ALTER TABLE %s DROP PARTITION %s"
+                   % (table, ", ".join(names)))
+
+def compact_slices(conn, cursor, time_cutoff, verbose=True):
+    """Merge the slices older than time_cutoff into coarse slices.
+
+    The totals of the slices are added up into the slice starting at
+    the beginning of their coarse slice; the others are deleted.
+    """
+    time_cutoff -= time_cutoff % coarse_length
+    cols = rollup._slice_cols
+    cursor.execute("""INSERT INTO wrinfo_slice
+      (radio_if_id, frequency, slice_start, %s)
+    SELECT radio_if_id, frequency, slice_start - slice_start %% %d, %s
+    FROM wrinfo_slice
+    WHERE slice_start < %d
+    AND slice_start %% %d != 0
+    GROUP BY radio_if_id, frequency, slice_start - slice_start %% %d
+    ON DUPLICATE KEY UPDATE %s""" % (
+        ", ".join(cols),
+        coarse_length, ", ".join("SUM(%s)" % (c,) for c in cols),
+        time_cutoff, coarse_length, coarse_length,
+        ", ".join("%s = %s + VALUES(%s)" % (c, c, c) for c in cols)))
+    cursor.execute("""DELETE FROM wrinfo_slice
+    WHERE slice_start < %d
+    AND slice_start %% %d != 0""" % (time_cutoff, coarse_length))
+    if verbose:
+        print("wrinfo_slice: compacted %d slices" % (cursor.rowcount,))
+    conn.commit()
+
+def compact_tx_hist(conn, cursor, time_cutoff, verbose=True):
+    """Merge the TX fraction histograms older than time_cutoff into
+    coarse buckets.
+
+    Histograms merge exactly:  the counts of each bin are added up into
+    the bucket starting at the beginning of their coarse bucket; the
+    others are deleted.
+    """
+    time_cutoff -= time_cutoff % tx_hist_coarse_length
+    cursor.execute("""INSERT INTO wrinfo_tx_hist
+      (radio_if_id, frequency, bucket_start, bin, count)
+    SELECT radio_if_id, frequency, bucket_start - bucket_start %% %d, bin,
+      SUM(count)
+    FROM wrinfo_tx_hist
+    WHERE bucket_start < %d
+    AND bucket_start %% %d != 0
+    GROUP BY radio_if_id, frequency, bucket_start - bucket_start %% %d, bin
+    ON DUPLICATE KEY UPDATE count = count + VALUES(count)""" % (
+        tx_hist_coarse_length, time_cutoff, tx_hist_coarse_length,
+        tx_hist_coarse_length))
+    cursor.execute("""DELETE FROM wrinfo_tx_hist
+    WHERE bucket_start < %d
+    AND bucket_start %% %d != 0""" % (time_cutoff, tx_hist_coarse_length))
+    if verbose:
+        print("wrinfo_tx_hist: compacted %d histogram bins"
+              % (cursor.rowcount,))
+    conn.commit()
+
+def run_retention(conn, cursor, survey_days, scan_days, compact_days,
+  days_ahead=3, verbose=True):
+    """Run all the retention steps.
+
+    @param  survey_days, scan_days
+            number of days to keep the raw survey and scan data.
+
+    @param  compact_days
+            age in days from which on the slices and the TX fraction
+            histograms are compacted.
+
+    @param  days_ahead
+            number of days to create partitions ahead of time for.
+    """
+    now = int(time.time())
+    for table in ("wrinfo_survey", "wrinfo_scan"):
+        if len(get_partitions(cursor, table)) == 0:
+            sys.stderr.write("Error:  Table %s is not partitioned; run"
+                " migrate.py first.\n" % (table,))
+            return False
+    for table in ("wrinfo_survey", "wrinfo_scan"):
+        add_partitions(cursor, table, now + days_ahead * _day, verbose)
+    compact_slices(conn, cursor, int(now - compact_days * _day), verbose)
+    compact_tx_hist(conn, cursor, int(now - compact_days * _day), verbose)
+    drop_partitions(cursor, "wrinfo_survey", now - survey_days * _day,
+                    verbose)
+    drop_partitions(cursor, "wrinfo_scan", now - scan_days * _day, verbose)
+    return True
+
+def usage():
+    print(  "retention\n"
+            "\n"
+            "utility to drop old raw survey and scan data, and compact old\n"
+            "slice rollups and TX fraction histograms; to be run daily\n"
+            "\n"
+            "   -h         display help and exit\n"
+            "   -d <name>  connect to database with given name [wifispecman]\n"
+            "   -r #       days to keep the raw survey data [7]\n"
+            "   -s #       days to keep the scan data [30]\n"
+            "   -c #       days after which to compact the slice rollups\n"
+            "              into %d second slices, and the TX fraction\n"
+            "              histograms into %d second buckets [7]\n"
+            % (coarse_length, tx_hist_coarse_length)
+    )
+
+if __name__ == "__main__":
+    import getopt
+
+    # Default settings
+    dbname = "wifispecman"
+    survey_days = 7
+    scan_days = 30
+    compact_days = 7
+
+    # Parse cmdline args
+    opts, args = getopt.getopt(sys.argv[1:], "hd:r:s:c:")
+    for k, v in opts:
+        if k == '-h':
+            usage()
+            sys.exit(0)
+        elif k == '-d':
+            dbname = v
+        elif k == '-r':
+            survey_days = float(v)
+        elif k == '-s':
+            scan_days = float(v)
+        elif k == '-c':
+            compact_days = float(v)
+        else:
+            sys.exit(1)
+
+    conn = db.connect(user='wifispecman',
+                      password='password',
+                      database=dbname)
+    cursor = conn.cursor()
+    ok = run_retention(conn, cursor, survey_days, scan_days, compact_days)
+    conn.close()
+    sys.exit(0 if ok else 1)
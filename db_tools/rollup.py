@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+
+"""
+Survey slice rollups.
+
+The wrinfo_slice table holds the survey data aggregated into fixed
+slices of slice_length seconds, keyed by (radio_if_id, frequency,
+slice_start).  For each slice it holds the totals of the measurement
+time and of the busy, rx and tx times, together with the measurement
+time over which each of these was valid.  For survey_type 1, the totals
+are the differences of consecutive counter values; for survey_type 2,
+they are plain sums.
+
+The wrinfo_tx_hist table holds, for each radio, frequency and time
+bucket of tx_hist_length seconds, a histogram of the TX fractions of
+the runs where the frequency was in use, the same fractions the
+collector's get_tx_value() takes a quantile of.  Histograms are merged
+by adding up their counts, so the quantile over any range of buckets
+is found from a GROUP BY query without reading the raw rows.
+
+run_wrinfo updates the rollups as data arrives.  This module is also a
+standalone utility to rebuild the rollups from the raw wrinfo_survey
+rows, e.g. to backfill after creating the tables.
+"""
+
+import sys
+import time
+
+import mysql.connector as db
+
+# Length of a slice in seconds.  Must match collector.slice_length.
+slice_length = 300
+
+# Length of the time buckets of the TX fraction histograms, in seconds.
+# Must match collector.tx_hist_length.
+tx_hist_length = 3600
+
+# Resolution of the TX fraction histograms:  a TX fraction f (clamped
+# to [0, 1]) is counted in bin round(f * tx_hist_bins).  Must match
+# collector.tx_hist_bins.
+tx_hist_bins = 1000
+
+# Columns of the wrinfo_slice table, besides the key
+_slice_cols = ( "samples", "in_use", "time", "busy", "busy_time",
+                "rx", "rx_time", "tx", "tx_time" )
+
+def get_survey_type(cursor, radio_if_id):
+    cursor.execute("SELECT survey_type FROM radio_if WHERE id=%s",
+                    (radio_if_id,))
+    return list(cursor)[0][0]
+
+def get_previous_survey(cursor, radio_if_id, wrinfo_id):
+    """Get the survey of the last run of radio_if_id before wrinfo_id.
+
+    @return dict frequency -> survey entry dict.
+    """
+    cursor.execute("""SELECT frequency, in_use, time, busy, rx, tx
+    FROM wrinfo_survey
+    WHERE wrinfo_id = (SELECT MAX(wrinfo.wrinfo_id)
+        FROM wrinfo, wrinfo_survey
+        WHERE wrinfo.wrinfo_id = wrinfo_survey.wrinfo_id
+        AND radio_if_id = %s
+        AND wrinfo.wrinfo_id < %s)""", (radio_if_id, wrinfo_id))
+    prev = {}
+    for (freq, in_use, t, busy, rx, tx) in cursor:
+        prev[freq] = { "in_use": in_use, "time": t, "busy": busy, "rx": rx,
+                       "tx": tx }
+    return prev
+
+def _survey_entry_values(survey_type, entry, prev):
+    """Compute what one survey entry adds to its slice.
+
+    @param  entry
+            survey entry dict, as output by wrinfo.
+
+    @param  prev
+            the previous entry of the same radio and frequency, or None.
+            Only used for survey_type 1.
+
+    @return list of values, in the order of _slice_cols.
+    """
+    ret = [ 1, 1 if entry.get("in_use") else 0 ] + 7 * [ 0 ]
+    t = entry.get("time")
+    if t is None:
+        return ret
+    if survey_type == 1:
+        if prev is None or prev.get("time") is None:
+            return ret
+        t -= prev["time"]
+        if t <= 0:
+            return ret
+    elif survey_type != 2:
+        return ret
+    ret[2] = t
+    for (i, key) in ((3, "busy"), (5, "rx"), (7, "tx")):
+        v = entry.get(key)
+        if v is None:
+            continue
+        if survey_type == 1:
+            if prev.get(key) is None:
+                continue
+            v -= prev[key]
+        ret[i] = v
+        ret[i + 1] = t
+    return ret
+
+def accumulate(slices, survey_type, radio_if_id, servertime, survey, prev):
+    """Add the survey of one wrinfo run to the slices.
+
+    @param  slices
+            dict (radio_if_id, frequency, slice_start) -> list of values
+            in the order of _slice_cols.  Updated in place.
+
+    @param  survey
+            list of survey entry dicts, as output by wrinfo.
+
+    @param  prev
+            the survey of the previous run of the same radio, as a dict
+            frequency -> survey entry.
+    """
+    slice_start = servertime - servertime % slice_length
+    for entry in survey:
+        freq = entry.get("frequency")
+        if freq is None:
+            continue
+        v = _survey_entry_values(survey_type, entry, prev.get(freq))
+        key = (radio_if_id, freq, slice_start)
+        acc = slices.get(key)
+        if acc is None:
+            slices[key] = v
+        else:
+            for i in range(len(v)):
+                acc[i] += v[i]
+
+def _tx_fraction(survey_type, entry, prev):
+    """Compute the TX fraction of an in-use survey entry.
+
+    This is the value collector._get_tx_fractions() computes for the
+    entry; for survey_type 1, the counters are differenced with prev,
+    which needs to have been in use on the same frequency.
+
+    @return the TX fraction, or None if there is none.
+    """
+    t, tx = entry.get("time"), entry.get("tx")
+    if t is None or tx is None:
+        return None
+    if survey_type == 1:
+        if prev is None or not prev.get("in_use") \
+          or prev.get("time") is None or prev.get("tx") is None:
+            return None
+        if t <= prev["time"]:
+            return None
+        return (tx - prev["tx"]) / float(t - prev["time"])
+    elif survey_type == 2:
+        if t == 0:
+            return None
+        return tx / t
+    return None
+
+def accumulate_tx_hist(hists, survey_type, radio_if_id, servertime, survey,
+  prev):
+    """Add the TX fraction of one wrinfo run to the histograms.
+
+    @param  hists
+            dict (radio_if_id, frequency, bucket_start, bin) -> count.
+            Updated in place.
+
+    @param  survey, prev
+            as for accumulate().
+    """
+    bucket_start = servertime - servertime % tx_hist_length
+    for entry in survey:
+        freq = entry.get("frequency")
+        if freq is None or not entry.get("in_use"):
+            continue
+        f = _tx_fraction(survey_type, entry, prev.get(freq))
+        if f is None:
+            continue
+        b = int(round(min(1.0, max(0.0, f)) * tx_hist_bins))
+        key = (radio_if_id, freq, bucket_start, b)
+        hists[key] = hists.get(key, 0) + 1
+
+def write_tx_hist(cursor, hists):
+    """Add the histogram counts to the wrinfo_tx_hist table."""
+    if len(hists) == 0:
+        return
+    cursor.executemany("INSERT INTO wrinfo_tx_hist"
+                       " (radio_if_id, frequency, bucket_start, bin, count)"
+                       " VALUES (%s, %s, %s, %s, %s)"
+                       " ON DUPLICATE KEY UPDATE"
+                       " count = count + VALUES(count)",
+                       [ key + (n,) for key, n in hists.items() ])
+
+def write_slices(cursor, slices):
+    """Add the slices to the wrinfo_slice table."""
+    if len(slices) == 0:
+        return
+    cols = ("radio_if_id", "frequency", "slice_start") + _slice_cols
+    cmd = "INSERT INTO wrinfo_slice (%s) VALUES (%s)" \
+            " ON DUPLICATE KEY UPDATE %s" % \
+            (", ".join(cols),
+             ", ".join(len(cols) * ["%s"]),
+             ", ".join("%s = %s + VALUES(%s)" % (c, c, c)
+                        for c in _slice_cols))
+    cursor.executemany(cmd, [ key + tuple(v) for key, v in slices.items() ])
+
+def update_slices(cursor, radio_if_id, wrinfo_id, servertime, survey):
+    """Add the survey of a new wrinfo run to the rollups."""
+    survey_type = get_survey_type(cursor, radio_if_id)
+    prev = {}
+    if survey_type == 1:
+        prev = get_previous_survey(cursor, radio_if_id, wrinfo_id)
+    slices = {}
+    accumulate(slices, survey_type, radio_if_id, servertime, survey, prev)
+    write_slices(cursor, slices)
+    hists = {}
+    accumulate_tx_hist(hists, survey_type, radio_if_id, servertime, survey,
+                       prev)
+    write_tx_hist(cursor, hists)
+
+def rebuild_slices(conn, cursor, time_cutoff):
+    """Recompute all the slices and TX fraction histograms starting at or
+    after time_cutoff.
+
+    The slices and histograms older than the oldest raw survey data
+    left (see retention.py) are kept as they are.
+    """
+    time_cutoff -= time_cutoff % slice_length
+    cursor.execute("""SELECT servertime FROM wrinfo
+    WHERE wrinfo_id = (SELECT MIN(wrinfo_id) FROM wrinfo_survey)""")
+    first = list(cursor)
+    if len(first) == 0:
+        return
+    first = first[0][0]
+    time_cutoff = max(time_cutoff, first + (-first) % slice_length)
+    hist_cutoff = time_cutoff + (-time_cutoff) % tx_hist_length
+    cursor.execute("SELECT id, survey_type FROM radio_if")
+    survey_types = dict(cursor)
+
+    # Fetch from one slice earlier, so that the survey_type 1 counters
+    # can be differenced at the start of the first slice.
+    cursor.execute("""SELECT radio_if_id, wrinfo.wrinfo_id, wrinfo.servertime,
+      frequency, in_use, time, busy, rx, tx
+    FROM wrinfo, wrinfo_survey
+    WHERE wrinfo.wrinfo_id = wrinfo_survey.wrinfo_id
+    AND wrinfo.servertime >= %s
+    AND wrinfo_survey.servertime >= %s
+    ORDER BY radio_if_id, wrinfo.wrinfo_id""",
+      (time_cutoff - slice_length, time_cutoff - slice_length))
+    rows = list(cursor)
+
+    slices = {}
+    hists = {}
+    prev = {}
+    i = 0
+    while i < len(rows):
+        # Gather the survey of one wrinfo run
+        radio_if_id, wrinfo_id, servertime = rows[i][0:3]
+        survey = []
+        while i < len(rows) and rows[i][1] == wrinfo_id:
+            survey.append(dict(zip(("frequency", "in_use", "time", "busy",
+                                    "rx", "tx"), rows[i][3:])))
+            i += 1
+        if radio_if_id != prev.get("radio_if_id"):
+            prev = { "radio_if_id": radio_if_id }
+        if servertime >= time_cutoff:
+            accumulate(slices, survey_types.get(radio_if_id),
+                       radio_if_id, servertime, survey, prev)
+        if servertime >= hist_cutoff:
+            accumulate_tx_hist(hists, survey_types.get(radio_if_id),
+                               radio_if_id, servertime, survey, prev)
+        for entry in survey:
+            prev[entry["frequency"]] = entry
+
+    cursor.execute("DELETE FROM wrinfo_slice WHERE slice_start >= %s",
+                    (time_cutoff,))
+    write_slices(cursor, slices)
+    cursor.execute("DELETE FROM wrinfo_tx_hist WHERE bucket_start >= %s",
+                    (hist_cutoff,))
+    write_tx_hist(cursor, hists)
+    conn.commit()
+
+def usage():
+    print(  "rollup\n"
+            "\n"
+            "utility to rebuild the survey slice rollups (wrinfo_slice table)\n"
+            "and TX fraction histograms (wrinfo_tx_hist table) from the raw\n"
+            "survey data\n"
+            "\n"
+            "   -h         display help and exit\n"
+            "   -d <name>  connect to database with given name [wifispecman]\n"
+            "   -r #       number of days into the past to rebuild [1]\n"
+    )
+
+if __name__ == "__main__":
+    import getopt
+
+    # Default settings
+    dbname = "wifispecman"
+    days = 1.0
+
+    # Parse cmdline args
+    opts, args = getopt.getopt(sys.argv[1:], "hd:r:")
+    for k, v in opts:
+        if k == '-h':
+            usage()
+            sys.exit(0)
+        elif k == '-d':
+            dbname = v
+        elif k == '-r':
+            days = float(v)
+        else:
+            sys.exit(1)
+
+    conn = db.connect(user='wifispecman',
+                      password='password',
+                      database=dbname)
+    cursor = conn.cursor()
+    rebuild_slices(conn, cursor, int(time.time() - days * 86400))
+    conn.close()
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import asyncio
 import json
 import sys
 import subprocess
@@ -7,6 +8,25 @@ import time
 
 import mysql.connector as db
 
+import metrics
+import rollup
+from spool import Spool
+import sshsession
+import wrbin
+
+# The columns of the tables the sections of the wrinfo output go into
+_ifinfo_cols = {    'ifindex',
+                    'mac',
+                    'ssid',
+                    'frequency', 
+                    'channel_width_enum',
+                    'center_freq1',
+                    'center_freq2',
+                    'channel_type_enum' }
+_meta_cols = { "cmd", "time_human", "time_unix" }
+_scan_cols = { "bssid", "frequency", "ssid" }
+_survey_cols = { "frequency", "in_use", "noise", "time", "busy", "rx", "tx" }
+
 def _insert_obj_into_db(cursor, table, known_cols, wrinfo_id, D):
     kv_pairs = []
     if wrinfo_id is not None:
@@ -21,137 +41,228 @@ def _insert_obj_into_db(cursor, table, known_cols, wrinfo_id, D):
     attr_values = tuple([y for x, y in kv_pairs])
     cursor.execute(cmd, attr_values)
 
-def _insert_objarr_into_db(cursor, table, known_cols, wrinfo_id, A):
-    for D in A:
-        _insert_obj_into_db(cursor, table, known_cols, wrinfo_id, D)
+def _insert_objarr_into_db(cursor, table, known_cols, wrinfo_id, A,
+  servertime=None):
+    """Insert an array of objects with a single statement.
+
+    All the known columns are inserted for every row, with the ones
+    missing from an object set to NULL.  If servertime is given, it is
+    inserted into every row too; the tables partitioned by servertime
+    need it.
+    """
+    if len(A) == 0:
+        return
+    cols = sorted(known_cols)
+    prefix = ()
+    if servertime is not None:
+        cols.insert(0, 'servertime')
+        prefix = (servertime,)
+    if wrinfo_id is not None:
+        cols.insert(0, 'wrinfo_id')
+        prefix = (wrinfo_id,) + prefix
+    cmd = "INSERT INTO %s (%s) VALUES (%s)" % \
+            (table,
+             ", ".join(cols),
+             ", ".join(len(cols) * ["%s"]))
+    rows = [ prefix + tuple(D.get(k) for k in cols[len(prefix):])
+             for D in A ]
+    cursor.executemany(cmd, rows)
 
 def _insert_ifinfo(cursor, wrinfo_id, D):
-    known_cols = {  'ifindex',
-                    'mac',
-                    'ssid',
-                    'frequency', 
-                    'channel_width_enum',
-                    'center_freq1',
-                    'center_freq2',
-                    'channel_type_enum' }
     _insert_obj_into_db(cursor,
                     "wrinfo_interface",
-                    known_cols,
+                    _ifinfo_cols,
                     wrinfo_id,
                     D)
 
 def _insert_metainfo(cursor, wrinfo_id, D):
     _insert_obj_into_db(cursor,
                     "wrinfo_meta",
-                    { "cmd", "time_human", "time_unix" },
+                    _meta_cols,
                     wrinfo_id,
                     D)
 
-def _insert_scan(cursor, wrinfo_id, A):
+def _insert_scan(cursor, wrinfo_id, servertime, A):
     _insert_objarr_into_db(cursor,
                     "wrinfo_scan",
-                    { "bssid", "frequency", "ssid" },
-                    wrinfo_id, A)
+                    _scan_cols,
+                    wrinfo_id, A, servertime)
 
-def _insert_survey(cursor, wrinfo_id, A):
+def _insert_survey(cursor, wrinfo_id, servertime, A):
     _insert_objarr_into_db(cursor,
                     "wrinfo_survey",
-                    { "frequency", "in_use", "noise", "time", "busy",
-                      "rx", "tx" },
-                    wrinfo_id, A)
-
-def _get_wrinfo_cmd(conn, cursor, if_id, do_scan):
-    # Find the associated ap_id and ifname
-    cursor.execute("SELECT ap_id, ifname, measuring, wrinfo_cmd " +
-                "FROM radio_if WHERE id=%s", (if_id,))
-    result = list(cursor) #[row for row in cursor]
-    if len(result) == 0:
+                    _survey_cols,
+                    wrinfo_id, A, servertime)
+
+def _get_wrinfo_cmd(conn, cursor, if_id, do_scan, binary=False,
+  interfaces=None):
+    """Find out how to run wrinfo for an interface.
+
+    If binary is set, wrinfo is asked for its binary output (wrinfo -b)
+    rather than JSON.  If interfaces (a spool.InterfaceCache) is given,
+    the interface is looked up there rather than in the DB.
+
+    @return Tuple (succ, ip_addr, cmd).  Normally, cmd is the wrinfo
+            command to run on the AP at ip_addr.  If the interface has
+            a premade command, ip_addr is None and cmd is the command to
+            run locally.  If the interface is not to be queried, cmd is
+            None.
+    """
+    # Find the associated ifname and AP
+    if interfaces is not None:
+        row = interfaces.get(if_id)
+    else:
+        cursor.execute("SELECT ap_id, ifname, measuring, wrinfo_cmd, " +
+                    "ip_addr, in_use FROM radio_if " +
+                    "LEFT JOIN ap ON ap.id = radio_if.ap_id " +
+                    "WHERE radio_if.id=%s", (if_id,))
+        result = list(cursor)
+        assert len(result) <= 1
+        row = result[0] if len(result) > 0 else None
+    if row is None:
         sys.stderr.write("Error:  Radio Interface %d does not exist.\n"
           % (if_id,))
-        return (False, None)
-    assert len(result) == 1
-    if not result[0][2]:
+        return (False, None, None)
+    ap_id, ifname, measuring, cmd, ip_addr, in_use = row
+    if not measuring:
         sys.stderr.write(
             "Info:  Interface is not being measured, skipping.\n")
-        return (True, None)
-    ap_id = result[0][0] 
-    ifname = result[0][1]
-    cmd = result[0][3]
+        return (True, None, None)
 
     # Check if we can use a premade command
     if cmd is not None:
-        return (True, cmd.split())
-
-    # Find the IP address
-    cursor.execute("SELECT ip_addr, in_use FROM ap WHERE id=%s", (ap_id,))
-    result = [row for row in cursor]
-    assert len(result) == 1
-    ip_addr = result[0][0]
-    if not result[0][1]:
+        return (True, None, cmd.split())
+
+    # Check the AP
+    if not in_use:
         sys.stderr.write(
             "Info:  AP holding interface %d is not in use, skipping.\n"
             % (if_id,))
-        return (True, None)
+        return (True, None, None)
 
-    # Construct ssh command
-    cmd = [ "ssh", "-n", "-T", "root@%s" % (ip_addr,),
-            "./wrinfo", "-i", ifname]
+    # Construct wrinfo command
+    cmd = [ "./wrinfo", "-i", ifname ]
     if do_scan:
         cmd.append("-s")
-    return (True, cmd)
+    if binary:
+        cmd.append("-b")
+    return (True, ip_addr, cmd)
 
-def run_wrinfo(dbname, if_id, timeout, cmdline, do_scan, tag):
-    # Open DB
-    conn = db.connect(user='wifispecman',
-                      password='password',
-                      database=dbname)
-    cursor = conn.cursor()
+def _refresh_interfaces(dbname, interfaces):
+    """Refresh a spool.InterfaceCache from the DB, if it's reachable.
 
-    # Create rungroup
+    @return True if refreshed.
+    """
+    try:
+        conn = db.connect(user='wifispecman',
+                          password='password',
+                          database=dbname,
+                          connection_timeout=5)
+        try:
+            interfaces.refresh(metrics.CountingCursor(conn.cursor()))
+        finally:
+            conn.close()
+    except (db.Error, OSError) as e:
+        sys.stderr.write("Warning:  Can't refresh the interfaces from the"
+                         " DB: %s\n" % (e,))
+        return False
+    return True
+
+def _ssh_cmd(ip_addr, cmd):
+    """Local command line to run cmd on the AP, without multiplexing."""
+    if ip_addr is None:
+        return cmd
+    return [ "ssh", "-n", "-T", "root@%s" % (ip_addr,) ] + cmd
+
+def _update_edges(cursor, mac, servertime, A):
+    """Record the sightings of the BSSIDs of a scan by mac in the
+    wrinfo_edge table."""
+    bssids = set(D.get("bssid") for D in A) - { None }
+    if mac is None or len(bssids) == 0:
+        return
+    cursor.executemany(
+      "INSERT INTO wrinfo_edge"
+      + " (mac, bssid, first_seen, last_seen, sightings)"
+      + " VALUES (%s, %s, %s, %s, 1)"
+      + " ON DUPLICATE KEY UPDATE"
+      + " last_seen = GREATEST(last_seen, VALUES(last_seen)),"
+      + " sightings = sightings + 1",
+      [ (mac, bssid, servertime, servertime) for bssid in sorted(bssids) ])
+
+def _create_rungroup(cursor, cmdline, tag, spool=None):
+    if spool is not None:
+        return spool.create_rungroup(cmdline, tag)
     cursor.execute(
       "INSERT INTO rungroup (cmd, servertime, tag) "
       + "VALUES (%s, %s, %s)", (cmdline, int(time.time()), tag))
-    rungroup_id = cursor.getlastrowid()
+    return cursor.getlastrowid()
 
-    # Run wrinfo
-    succ, cmd = _get_wrinfo_cmd(conn, cursor, if_id, do_scan)
-    if succ == False or cmd is None:
-        return succ
-    status = 0
-    try:
-        result = subprocess.run(cmd,
-                    stdin=subprocess.DEVNULL,
-                    capture_output=True,
-                    text=True,
-                    timeout=timeout)
-    except subprocess.TimeoutExpired:
-        status = 2
+def _store_result(conn, cursor, if_id, rungroup_id, status, exit_code,
+  stdout, stderr, spool=None):
+    """Insert the outcome of one wrinfo run into the DB and commit.
+
+    Everything is written in one transaction, which is rolled back if
+    any of the inserts fails.  If spool is given, the parsed outcome is
+    appended to it instead, for load_spool.py to load into the DB.
+
+    @param  stdout
+            the output of wrinfo, as text or bytes; a binary record
+            (wrinfo -b) must be given as bytes.
+
+    @return True if the output was complete and valid.
+    """
+    # Parse the output:  a binary record, or JSON
+    metrics.registry.add("wrinfo_output_bytes_total",
+                         len(stdout) if isinstance(stdout, bytes)
+                         else len(stdout.encode(errors="replace")))
+    if isinstance(stdout, bytes) and wrbin.is_binary(stdout):
+        with metrics.registry.timer("wrinfo_bin_decode"):
+            try:
+                D = wrbin.decode(stdout)
+            except ValueError:
+                D = None
+    else:
+        if isinstance(stdout, bytes):
+            stdout = stdout.decode(errors="replace")
+        with metrics.registry.timer("wrinfo_json_parse"):
+            try:
+                D = json.loads(stdout)
+            except:
+                D = None
 
-    exit_code = result.returncode
-    if status == 0 and exit_code != 0:
-        status = 1
+    if spool is not None:
+        spool.append_run(rungroup_id, if_id, status, exit_code, D, stderr)
+        return type(D) == dict
 
+    try:
+        with metrics.registry.timer("wrinfo_db_insert"):
+            return _store_result_rows(conn, cursor, if_id, rungroup_id,
+                                      status, exit_code, D, stderr)
+    except:
+        conn.rollback()
+        raise
+
+def _store_result_rows(conn, cursor, if_id, rungroup_id, status, exit_code,
+  D, stderr):
     # Create the wrinfo entry
+    servertime = int(time.time())
     cursor.execute(
       ("INSERT INTO wrinfo"
       + " (radio_if_id, status, exit_code, servertime, rungroup_id)"
       + " VALUES (%s, %s, %s, %s, %s)"),
-      (if_id, status, exit_code, int(time.time()), rungroup_id)
+      (if_id, status, exit_code, servertime, rungroup_id)
     )
     wrinfo_id = cursor.getlastrowid()
 
     # Insert stderr
-    for l in result.stderr.split('\n'):
-        if l == "":
-            continue
-        cursor.execute(("INSERT INTO wrinfo_errors (wrinfo_id, msg)"
-          + " VALUES (%s, %s)"), (wrinfo_id, l))
+    errors = [ (wrinfo_id, l) for l in stderr.split('\n') if l != "" ]
+    if len(errors) > 0:
+        cursor.executemany(("INSERT INTO wrinfo_errors (wrinfo_id, msg)"
+          + " VALUES (%s, %s)"), errors)
 
-    # Parse JSON output and insert
+    # Insert the parsed output
     output_ok = True
-    try:
-        D = json.loads(result.stdout)
-    except:
+    if D is None:
         output_ok = False
     else: 
         if type(D) == dict:
@@ -166,12 +277,17 @@ def run_wrinfo(dbname, if_id, timeout, cmdline, do_scan, tag):
                 print("Error reading the meta section.")
                 output_ok = False
             if "scan" in D and type(D["scan"]) == list:
-                _insert_scan(cursor, wrinfo_id, D["scan"])
+                _insert_scan(cursor, wrinfo_id, servertime, D["scan"])
+                if type(D.get("interface")) == dict:
+                    _update_edges(cursor, D["interface"].get("mac"),
+                                  servertime, D["scan"])
             else:
                 print("Error reading the scan section.")
                 output_ok = False
             if "survey" in D and type(D["survey"]) == list:
-                _insert_survey(cursor, wrinfo_id, D["survey"])
+                _insert_survey(cursor, wrinfo_id, servertime, D["survey"])
+                rollup.update_slices(cursor, if_id, wrinfo_id, servertime,
+                                     D["survey"])
             else:
                 print("Error reading the survey section.")
                 output_ok = False
@@ -186,9 +302,211 @@ def run_wrinfo(dbname, if_id, timeout, cmdline, do_scan, tag):
             # update in error case.
             cursor.execute(("UPDATE wrinfo SET status = %s WHERE " +
                             "wrinfo_id = %d" % (wrinfo_id,)), (3,))
+            status = 3
+    metrics.registry.add("wrinfo_runs_total", status=status)
 
     # Commit updates
     conn.commit()
+    return output_ok
+
+def run_wrinfo(dbname, if_id, timeout, cmdline, do_scan, tag,
+  sessions=None, binary=False, spool=None):
+    # Open DB; with a spool, the interface is looked up in its cache
+    # instead, which is refreshed from the DB after the run, or before
+    # it if the interface isn't there yet.
+    conn, cursor, interfaces = None, None, None
+    if spool is None:
+        conn = db.connect(user='wifispecman',
+                          password='password',
+                          database=dbname)
+        cursor = metrics.CountingCursor(conn.cursor())
+    else:
+        interfaces = spool.interfaces
+        if interfaces.get(if_id) is None:
+            _refresh_interfaces(dbname, interfaces)
+
+    # Create rungroup
+    rungroup_id = _create_rungroup(cursor, cmdline, tag, spool)
+
+    # Run wrinfo
+    succ, ip_addr, cmd = _get_wrinfo_cmd(conn, cursor, if_id, do_scan,
+                                         binary, interfaces)
+    if succ == False or cmd is None:
+        return succ
+    status = 0
+    exit_code = None
+    stdout, stderr = b"", ""
+    try:
+        with metrics.registry.timer("wrinfo_ssh", if_id=if_id):
+            if sessions is not None and ip_addr is not None:
+                result = sessions.run(ip_addr, cmd, timeout, text=False)
+            else:
+                result = subprocess.run(_ssh_cmd(ip_addr, cmd),
+                            stdin=subprocess.DEVNULL,
+                            capture_output=True,
+                            timeout=timeout)
+    except subprocess.TimeoutExpired:
+        status = 2
+    else:
+        exit_code = result.returncode
+        stdout = result.stdout
+        stderr = result.stderr.decode(errors="replace")
+        if exit_code != 0:
+            status = 1
+
+    _store_result(conn, cursor, if_id, rungroup_id, status, exit_code,
+                  stdout, stderr, spool)
+    if sessions is not None and ip_addr is not None:
+        print(sessions.format_stats())
+    if spool is not None:
+        _refresh_interfaces(dbname, interfaces)
+
+async def _run_async(cmd, timeout):
+    """Run cmd, capturing its output.
+
+    @return Tuple (returncode, stdout, stderr), with the output as
+            bytes.  asyncio.TimeoutError is raised on timeout.
+    """
+    proc = await asyncio.create_subprocess_exec(*cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise
+    return (proc.returncode, stdout, stderr)
+
+async def _poll_interface(conn, cursor, if_id, rungroup_id, timeout, do_scan,
+  semaphore, sessions, binary=False, spool=None):
+    """Run wrinfo on one interface as part of a collection round."""
+    interfaces = None if spool is None else spool.interfaces
+    succ, ip_addr, cmd = _get_wrinfo_cmd(conn, cursor, if_id, do_scan,
+                                         binary, interfaces)
+    if succ == False or cmd is None:
+        return
+    status = 0
+    exit_code = None
+    stdout, stderr = b"", b""
+    async with semaphore:
+        try:
+            with metrics.registry.timer("wrinfo_ssh", if_id=if_id):
+                if sessions is not None and ip_addr is not None:
+                    exit_code, stdout, stderr = \
+                        await sessions.run_async(ip_addr, cmd, timeout)
+                else:
+                    exit_code, stdout, stderr = \
+                        await _run_async(_ssh_cmd(ip_addr, cmd), timeout)
+        except asyncio.TimeoutError:
+            status = 2
+        else:
+            if exit_code != 0:
+                status = 1
+    print("Interface %d:" % (if_id,))
+    _store_result(conn, cursor, if_id, rungroup_id, status, exit_code,
+                  stdout, stderr.decode(errors="replace"), spool)
+
+async def _collect(conn, cursor, timeout, cmdline, do_scan, tag, concurrency,
+  interval, scan_every, sessions, metrics_path, binary, spool, dbname=None):
+    semaphore = asyncio.Semaphore(concurrency)
+    in_flight = {}
+    round_no = 0
+    refresh = None
+    while True:
+        t_start = time.monotonic()
+        if spool is None:
+            conn.ping(reconnect=True)
+        if sessions is not None and round_no > 0:
+            print(sessions.format_stats())
+        if metrics_path is not None and round_no > 0:
+            metrics.registry.write(metrics_path, program="run_wrinfo",
+                                   rounds=round_no)
+
+        # Start a round on the interfaces not still busy with an
+        # earlier one; so a hung AP never holds up the others.  With a
+        # spool, the interfaces come from its cache, refreshed from the
+        # DB in the background for the next rounds; only a round without
+        # any cached interfaces waits for the refresh.
+        if spool is None:
+            cursor.execute("SELECT id FROM radio_if WHERE measuring = 1")
+            if_ids = [ row[0] for row in cursor ]
+        else:
+            if refresh is None or refresh.done():
+                refresh = asyncio.get_running_loop().run_in_executor(None,
+                            _refresh_interfaces, dbname, spool.interfaces)
+            if len(spool.interfaces.interfaces) == 0:
+                await refresh
+            if_ids = spool.interfaces.measured()
+        round_scan = do_scan or (scan_every > 0
+                                 and round_no % scan_every == 0)
+        rungroup_id = _create_rungroup(cursor, cmdline, tag, spool)
+        if spool is None:
+            conn.commit()
+        for if_id in if_ids:
+            if if_id in in_flight:
+                sys.stderr.write("Info:  Interface %d still busy with the"
+                    " previous round, skipping.\n" % (if_id,))
+                continue
+            task = asyncio.create_task(_poll_interface(conn, cursor, if_id,
+                        rungroup_id, timeout, round_scan, semaphore,
+                        sessions, binary, spool))
+            in_flight[if_id] = task
+            task.add_done_callback(
+                lambda t, if_id=if_id: in_flight.pop(if_id, None))
+        round_no += 1
+
+        if interval <= 0:
+            await asyncio.gather(*in_flight.values())
+            if sessions is not None:
+                print(sessions.format_stats())
+            if metrics_path is not None:
+                metrics.registry.write(metrics_path, program="run_wrinfo",
+                                       rounds=round_no)
+            return
+        await asyncio.sleep(max(0, interval - (time.monotonic() - t_start)))
+
+def run_wrinfo_all(dbname, timeout, cmdline, do_scan, tag, concurrency,
+  interval, scan_every, sessions=None, metrics_path=None, binary=False,
+  spool=None):
+    """Run wrinfo on all the measured interfaces concurrently.
+
+    All the interfaces of a round share one DB connection and one
+    rungroup.  If interval is positive, a new round is started every
+    interval seconds, forever.
+
+    @param  concurrency
+            maximum number of wrinfo commands running at the same time.
+
+    @param  scan_every
+            if positive, also run a channel scan every scan_every-th
+            round.
+
+    @param  metrics_path
+            if given, the metrics are written there after every round,
+            see metrics.Metrics.write().  The counters are cumulative
+            over the rounds.
+
+    @param  spool
+            if given, a spool.Spool the results are appended to rather
+            than written to the DB.  The interfaces are then taken from
+            its cache, and the DB is only connected to, in the
+            background, to refresh the cache.
+    """
+    conn, cursor = None, None
+    if spool is None:
+        conn = db.connect(user='wifispecman',
+                          password='password',
+                          database=dbname)
+        cursor = metrics.CountingCursor(conn.cursor())
+    try:
+        asyncio.run(_collect(conn, cursor, timeout, cmdline, do_scan, tag,
+                             concurrency, interval, scan_every, sessions,
+                             metrics_path, binary, spool, dbname))
+    finally:
+        if conn is not None:
+            conn.close()
 
 def usage():
     print(  "run_wrinfo\n"
@@ -200,8 +518,20 @@ def usage():
             "   -d <name>  connect to database with given name [wifispecman]\n"
             "   -i #       interface ID (radio_if.id value from DB)\n"
             "   -s         run channel scan as well (pass -s to wrinfo)\n"
+            "   -b         get binary rather than JSON output (pass -b to\n"
+            "              wrinfo)\n"
             "   -t #       timeout in seconds\n"
             "   -T <name>  tag name to associate with run\n"
+            "   -a         run on all measured interfaces concurrently,\n"
+            "              rather than on the one given by -i\n"
+            "   -P #       with -a, number of concurrent runs [8]\n"
+            "   -l #       with -a, keep running a new round every # seconds\n"
+            "   -e #       with -l, run a channel scan every #-th round\n"
+            "   -M         don't keep SSH connections to the APs open\n"
+            "   -m <file>  write metrics to the file; Prometheus text format\n"
+            "              if it ends in .prom, else a JSON line is appended\n"
+            "   -S <file>  append the results to the spool file rather than\n"
+            "              writing them to the DB; see load_spool.py\n"
     )
 
 if __name__ == "__main__":
@@ -213,9 +543,17 @@ if __name__ == "__main__":
     dbname = "wifispecman"
     do_scan = False
     tag = None
+    all_ifs = False
+    concurrency = 8
+    interval = 0
+    scan_every = 0
+    multiplex = True
+    metrics_path = None
+    binary = False
+    spool_path = None
 
     # Parse cmdline args
-    opts, args = getopt.getopt(sys.argv[1:], "hd:i:st:T:")
+    opts, args = getopt.getopt(sys.argv[1:], "hd:i:sbt:T:aP:l:e:Mm:S:")
     for k, v in opts:
         if k == '-h':
             usage()
@@ -225,15 +563,43 @@ if __name__ == "__main__":
             if_id = int(v)
         elif k == '-s':
             do_scan = True
+        elif k == '-b':
+            binary = True
         elif k == '-t':
             timeout = float(v)
         elif k == '-T':
             tag = v
+        elif k == '-a':
+            all_ifs = True
+        elif k == '-P':
+            concurrency = int(v)
+        elif k == '-l':
+            interval = float(v)
+        elif k == '-e':
+            scan_every = int(v)
+        elif k == '-M':
+            multiplex = False
+        elif k == '-m':
+            metrics_path = v
+        elif k == '-S':
+            spool_path = v
         else:
             sys.exit(1)
 
+    sessions = sshsession.SSHSessions() if multiplex else None
+    spool = None if spool_path is None else Spool(spool_path)
+    if all_ifs:
+        run_wrinfo_all(dbname, timeout, ' '.join(sys.argv), do_scan, tag,
+                       concurrency, interval, scan_every, sessions,
+                       metrics_path, binary, spool)
+        sys.exit(0)
+
     if if_id is None:
         sys.stderr.write("Error:  Missing interface ID (specify it with -i)\n")
         sys.exit(1)
 
-    run_wrinfo(dbname, if_id, timeout, ' '.join(sys.argv), do_scan, tag)
+    run_wrinfo(dbname, if_id, timeout, ' '.join(sys.argv), do_scan, tag,
+               sessions, binary, spool)
+    if metrics_path is not None:
+        metrics.registry.write(metrics_path, program="run_wrinfo",
+                               if_id=if_id)
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+
+"""
+Adaptive wrinfo polling scheduler.
+
+Rather than surveying every interface at a fixed rate and scanning all
+of them hourly (see sample_crontab.txt), this decides per interface
+when to run a survey and when to add a channel scan:
+
+  - an interface's survey is due once its last run is older than its
+    target interval, which shrinks from max_interval to min_interval
+    as the busy fraction of its recent slices (the wrinfo_slice
+    table) gets more variable;
+
+  - its scan is due once its last scan is older than scan_interval, or
+    than the shorter changed_scan_interval if its neighborhood in the
+    interference graph (the wrinfo_edge table) changed since the
+    scheduler last looked;
+
+  - the most overdue interfaces are polled first, within a global
+    budget of wrinfo runs (SSH commands) and scans per minute.
+
+The runs are stored the same way as those of run_wrinfo.py.  The
+scheduler outlives DB restarts:  a refresh that fails is retried on the
+next tick, and a run that fails still counts as the interface's turn.
+"""
+
+import asyncio
+import math
+import sys
+import time
+
+import mysql.connector as db
+
+import metrics
+import rollup
+import run_wrinfo
+import sshsession
+import stream_wrinfo
+
+class Settings(object):
+    """Scheduler settings; all times in seconds."""
+
+    def __init__(self):
+        self.min_interval = 60
+        self.max_interval = 900
+        # Standard deviation of the busy fraction at which the survey
+        # interval reaches min_interval
+        self.variability_high = 0.15
+        self.scan_interval = 3600
+        self.changed_scan_interval = 600
+        # Budgets, per minute
+        self.runs_per_minute = 20.0
+        self.scans_per_minute = 1.0
+        # How often to look at the DB for the variability and the
+        # neighborhoods, and the time window looked at
+        self.refresh = 300
+        self.window = 3600
+        self.tick = 5
+
+class InterfaceState(object):
+    """What the scheduler knows about one interface."""
+
+    def __init__(self, if_id):
+        self.if_id = if_id
+        self.mac = None
+        self.last_run = None
+        self.last_scan = None
+        self.variability = None
+        self.neighbors = None
+        self.neighborhood_changed = False
+
+    def survey_interval(self, settings):
+        """Target time between runs, given the variability."""
+        if self.variability is None:
+            return settings.max_interval
+        x = min(1.0, self.variability / settings.variability_high)
+        return settings.max_interval \
+                - x * (settings.max_interval - settings.min_interval)
+
+    def scan_interval(self, settings):
+        if self.neighborhood_changed:
+            return settings.changed_scan_interval
+        return settings.scan_interval
+
+    def survey_priority(self, settings, now):
+        """How overdue the survey is; due from 1 on."""
+        if self.last_run is None:
+            return math.inf
+        return (now - self.last_run) / self.survey_interval(settings)
+
+    def scan_priority(self, settings, now):
+        """How overdue the scan is; due from 1 on."""
+        if self.last_scan is None:
+            return math.inf
+        return (now - self.last_scan) / self.scan_interval(settings)
+
+def _busy_stddev(fractions):
+    if len(fractions) < 2:
+        return None
+    mean = sum(fractions) / len(fractions)
+    return math.sqrt(sum((f - mean) ** 2 for f in fractions)
+                     / (len(fractions) - 1))
+
+def refresh(cursor, states, settings, now):
+    """Update the interface states from the DB.
+
+    Adds the newly measured interfaces to states and drops the ones no
+    longer measured; reads the time of their last run, their MAC, the
+    variability of their recent slices and their neighbors.  The
+    times of the last runs and scans are only read for new interfaces;
+    afterwards the scheduler keeps track of them itself.
+    """
+    cursor.execute("SELECT id FROM radio_if WHERE measuring = 1")
+    if_ids = [ row[0] for row in cursor ]
+    for if_id in list(states):
+        if if_id not in if_ids:
+            del states[if_id]
+    new = [ if_id for if_id in if_ids if if_id not in states ]
+    for if_id in new:
+        states[if_id] = InterfaceState(if_id)
+    if len(if_ids) == 0:
+        return
+    id_list = ", ".join("%d" % (x,) for x in if_ids)
+    window_start = int(now - settings.window)
+
+    # Time of the last run of the new interfaces
+    if len(new) > 0:
+        cursor.execute("""SELECT radio_if_id, MAX(servertime)
+        FROM wrinfo
+        WHERE radio_if_id IN (%s)
+        GROUP BY radio_if_id""" % (", ".join("%d" % (x,) for x in new),))
+        for (if_id, t) in list(cursor):
+            states[if_id].last_run = t
+
+    # MACs, from the runs in the window
+    cursor.execute("""SELECT wrinfo.radio_if_id, wrinfo_interface.mac
+    FROM wrinfo, wrinfo_interface
+    WHERE wrinfo.wrinfo_id = wrinfo_interface.wrinfo_id
+    AND radio_if_id IN (%s)
+    AND wrinfo.servertime >= %d
+    AND mac IS NOT NULL
+    ORDER BY wrinfo.wrinfo_id""" % (id_list, window_start))
+    for (if_id, mac) in list(cursor):
+        states[if_id].mac = mac
+
+    # Variability:  standard deviation of the busy fraction of the
+    # slices in the window, on the channels in use.
+    cursor.execute("""SELECT radio_if_id, busy, busy_time
+    FROM wrinfo_slice
+    WHERE radio_if_id IN (%s)
+    AND slice_start >= %d
+    AND in_use > 0
+    AND busy_time > 0""" % (id_list,
+                             window_start - window_start % rollup.slice_length))
+    fractions = {}
+    for (if_id, busy, busy_time) in list(cursor):
+        fractions.setdefault(if_id, []).append(busy / busy_time)
+    for (if_id, st) in states.items():
+        st.variability = _busy_stddev(fractions.get(if_id, []))
+
+    # Neighborhoods, and the time of the last scan that found anything
+    # for the new interfaces
+    macs = dict((st.mac, st) for st in states.values() if st.mac is not None)
+    if len(macs) == 0:
+        return
+    cursor.execute("""SELECT mac, bssid, last_seen
+    FROM wrinfo_edge
+    WHERE mac IN (%s)""" % (", ".join(len(macs) * [ "%s" ]),),
+                   tuple(macs))
+    neighbors = dict((mac, set()) for mac in macs)
+    last_seen = {}
+    for (mac, bssid, t) in list(cursor):
+        last_seen[mac] = max(last_seen.get(mac, t), t)
+        if t >= window_start - settings.scan_interval:
+            neighbors[mac].add(bssid)
+    for (mac, st) in macs.items():
+        if st.neighbors is not None and st.neighbors != neighbors[mac]:
+            st.neighborhood_changed = True
+        st.neighbors = neighbors[mac]
+        if st.if_id in new and st.last_scan is None:
+            st.last_scan = last_seen.get(mac)
+
+def plan(states, settings, now, run_tokens, scan_tokens, busy=()):
+    """Choose the interfaces to poll now.
+
+    @param  run_tokens, scan_tokens
+            number of runs and scans the budget allows now.
+
+    @param  busy
+            interfaces whose previous run is still going on.
+
+    @return list of tuples (if_id, do_scan), most overdue first.
+    """
+    due = []
+    for st in states.values():
+        if st.if_id in busy:
+            continue
+        survey = st.survey_priority(settings, now)
+        scan = st.scan_priority(settings, now)
+        if max(survey, scan) >= 1:
+            due.append( (max(survey, scan), scan >= 1, st.if_id) )
+    due.sort(key=lambda x: (-x[0], x[2]))
+
+    ret = []
+    for (_, scan_due, if_id) in due:
+        if run_tokens < 1:
+            break
+        do_scan = scan_due and scan_tokens >= 1
+        if scan_due and not do_scan \
+          and states[if_id].survey_priority(settings, now) < 1:
+            # Only the scan is due, and there's no budget for it
+            continue
+        run_tokens -= 1
+        if do_scan:
+            scan_tokens -= 1
+        ret.append( (if_id, do_scan) )
+    return ret
+
+async def _poll(conn, cursor, st, rungroup_id, timeout, do_scan, semaphore,
+  sessions, binary):
+    t = time.time()
+    try:
+        await run_wrinfo._poll_interface(conn, cursor, st.if_id, rungroup_id,
+                                         timeout, do_scan, semaphore,
+                                         sessions, binary)
+    except db.Error as e:
+        stream_wrinfo._recover(conn, st.if_id, e)
+        metrics.registry.add("schedule_runs_failed_total")
+        return
+    finally:
+        # A failed run counts too, so that the interface waits for its
+        # next turn rather than using up the budget every tick.
+        st.last_run = t
+        if do_scan:
+            st.last_scan = t
+    if do_scan:
+        st.neighborhood_changed = False
+    metrics.registry.add("schedule_runs_total", scan=int(do_scan))
+
+def _poll_done(in_flight, if_id, task):
+    """Forget a finished poll, logging what it failed on."""
+    in_flight.pop(if_id, None)
+    if not task.cancelled() and task.exception() is not None:
+        sys.stderr.write("Error:  Polling interface %d failed: %s: %s\n"
+                         % (if_id, type(task.exception()).__name__,
+                            task.exception()))
+        metrics.registry.add("schedule_runs_failed_total")
+
+async def _schedule(conn, cursor, settings, timeout, cmdline, tag,
+  concurrency, sessions, metrics_path, binary):
+    semaphore = asyncio.Semaphore(concurrency)
+    states = {}
+    in_flight = {}
+    run_tokens, scan_tokens = 0.0, 0.0
+    last_refresh, last_report = None, time.time()
+    rungroup_id = None
+    while True:
+        now = time.time()
+        if now - last_report >= settings.refresh:
+            if sessions is not None:
+                print(sessions.format_stats())
+            if metrics_path is not None:
+                metrics.registry.write(metrics_path,
+                                       program="schedule_wrinfo")
+            last_report = now
+
+        # Refresh from the DB; if it's unreachable, keep polling on what
+        # is known, and try again on the next tick.
+        if last_refresh is None or now - last_refresh >= settings.refresh:
+            try:
+                conn.ping(reconnect=True)
+                refresh(cursor, states, settings, now)
+                rungroup_id = run_wrinfo._create_rungroup(cursor, cmdline,
+                                                          tag)
+                conn.commit()
+                last_refresh = now
+            except db.Error as e:
+                sys.stderr.write("Error:  Can't refresh from the DB: %s\n"
+                                 % (e,))
+                try:
+                    conn.rollback()
+                except db.Error:
+                    pass
+
+        # Token buckets holding up to a minute's worth of budget
+        run_tokens = min(max(1.0, settings.runs_per_minute), run_tokens
+                         + settings.runs_per_minute * settings.tick / 60)
+        scan_tokens = min(max(1.0, settings.scans_per_minute), scan_tokens
+                          + settings.scans_per_minute * settings.tick / 60)
+        for (if_id, do_scan) in plan(states, settings, now, run_tokens,
+                                     scan_tokens, in_flight):
+            run_tokens -= 1
+            if do_scan:
+                scan_tokens -= 1
+            task = asyncio.create_task(_poll(conn, cursor, states[if_id],
+                        rungroup_id, timeout, do_scan, semaphore, sessions,
+                        binary))
+            in_flight[if_id] = task
+            task.add_done_callback(
+                lambda t, if_id=if_id: _poll_done(in_flight, if_id, t))
+        await asyncio.sleep(settings.tick)
+
+def schedule_wrinfo(dbname, settings, timeout, cmdline, tag, concurrency=8,
+  sessions=None, metrics_path=None, binary=False):
+    """Poll the measured interfaces adaptively, until interrupted."""
+    conn = db.connect(user='wifispecman',
+                      password='password',
+                      database=dbname)
+    cursor = metrics.CountingCursor(conn.cursor())
+    try:
+        asyncio.run(_schedule(conn, cursor, settings, timeout, cmdline, tag,
+                              concurrency, sessions, metrics_path, binary))
+    finally:
+        conn.close()
+
+def usage():
+    s = Settings()
+    print(  "schedule_wrinfo\n"
+            "\n"
+            "utility to run wrinfo on the measured interfaces, surveying\n"
+            "and scanning each as often as its data changes, within a\n"
+            "budget; runs until interrupted\n"
+            "\n"
+            "   -h         display help and exit\n"
+            "   -d <name>  connect to database with given name [wifispecman]\n"
+            "   -i #       shortest time between surveys, in seconds [%d]\n"
+            "   -I #       longest time between surveys, in seconds [%d]\n"
+            "   -v #       standard deviation of the busy fraction at which\n"
+            "              the shortest interval is used [%g]\n"
+            "   -e #       time between scans, in seconds [%d]\n"
+            "   -E #       time between scans after the neighborhood of an\n"
+            "              interface changed, in seconds [%d]\n"
+            "   -b #       budget of wrinfo runs per minute [%g]\n"
+            "   -B #       budget of scans per minute [%g]\n"
+            "   -c         get binary rather than JSON output (wrinfo -b)\n"
+            "   -P #       number of concurrent runs [8]\n"
+            "   -t #       timeout in seconds [60]\n"
+            "   -T <name>  tag name to associate with run\n"
+            "   -M         don't keep SSH connections to the APs open\n"
+            "   -m <file>  write metrics to the file, see run_wrinfo.py\n"
+            % (s.min_interval, s.max_interval, s.variability_high,
+               s.scan_interval, s.changed_scan_interval, s.runs_per_minute,
+               s.scans_per_minute)
+    )
+
+if __name__ == "__main__":
+    import getopt
+
+    # Default settings
+    dbname = "wifispecman"
+    settings = Settings()
+    concurrency = 8
+    timeout = 60.0
+    tag = None
+    multiplex = True
+    metrics_path = None
+    binary = False
+
+    # Parse cmdline args
+    opts, args = getopt.getopt(sys.argv[1:], "hd:i:I:v:e:E:b:B:cP:t:T:Mm:")
+    for k, v in opts:
+        if k == '-h':
+            usage()
+            sys.exit(0)
+        elif k == '-d':
+            dbname = v
+        elif k == '-i':
+            settings.min_interval = float(v)
+        elif k == '-I':
+            settings.max_interval = float(v)
+        elif k == '-v':
+            settings.variability_high = float(v)
+        elif k == '-e':
+            settings.scan_interval = float(v)
+        elif k == '-E':
+            settings.changed_scan_interval = float(v)
+        elif k == '-b':
+            settings.runs_per_minute = float(v)
+        elif k == '-B':
+            settings.scans_per_minute = float(v)
+        elif k == '-c':
+            binary = True
+        elif k == '-P':
+            concurrency = int(v)
+        elif k == '-t':
+            timeout = float(v)
+        elif k == '-T':
+            tag = v
+        elif k == '-M':
+            multiplex = False
+        elif k == '-m':
+            metrics_path = v
+        else:
+            sys.exit(1)
+
+    sessions = sshsession.SSHSessions() if multiplex else None
+    schedule_wrinfo(dbname, settings, timeout, ' '.join(sys.argv), tag,
+                    concurrency, sessions, metrics_path, binary)
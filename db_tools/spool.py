@@ -0,0 +1,205 @@
+"""
+Local spool of wrinfo results.
+
+With run_wrinfo.py -S, the parsed results are appended to a spool file
+rather than written to the DB, so that collection goes on at its own
+pace while the DB is slow or restarting; load_spool.py later loads them
+in bulk.  The spool file holds one JSON object per line, either
+
+    { "kind": "rungroup", "rungroup": <id>, "cmd": ..., "servertime":
+      ..., "tag": ... }
+
+for a rungroup, with a spool-local id, or
+
+    { "kind": "run", "rungroup": <id>, "rungroup_info": { "cmd": ...,
+      "servertime": ..., "tag": ... }, "if_id": ..., "status": ...,
+      "exit_code": ..., "servertime": ..., "output": <parsed wrinfo
+      output or null>, "stderr": ... }
+
+for a wrinfo run.  A run repeats the items of its rungroup, as the
+rungroup record may be in an earlier spool file than the run, already
+loaded (or set aside).  Each line is appended with a single write under an
+exclusive lock, so that several processes can share a spool.  To load
+the spool, the loader claims it by renaming it under the same lock;
+the writers then start a new file.
+
+The radio_if and ap rows run_wrinfo.py needs to run wrinfo are kept in
+a local InterfaceCache file next to the spool, so that collecting
+doesn't need the DB either.
+"""
+
+import collections
+import fcntl
+import glob
+import json
+import os
+import sys
+import time
+import uuid
+
+import metrics
+
+# Number of the latest rungroups whose items a Spool keeps, to repeat
+# them in their runs
+_rungroups_kept = 16
+
+class Spool(object):
+    """Writer of a spool file."""
+
+    def __init__(self, path, sync=False):
+        """
+        @param  sync
+                if set, each record is fsync()ed, so that it survives
+                a crash of the host, not only of the process.
+        """
+        self.path = path
+        self.sync = sync
+        self.interfaces = InterfaceCache(path + ".interfaces")
+        self._rungroups = collections.OrderedDict()
+
+    def _open_locked(self):
+        """Open the spool for appending and lock it, making sure it's
+        not a file just claimed by the loader."""
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def append(self, D):
+        """Append a record."""
+        line = (json.dumps(D, separators=(",", ":")) + "\n").encode()
+        fd = self._open_locked()
+        try:
+            os.write(fd, line)
+            if self.sync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        metrics.registry.add("spool_records_total", kind=D["kind"])
+        metrics.registry.add("spool_bytes_total", len(line))
+
+    def create_rungroup(self, cmdline, tag):
+        """Record a rungroup; returns its spool-local id."""
+        rungroup_id = "s" + uuid.uuid4().hex
+        info = { "cmd": cmdline, "servertime": int(time.time()),
+                 "tag": tag }
+        self.append(dict(info, kind="rungroup", rungroup=rungroup_id))
+        self._rungroups[rungroup_id] = info
+        while len(self._rungroups) > _rungroups_kept:
+            self._rungroups.popitem(last=False)
+        return rungroup_id
+
+    def append_run(self, rungroup_id, if_id, status, exit_code, output,
+      stderr):
+        """Record a wrinfo run.
+
+        @param  output
+                the parsed output of wrinfo, or None if it could not be
+                parsed.
+        """
+        self.append({ "kind": "run", "rungroup": rungroup_id,
+                      "rungroup_info": self._rungroups.get(rungroup_id),
+                      "if_id": if_id, "status": status,
+                      "exit_code": exit_code,
+                      "servertime": int(time.time()),
+                      "output": output, "stderr": stderr })
+
+def claim(path):
+    """Claim the spool file for loading.
+
+    The spool is renamed to path.<time>.<pid>.load, so that the writers
+    start a new one.  If a file of that name is left from an earlier
+    claim in the same second, the time is counted up.
+
+    @return the list of the claimed files to load, oldest first; this
+            includes the ones left by earlier loads that failed.
+    """
+    try:
+        fd = os.open(path, os.O_WRONLY)
+    except FileNotFoundError:
+        pass
+    else:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size > 0:
+                t = int(time.time())
+                while True:
+                    claimed = "%s.%d.%d.load" % (path, t, os.getpid())
+                    if not os.path.exists(claimed):
+                        break
+                    t += 1
+                os.rename(path, claimed)
+        finally:
+            os.close(fd)
+    return sorted(glob.glob(glob.escape(path) + ".*.load"),
+                  key=lambda p: [ int(x) for x in p.split(".")[-3:-1] ])
+
+def read(path):
+    """Read the records of a spool file.
+
+    A last line without its newline is from a write cut short, and is
+    skipped, as are lines that don't parse.
+    """
+    records = []
+    with open(path, "rb") as f:
+        for (i, l) in enumerate(f):
+            if not l.endswith(b"\n"):
+                sys.stderr.write("Warning:  %s: incomplete last line,"
+                                 " skipped.\n" % (path,))
+                break
+            try:
+                records.append(json.loads(l))
+            except ValueError:
+                sys.stderr.write("Warning:  %s:%d: invalid record,"
+                                 " skipped.\n" % (path, i + 1))
+    return records
+
+class InterfaceCache(object):
+    """Local copy of the interfaces run_wrinfo.py looks up in the DB.
+
+    Holds, for each radio_if id, the tuple (ap_id, ifname, measuring,
+    wrinfo_cmd, ip_addr, in_use) of the interface and its AP.  The copy
+    is read from a JSON file, and refresh() replaces it, and the file,
+    with the DB's rows whenever the DB is reachable.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.interfaces = {}
+        try:
+            with open(path) as f:
+                self.interfaces = dict((int(k), tuple(v)) for (k, v)
+                                       in json.load(f)["interfaces"].items())
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError):
+            sys.stderr.write("Warning:  %s: invalid interface cache,"
+                             " ignored.\n" % (path,))
+
+    def refresh(self, cursor):
+        """Reload the interfaces from the DB, and save them."""
+        cursor.execute("""SELECT radio_if.id, ap_id, ifname, measuring,
+          wrinfo_cmd, ip_addr, in_use
+        FROM radio_if LEFT JOIN ap ON ap.id = radio_if.ap_id""")
+        interfaces = dict((row[0], tuple(row[1:])) for row in cursor)
+        tmp = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({ "servertime": int(time.time()),
+                        "interfaces": interfaces }, f)
+        os.replace(tmp, self.path)
+        self.interfaces = interfaces
+
+    def get(self, if_id):
+        """Return the tuple of an interface, None if it's unknown."""
+        return self.interfaces.get(if_id)
+
+    def measured(self):
+        """Return the ids of the measured interfaces."""
+        return sorted(if_id for (if_id, row) in self.interfaces.items()
+                      if row[2])
@@ -0,0 +1,249 @@
+"""
+Persistent SSH sessions to the APs.
+
+Opening an SSH connection to a low power AP (key exchange and
+authentication) often takes longer than the command run over it.  The
+SSHSessions class keeps one connection per AP open across commands,
+using OpenSSH connection multiplexing:  a master connection is set up
+once per AP, and commands are then run as new sessions over it.  With
+ControlPersist, the master connection outlives the process that
+created it, so even separate run_wrinfo.py invocations share it.
+
+The check for a master connection and its setup are serialized per AP,
+so that concurrent commands to the radios of one AP don't both start
+one:  the second ssh -f would find the control socket taken and stay
+in the background as a plain session.
+
+The time taken to establish master connections and to run commands is
+recorded per AP, to check the savings.
+"""
+
+import asyncio
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import weakref
+
+def _remaining(deadline):
+    """Number of seconds left until deadline (a time.monotonic() value),
+    or None if there's none."""
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+class SSHSessions(object):
+    def __init__(self, user = "root", persist = 600, control_dir = None):
+        """Create the session manager.
+
+        @param  user
+                user name to log in with on the APs.
+
+        @param  persist
+                number of seconds an idle master connection stays open.
+
+        @param  control_dir
+                directory holding the control sockets; defaults to a
+                per-user directory in the temp directory.
+        """
+        if control_dir is None:
+            control_dir = os.path.join(tempfile.gettempdir(),
+                                       "wifispecman-ssh-%d" % (os.getuid(),))
+        os.makedirs(control_dir, mode=0o700, exist_ok=True)
+        self.user = user
+        self.persist = persist
+        self.control_dir = control_dir
+
+        # host -> [ connects, connect time, execs, exec time ]
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+        # host -> lock serializing the connects of connect(); and, per
+        # event loop, host -> asyncio.Lock for connect_async()
+        self._locks = {}
+        self._async_locks = weakref.WeakKeyDictionary()
+
+    def _options(self, master = "auto"):
+        return [ "-o", "ControlMaster=%s" % (master,),
+                 "-o", "ControlPersist=%d" % (self.persist,),
+                 "-o", "ControlPath=%s" % (os.path.join(self.control_dir,
+                                                        "%r@%h:%p"),) ]
+
+    def _destination(self, host):
+        return "%s@%s" % (self.user, host)
+
+    def _record(self, host, idx, dt):
+        with self._stats_lock:
+            st = self.stats.setdefault(host, [ 0, 0.0, 0, 0.0 ])
+            st[idx] += 1
+            st[idx + 1] += dt
+
+    def _lock(self, host):
+        with self._stats_lock:
+            return self._locks.setdefault(host, threading.Lock())
+
+    def _async_lock(self, host):
+        loop = asyncio.get_running_loop()
+        with self._stats_lock:
+            return self._async_locks.setdefault(loop, {}) \
+                    .setdefault(host, asyncio.Lock())
+
+    def command(self, host, args):
+        """Return the ssh command line running args on host.
+
+        The command uses the master connection of host if there is one,
+        and becomes the master connection otherwise.
+        """
+        return [ "ssh", "-n", "-T" ] + self._options() \
+                + [ self._destination(host) ] + list(args)
+
+    def _check_command(self, host):
+        return [ "ssh", "-O", "check" ] + self._options() \
+                + [ self._destination(host) ]
+
+    def _connect_command(self, host):
+        return [ "ssh", "-f", "-N" ] + self._options("yes") \
+                + [ self._destination(host) ]
+
+    def is_connected(self, host):
+        """Check if there's a master connection to host."""
+        result = subprocess.run(self._check_command(host),
+                        stdin=subprocess.DEVNULL,
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL)
+        return result.returncode == 0
+
+    def connect(self, host, timeout=None):
+        """Establish the master connection to host, if not already up.
+
+        @param  timeout
+                number of seconds the whole takes at most, including the
+                wait for a concurrent connect to the same host.
+
+        @return True if the master connection is up.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        lock = self._lock(host)
+        if not lock.acquire(timeout=-1 if timeout is None else timeout):
+            return False
+        try:
+            if self.is_connected(host):
+                return True
+            t0 = time.monotonic()
+            try:
+                result = subprocess.run(self._connect_command(host),
+                                stdin=subprocess.DEVNULL,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL,
+                                timeout=_remaining(deadline))
+            except subprocess.TimeoutExpired:
+                return False
+            if result.returncode != 0:
+                return False
+            self._record(host, 0, time.monotonic() - t0)
+            return True
+        finally:
+            lock.release()
+
+    async def connect_async(self, host, timeout=None):
+        """Coroutine version of connect()."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        async def _run(cmd):
+            proc = await asyncio.create_subprocess_exec(*cmd,
+                            stdin=asyncio.subprocess.DEVNULL,
+                            stdout=asyncio.subprocess.DEVNULL,
+                            stderr=asyncio.subprocess.DEVNULL)
+            try:
+                return await asyncio.wait_for(proc.wait(),
+                                              _remaining(deadline))
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                return None
+
+        lock = self._async_lock(host)
+        try:
+            await asyncio.wait_for(lock.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        try:
+            if await _run(self._check_command(host)) == 0:
+                return True
+            t0 = time.monotonic()
+            if await _run(self._connect_command(host)) != 0:
+                return False
+            self._record(host, 0, time.monotonic() - t0)
+            return True
+        finally:
+            lock.release()
+
+    def run(self, host, args, timeout=None, text=True):
+        """Run args on host over the master connection.
+
+        The arguments and return value are those of subprocess.run(),
+        with output captured as text, or bytes if text is false;
+        subprocess.TimeoutExpired is raised on timeout.  The timeout
+        covers setting up the master connection as well.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.connect(host, timeout)
+        t0 = time.monotonic()
+        remaining = _remaining(deadline)
+        if remaining is not None and remaining <= 0:
+            raise subprocess.TimeoutExpired(self.command(host, args),
+                                            timeout)
+        result = subprocess.run(self.command(host, args),
+                        stdin=subprocess.DEVNULL,
+                        capture_output=True,
+                        text=text,
+                        timeout=remaining)
+        self._record(host, 2, time.monotonic() - t0)
+        return result
+
+    async def run_async(self, host, args, timeout=None):
+        """Coroutine version of run().
+
+        @return Tuple (returncode, stdout, stderr), with the output as
+                bytes.  asyncio.TimeoutError is raised on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        await self.connect_async(host, timeout)
+        t0 = time.monotonic()
+        timeout = _remaining(deadline)
+        if timeout is not None and timeout <= 0:
+            raise asyncio.TimeoutError()
+        proc = await asyncio.create_subprocess_exec(
+                        *self.command(host, args),
+                        stdin=asyncio.subprocess.DEVNULL,
+                        stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(),
+                                                    timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise
+        self._record(host, 2, time.monotonic() - t0)
+        return (proc.returncode, stdout, stderr)
+
+    def close(self, host):
+        """Close the master connection to host."""
+        subprocess.run([ "ssh", "-O", "exit" ] + self._options()
+                        + [ self._destination(host) ],
+                       stdin=subprocess.DEVNULL,
+                       stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+
+    def format_stats(self):
+        """Format the per-AP connect and exec latencies as text."""
+        lines = [ "%-16s %8s %10s %8s %10s" % ("host", "connects",
+                    "avg conn", "execs", "avg exec") ]
+        for host in sorted(self.stats):
+            nc, tc, ne, te = self.stats[host]
+            lines.append("%-16s %8d %9.3fs %8d %9.3fs" % (host,
+                    nc, tc / nc if nc > 0 else 0,
+                    ne, te / ne if ne > 0 else 0))
+        return "\n".join(lines)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+"""
+Streaming wrinfo ingester.
+
+Rather than starting a new wrinfo (and ssh connection) for every
+sample, this keeps wrinfo running on the APs in streaming mode
+(wrinfo -l), where it outputs one record per interval as a line of
+JSON.  Each record is written to the DB as it arrives, the same way
+run_wrinfo.py writes the output of a one-shot wrinfo run.  A DB error
+only loses the record at hand:  the connection is reestablished and
+the streams go on.
+"""
+
+import asyncio
+import sys
+
+import mysql.connector as db
+
+import metrics
+import run_wrinfo
+import sshsession
+
+async def _read_lines(stream, lines):
+    while True:
+        l = await stream.readline()
+        if not l:
+            return
+        lines.append(l.decode(errors="replace"))
+
+def _recover(conn, if_id, e):
+    """Roll back after a DB error while handling an interface, and
+    reconnect if the connection was lost."""
+    sys.stderr.write("Error:  DB error on interface %d: %s\n" % (if_id, e))
+    try:
+        conn.rollback()
+    except db.Error:
+        pass
+    try:
+        conn.ping(reconnect=True, attempts=1)
+    except db.Error as e:
+        sys.stderr.write("Error:  Can't reconnect to the DB: %s\n" % (e,))
+
+async def _stream_interface(conn, cursor, if_id, rungroup_id, interval,
+  sessions, restart_delay):
+    """Ingest the records of one interface, restarting wrinfo if needed."""
+    while True:
+        try:
+            succ, ip_addr, cmd = run_wrinfo._get_wrinfo_cmd(conn, cursor,
+                                                            if_id, False)
+        except db.Error as e:
+            _recover(conn, if_id, e)
+            await asyncio.sleep(restart_delay)
+            continue
+        if succ == False or cmd is None:
+            return
+        cmd = cmd + [ "-l", "%d" % (interval,) ]
+        if sessions is not None and ip_addr is not None:
+            await sessions.connect_async(ip_addr, 3 * interval)
+            cmd = sessions.command(ip_addr, cmd)
+        else:
+            cmd = run_wrinfo._ssh_cmd(ip_addr, cmd)
+
+        proc = await asyncio.create_subprocess_exec(*cmd,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE)
+        errors = []
+        stderr_task = asyncio.create_task(_read_lines(proc.stderr, errors))
+
+        # Each line is a record; stderr output is attached to the next
+        # record.  If no record arrives in a while, the stream is
+        # considered hung.
+        while True:
+            try:
+                l = await asyncio.wait_for(proc.stdout.readline(),
+                                           3 * interval)
+            except asyncio.TimeoutError:
+                sys.stderr.write("Info:  No record from interface %d in"
+                    " %ds, restarting.\n" % (if_id, 3 * interval))
+                proc.kill()
+                break
+            if not l:
+                break
+            stderr = "".join(errors)
+            errors.clear()
+            try:
+                run_wrinfo._store_result(conn, cursor, if_id, rungroup_id, 0,
+                                         None, l, stderr)
+            except db.Error as e:
+                _recover(conn, if_id, e)
+
+        exit_code = await proc.wait()
+        await stderr_task
+        sys.stderr.write("Info:  Stream of interface %d ended with exit"
+            " code %d.\n" % (if_id, exit_code))
+        await asyncio.sleep(restart_delay)
+
+async def _stream(conn, cursor, if_ids, cmdline, tag, interval, sessions,
+  restart_delay):
+    if if_ids is None:
+        cursor.execute("SELECT id FROM radio_if WHERE measuring = 1")
+        if_ids = [ row[0] for row in cursor ]
+    rungroup_id = run_wrinfo._create_rungroup(cursor, cmdline, tag)
+    conn.commit()
+    await asyncio.gather(*[ _stream_interface(conn, cursor, if_id,
+                                rungroup_id, interval, sessions,
+                                restart_delay)
+                            for if_id in if_ids ])
+
+def stream_wrinfo(dbname, if_ids, cmdline, tag, interval, sessions=None,
+  restart_delay=10):
+    """Ingest streaming wrinfo records, until interrupted.
+
+    @param  if_ids
+            list of the interfaces to ingest; None for all the measured
+            interfaces.
+
+    @param  interval
+            number of seconds between records.
+
+    @param  restart_delay
+            number of seconds to wait before restarting a stream that
+            ended.
+    """
+    conn = db.connect(user='wifispecman',
+                      password='password',
+                      database=dbname)
+    cursor = metrics.CountingCursor(conn.cursor())
+    try:
+        asyncio.run(_stream(conn, cursor, if_ids, cmdline, tag, interval,
+                            sessions, restart_delay))
+    finally:
+        conn.close()
+
+def usage():
+    print(  "stream_wrinfo\n"
+            "\n"
+            "utility to run wrinfo in streaming mode on remote hosts and\n"
+            "update the database with each record as it arrives\n"
+            "\n"
+            "   -h         display help and exit\n"
+            "   -d <name>  connect to database with given name [wifispecman]\n"
+            "   -i #       interface ID (radio_if.id value from DB); can be\n"
+            "              given several times.  Default: all measured\n"
+            "              interfaces\n"
+            "   -l #       seconds between records [30]\n"
+            "   -T <name>  tag name to associate with run\n"
+            "   -M         don't use multiplexed SSH connections\n"
+    )
+
+if __name__ == "__main__":
+    import getopt
+
+    # Default settings
+    if_ids = None
+    dbname = "wifispecman"
+    interval = 30
+    tag = None
+    multiplex = True
+
+    # Parse cmdline args
+    opts, args = getopt.getopt(sys.argv[1:], "hd:i:l:T:M")
+    for k, v in opts:
+        if k == '-h':
+            usage()
+            sys.exit(0)
+        elif k == '-d':
+            dbname = v
+        elif k == '-i':
+            if if_ids is None:
+                if_ids = []
+            if_ids.append(int(v))
+        elif k == '-l':
+            interval = int(v)
+        elif k == '-T':
+            tag = v
+        elif k == '-M':
+            multiplex = False
+        else:
+            sys.exit(1)
+
+    sessions = sshsession.SSHSessions() if multiplex else None
+    stream_wrinfo(dbname, if_ids, ' '.join(sys.argv), tag, interval,
+                  sessions)
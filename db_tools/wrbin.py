@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+"""
+Decoder for the binary output of wrinfo -b.
+
+The format is described in wrinfo/wbin.h.  decode() turns a record into
+the same dict json.loads() makes of the JSON output, so that
+run_wrinfo.py inserts it the same way.  encode() is the reverse, as
+wrinfo does it; together with the standalone utility, which compares
+the size and decode time of both formats, it serves to check the
+decoder without an AP.
+"""
+
+import json
+import struct
+import sys
+import time
+
+MAGIC = b"WRB1"
+
+_HEADER = struct.Struct("<4sI")
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_IFC_INTS = struct.Struct("<5I")
+_SCAN = struct.Struct("<B6sIH")
+_SURVEY = struct.Struct("<HIb5Q")
+
+# Flags and keys of the interface fields, in the order of the record
+_IFC_FIELDS = ( (0x001, "interface"),
+                (0x002, "ifindex"),
+                (0x004, "mac"),
+                (0x008, "ssid"),
+                (0x010, "frequency"),
+                (0x020, "channel_width_enum"),
+                (0x040, "center_freq1"),
+                (0x080, "center_freq2"),
+                (0x100, "channel_type_enum") )
+
+_SCAN_BSSID = 0x1
+_SCAN_FREQUENCY = 0x2
+_SCAN_SSID = 0x4
+
+# Flags and keys of the survey fields after in_use, in the order of the
+# record
+_SURVEY_IN_USE = 0x02
+_SURVEY_FIELDS = ( (0x01, "frequency"),
+                   (0x04, "noise"),
+                   (0x08, "time"),
+                   (0x10, "busy"),
+                   (0x20, "ext_busy"),
+                   (0x40, "rx"),
+                   (0x80, "tx") )
+_SURVEY_ALL = 0xfd
+_SURVEY_KEYS = tuple(key for (bit, key) in _SURVEY_FIELDS)
+
+def is_binary(data):
+    """Tell whether data (bytes) is a binary record."""
+    return data[:len(MAGIC)] == MAGIC
+
+def _format_mac(b):
+    return b.hex(":")
+
+def _parse_mac(s):
+    return bytes(int(x, 16) for x in s.split(":"))
+
+class _Reader(object):
+    """Reads data[pos:end] from the front."""
+
+    def __init__(self, data, pos, end):
+        self.data = data
+        self.pos = pos
+        self.end = end
+
+    def bytes(self, n):
+        if self.pos + n > self.end:
+            raise ValueError("truncated record")
+        ret = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return ret
+
+    def unpack(self, st):
+        return st.unpack(self.bytes(st.size))
+
+    def str(self):
+        n, = self.unpack(_U16)
+        return self.bytes(n).decode(errors="replace")
+
+def decode(data):
+    """Decode a binary record.
+
+    @return Dict with the interface, scan, survey and meta items of the
+            JSON record.  The interface item is missing if wrinfo got
+            no interface information.
+
+    Raises ValueError if data isn't a complete record.
+    """
+    try:
+        magic, length = _HEADER.unpack_from(data, 0)
+    except struct.error:
+        raise ValueError("truncated record")
+    if magic != MAGIC:
+        raise ValueError("not a binary wrinfo record")
+    if len(data) < _HEADER.size + length:
+        raise ValueError("truncated record")
+    r = _Reader(data, _HEADER.size, _HEADER.size + length)
+    try:
+        D = {}
+
+        # Meta
+        time_unix, = r.unpack(_I64)
+        time_human = r.str()
+        D["meta"] = { "cmdline": r.str(),
+                      "time_human": time_human,
+                      "time_unix": time_unix }
+
+        # Interface
+        n, = r.unpack(_U8)
+        if n > 0:
+            flags, = r.unpack(_U16)
+            values = [ r.str() ]
+            values += r.unpack(_U32)
+            values.append(_format_mac(r.bytes(6)))
+            values.append(r.str())
+            values += r.unpack(_IFC_INTS)
+            D["interface"] = dict((key, v) for ((bit, key), v)
+                                  in zip(_IFC_FIELDS, values) if flags & bit)
+
+        # SSID dictionary
+        n, = r.unpack(_U16)
+        ssids = [ r.str() for i in range(n) ]
+
+        # Scan
+        n, = r.unpack(_U16)
+        scan = []
+        for (flags, bssid, frequency, ssid) in \
+                _SCAN.iter_unpack(r.bytes(n * _SCAN.size)):
+            if flags == _SCAN_BSSID | _SCAN_FREQUENCY | _SCAN_SSID:
+                # The usual case
+                scan.append({ "bssid": bssid.hex(":"),
+                              "frequency": frequency,
+                              "ssid": ssids[ssid] })
+                continue
+            E = {}
+            if flags & _SCAN_BSSID:
+                E["bssid"] = _format_mac(bssid)
+            if flags & _SCAN_FREQUENCY:
+                E["frequency"] = frequency
+            if flags & _SCAN_SSID:
+                E["ssid"] = ssids[ssid]
+            scan.append(E)
+        D["scan"] = scan
+
+        # Survey
+        n, = r.unpack(_U16)
+        survey = []
+        for values in _SURVEY.iter_unpack(r.bytes(n * _SURVEY.size)):
+            flags = values[0]
+            if flags & _SURVEY_ALL == _SURVEY_ALL:
+                E = dict(zip(_SURVEY_KEYS, values[1:]))
+            else:
+                E = dict((key, v) for ((bit, key), v)
+                         in zip(_SURVEY_FIELDS, values[1:]) if flags & bit)
+            E["in_use"] = bool(flags & _SURVEY_IN_USE)
+            survey.append(E)
+        D["survey"] = survey
+    except IndexError:
+        raise ValueError("SSID index out of range")
+    return D
+
+def _pack_str(s):
+    b = s.encode()
+    return _U16.pack(len(b)) + b
+
+def encode(D):
+    """Encode a record, as returned by json.loads() or decode(), the
+    way wrinfo -b does."""
+    parts = []
+
+    meta = D["meta"]
+    parts.append(_I64.pack(meta["time_unix"]))
+    parts.append(_pack_str(meta.get("time_human", "")))
+    parts.append(_pack_str(meta.get("cmdline", "")))
+
+    ifc = D.get("interface")
+    if ifc is None:
+        parts.append(_U8.pack(0))
+    else:
+        flags = 0
+        for (bit, key) in _IFC_FIELDS:
+            if key in ifc:
+                flags |= bit
+        parts.append(_U8.pack(1) + _U16.pack(flags))
+        parts.append(_pack_str(ifc.get("interface", "")))
+        parts.append(_U32.pack(ifc.get("ifindex", 0)))
+        parts.append(_parse_mac(ifc["mac"]) if "mac" in ifc else bytes(6))
+        parts.append(_pack_str(ifc.get("ssid", "")))
+        parts.append(_IFC_INTS.pack(*[ ifc.get(key, 0) for (bit, key)
+                                       in _IFC_FIELDS[4:] ]))
+
+    ssids = {}
+    scan = []
+    for E in D["scan"]:
+        flags = 0
+        if "bssid" in E:
+            flags |= _SCAN_BSSID
+        if "frequency" in E:
+            flags |= _SCAN_FREQUENCY
+        if "ssid" in E:
+            flags |= _SCAN_SSID
+        ssid = ssids.setdefault(E["ssid"], len(ssids)) if "ssid" in E else 0
+        scan.append(_SCAN.pack(flags,
+                    _parse_mac(E["bssid"]) if "bssid" in E else bytes(6),
+                    E.get("frequency", 0), ssid))
+    parts.append(_U16.pack(len(ssids)))
+    parts += [ _pack_str(s) for s in ssids ]
+    parts.append(_U16.pack(len(scan)))
+    parts += scan
+
+    parts.append(_U16.pack(len(D["survey"])))
+    for E in D["survey"]:
+        flags = _SURVEY_IN_USE if E.get("in_use") else 0
+        for (bit, key) in _SURVEY_FIELDS:
+            if key in E:
+                flags |= bit
+        parts.append(_SURVEY.pack(flags,
+                     *[ E.get(key, 0) for (bit, key) in _SURVEY_FIELDS ]))
+
+    rec = b"".join(parts)
+    return _HEADER.pack(MAGIC, len(rec)) + rec
+
+def synthetic_record(n_bssids, n_ssids=20, n_channels=30):
+    """A made up record with a scan of n_bssids BSSIDs sharing n_ssids
+    SSIDs, and a survey of n_channels channels."""
+    freqs = [ 2412 + 5 * i for i in range(11) ] \
+          + [ 5180 + 20 * i for i in range(n_channels - 11) ]
+    t = 1700000000
+    return {
+        "interface": { "interface": "wlan0", "ifindex": 12,
+                       "mac": "02:00:00:00:00:01", "ssid": "specman",
+                       "frequency": 5180, "channel_width_enum": 3,
+                       "center_freq1": 5210, "channel_type_enum": 1 },
+        "scan": [ { "bssid": _format_mac(bytes([ 2, 0, 0, 0,
+                                                  i // 256, i % 256 ])),
+                    "frequency": freqs[i % len(freqs)],
+                    "ssid": "network-%d" % (i % n_ssids,) }
+                  for i in range(n_bssids) ],
+        "survey": [ { "frequency": f, "in_use": f == 5180, "noise": -95,
+                      "time": 123456789 + i, "busy": 23456789 + i,
+                      "ext_busy": 0, "rx": 3456789 + i, "tx": 456789 + i }
+                    for (i, f) in enumerate(freqs) ],
+        "meta": { "cmdline": "./wrinfo -i wlan0 -s",
+                  "time_human": time.ctime(t) + "\n",
+                  "time_unix": t },
+    }
+
+def _decode_time(f, data, repeat):
+    t0 = time.perf_counter()
+    for i in range(repeat):
+        f(data)
+    return (time.perf_counter() - t0) / repeat
+
+def compare(name, json_data, repeat):
+    """Print the size and decode time of a record in both formats."""
+    D = json.loads(json_data)
+    bin_data = encode(D)
+    if decode(bin_data) != D:
+        sys.stderr.write("Warning:  %s doesn't round trip.\n" % (name,))
+    t_json = _decode_time(json.loads, json_data, repeat)
+    t_bin = _decode_time(decode, bin_data, repeat)
+    print("%-24s %4d %4d  %8d %8d %5.1fx  %8.1f %8.1f %5.2fx"
+          % (name, len(D["scan"]), len(D["survey"]),
+             len(json_data), len(bin_data), len(json_data) / len(bin_data),
+             1e6 * t_json, 1e6 * t_bin, t_json / t_bin))
+
+def usage():
+    print(  "wrbin\n"
+            "\n"
+            "utility to compare the size and decode time of the JSON and\n"
+            "binary wrinfo output.  The records are read from the given\n"
+            "JSON files (wrinfo output), or made up if none are given\n"
+            "\n"
+            "   -h         display help and exit\n"
+            "   -n #,...   numbers of BSSIDs of made up records\n"
+            "              [0,20,100,500]\n"
+            "   -r #       number of times to decode each record [200]\n"
+    )
+
+if __name__ == "__main__":
+    import getopt
+
+    # Default settings
+    n_bssids = [ 0, 20, 100, 500 ]
+    repeat = 200
+
+    # Parse cmdline args
+    opts, args = getopt.getopt(sys.argv[1:], "hn:r:")
+    for k, v in opts:
+        if k == '-h':
+            usage()
+            sys.exit(0)
+        elif k == '-n':
+            n_bssids = [ int(x) for x in v.split(",") ]
+        elif k == '-r':
+            repeat = int(v)
+        else:
+            sys.exit(1)
+
+    print("%-24s %4s %4s  %8s %8s %6s  %8s %8s %6s"
+          % ("record", "scan", "surv", "json B", "bin B", "ratio",
+             "json us", "bin us", "ratio"))
+    if len(args) > 0:
+        for path in args:
+            with open(path, "rb") as f:
+                compare(path, f.read().decode(errors="replace"), repeat)
+    else:
+        for n in n_bssids:
+            # Indented as wrinfo's JSON output
+            compare("%d BSSIDs" % (n,),
+                    json.dumps(synthetic_record(n), indent=2), repeat)
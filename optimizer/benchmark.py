@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of the collector and the optimizer on a synthetic site.
+
+Fills a throwaway database with a generated site:  APs with their
+radios, scans with a given neighbor density, and some days of survey
+history of the given survey types.  Then times the steps of the data
+collection and the solver one by one, counting the DB queries each
+makes and the peak memory it allocates.
+
+The results are written as one JSON object per run, so that they can
+be collected and compared across versions.
+"""
+
+import os
+import sys
+
+# The data collection tools, after the modules of this directory
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "db_tools"))
+
+import collector
+import json
+import optimizer
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+
+import metrics
+import migrate
+import rollup
+
+# The tables emptied before generate() fills the DB
+_tables = ( "ap", "radio_if", "rungroup", "wrinfo", "wrinfo_meta",
+            "wrinfo_interface", "wrinfo_scan", "wrinfo_survey",
+            "wrinfo_slice", "wrinfo_errors", "wrinfo_edge",
+            "wrinfo_tx_hist" )
+
+# Number of rows inserted per statement
+_BATCH_SIZE = 2000
+
+def _queries():
+    """The number of SQL statements the metrics.CountingCursor cursors
+    have executed so far."""
+    return sum(v for ((name, labels), v) in metrics.registry.values.items()
+               if name == "sql_statements_total")
+
+class _Inserter(object):
+    """Batched inserts of rows into a table."""
+
+    def __init__(self, cursor, table, cols):
+        self.cursor = cursor
+        self.sql = "INSERT INTO %s (%s) VALUES (%s)" % \
+                    (table, ", ".join(cols), ", ".join(len(cols) * ["%s"]))
+        self.rows = []
+        self.count = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= _BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if len(self.rows) > 0:
+            self.cursor.executemany(self.sql, self.rows)
+            self.count += len(self.rows)
+            self.rows = []
+
+def setup_db(dbname):
+    """Create the tables of a database, bring them up to date and empty
+    them.
+
+    @return Tuple (conn, cursor).
+    """
+    db_tools = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "..", "db_tools")
+    subprocess.run([ "sh", "create_tables.sh", dbname ], cwd=db_tools,
+                   check=True)
+    conn, cursor = collector.open_db(dbname)
+    migrate.migrate(conn, cursor, verbose=False)
+    for table in _tables:
+        cursor.execute("TRUNCATE TABLE %s" % (table,))
+    conn.commit()
+    return (conn, cursor)
+
+def _survey_entry(r, survey_type, freq, in_use, load, interval, counters):
+    """Generate a survey entry, as output by wrinfo.
+
+    @param  load
+            mean busy fraction of the channel.
+
+    @param  counters
+            the running counters (time, busy, rx, tx) of survey_type 1;
+            updated in place.
+    """
+    entry = { "frequency": freq, "in_use": in_use, "noise": -95 }
+    if survey_type == 0:
+        return entry
+    t = 1000 * interval if survey_type == 1 else r.randint(1000, 5000)
+    busy = int(t * min(1.0, max(0.0, r.gauss(load, 0.1))))
+    rx = int(busy * r.uniform(0.3, 0.9))
+    tx = int((busy - rx) * r.random()) if in_use else 0
+    values = (t, busy, rx, tx)
+    if survey_type == 1:
+        for i in range(4):
+            counters[i] += values[i]
+        values = tuple(counters)
+    entry.update(zip(("time", "busy", "rx", "tx"), values))
+    return entry
+
+def generate(conn, cursor, n_ap, radios, channels, density, survey_types,
+  days, interval=300, scan_every=12, seed=1, now=None):
+    """Fill the database with a synthetic site.
+
+    @param  n_ap, radios
+            number of APs, and of radios per AP.
+
+    @param  density
+            probability that two radios on different APs find each other
+            in their scans.
+
+    @param  survey_types
+            survey types to pick from, at random, for each radio.
+
+    @param  days, interval, scan_every
+            length of the history in days; seconds between the wrinfo
+            runs of a radio; number of runs between scans.
+
+    @return dict table -> number of rows inserted.
+    """
+    r = random.Random(seed)
+    if now is None:
+        now = int(time.time())
+    n = n_ap * radios
+    macs = [ "02:00:%02x:%02x:%02x:%02x" % ((i >> 24) & 255,
+             (i >> 16) & 255, (i >> 8) & 255, i & 255) for i in range(n) ]
+
+    ins = dict((t, _Inserter(cursor, t, cols)) for (t, cols) in (
+        ("ap", ("id", "ip_addr", "in_use")),
+        ("radio_if", ("id", "ap_id", "ifname", "measuring", "optimising",
+                      "survey_type")),
+        ("wrinfo", ("wrinfo_id", "radio_if_id", "status", "exit_code",
+                    "servertime")),
+        ("wrinfo_interface", ("wrinfo_id", "mac", "frequency")),
+        ("wrinfo_scan", ("wrinfo_id", "servertime", "bssid", "frequency")),
+        ("wrinfo_survey", ("wrinfo_id", "servertime", "frequency", "in_use",
+                           "noise", "time", "busy", "rx", "tx")),
+        ("wrinfo_edge", ("mac", "bssid", "first_seen", "last_seen",
+                         "sightings")),
+    ))
+
+    # The site
+    types = []
+    for a in range(n_ap):
+        ins["ap"].add( (a + 1, "10.%d.%d.%d" % ((a >> 16) & 255,
+                        (a >> 8) & 255, a & 255), 1) )
+        for k in range(radios):
+            i = a * radios + k
+            types.append(r.choice(survey_types))
+            ins["radio_if"].add( (i + 1, a + 1, "wlan%d" % (k,), 1, 1,
+                                  types[i]) )
+    neighbors = [ [] for i in range(n) ]
+    for i in range(n):
+        for j in range(i + 1, n):
+            if i // radios != j // radios and r.random() < density:
+                neighbors[i].append(j)
+                neighbors[j].append(i)
+
+    # The history, one radio at a time
+    runs = int(days * 86400) // interval
+    wrinfo_id = 0
+    slices = {}
+    hists = {}
+    edges = {}
+    for i in range(n):
+        freq = r.choice(channels)
+        load = dict((c, r.uniform(0.05, 0.6)) for c in channels)
+        counters = dict((c, [ 0, 0, 0, 0 ]) for c in channels)
+        prev = {}
+        offset = r.randrange(interval)
+        for k in range(runs):
+            wrinfo_id += 1
+            servertime = now - (runs - k) * interval + offset
+            ins["wrinfo"].add( (wrinfo_id, i + 1, 0, 0, servertime) )
+            ins["wrinfo_interface"].add( (wrinfo_id, macs[i], freq) )
+            survey = [ _survey_entry(r, types[i], c, c == freq, load[c],
+                                     interval, counters[c])
+                       for c in channels ]
+            for e in survey:
+                ins["wrinfo_survey"].add( (wrinfo_id, servertime,
+                    e["frequency"], e["in_use"], e["noise"], e.get("time"),
+                    e.get("busy"), e.get("rx"), e.get("tx")) )
+            rollup.accumulate(slices, types[i], i + 1, servertime, survey,
+                              prev)
+            rollup.accumulate_tx_hist(hists, types[i], i + 1, servertime,
+                                      survey, prev)
+            prev = dict((e["frequency"], e) for e in survey)
+            if k % scan_every == 0:
+                for j in neighbors[i]:
+                    ins["wrinfo_scan"].add( (wrinfo_id, servertime, macs[j],
+                                             freq) )
+                    e = edges.setdefault((macs[i], macs[j]),
+                                         [ servertime, servertime, 0 ])
+                    e[1] = servertime
+                    e[2] += 1
+    for ((mac, bssid), e) in edges.items():
+        ins["wrinfo_edge"].add( (mac, bssid) + tuple(e) )
+    for x in ins.values():
+        x.flush()
+    rollup.write_slices(cursor, slices)
+    rollup.write_tx_hist(cursor, hists)
+    conn.commit()
+
+    counts = dict((t, x.count) for (t, x) in ins.items())
+    counts["wrinfo_slice"] = len(slices)
+    counts["wrinfo_tx_hist"] = len(hists)
+    return counts
+
+def _commit_id():
+    """The git commit of the code, if known."""
+    try:
+        result = subprocess.run([ "git", "rev-parse", "HEAD" ],
+                        cwd=os.path.dirname(os.path.abspath(__file__)),
+                        capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def run_benchmark(conn, cursor, channels, algorithm='anneal',
+  time_budget=2.0, seed=1, processes=1, use_slices=False, batched=True):
+    """Time the collector steps and the solver.
+
+    @param  batched
+            if set, the channel scores and TX values are computed from
+            one SurveyData (or SliceData) object, as collect_data()
+            does; otherwise each makes its own queries, sharing a
+            StatsCache.
+
+    @return Tuple (phases, instance); phases is a list of dicts with the
+            name, seconds, queries and peak_bytes of each step, instance
+            a dict describing the problem instance and solution.
+    """
+    cur = metrics.CountingCursor(cursor)
+    phases = []
+    def measure(name, f):
+        tracemalloc.reset_peak()
+        m0 = tracemalloc.get_traced_memory()[0]
+        q0 = _queries()
+        t0 = time.perf_counter()
+        result = f()
+        phases.append({ "name": name,
+                        "seconds": time.perf_counter() - t0,
+                        "queries": _queries() - q0,
+                        "peak_bytes": tracemalloc.get_traced_memory()[1]
+                                      - m0 })
+        return result
+
+    tracemalloc.start()
+    try:
+        nodes = measure("get_nodes", lambda: collector.get_nodes(conn, cur))
+        graph = measure("get_graph",
+                        lambda: collector.get_graph(conn, cur, nodes))
+        time_cutoff = collector.get_time_cutoff()
+        survey_data = None
+        if batched:
+            loader = collector.SliceData if use_slices \
+                        else collector.SurveyData
+            survey_data = measure("survey_data", lambda: loader(conn, cur,
+                            [ ifid for (ifid, mac) in nodes ], channels,
+                            time_cutoff))
+        cache = None if batched else collector.StatsCache()
+        measure("get_node_channel_scores", lambda: [
+                    collector.get_node_channel_scores(conn, cur, nodes, i,
+                        graph.get(i, []), channels,
+                        survey_data=survey_data, cache=cache,
+                        time_cutoff=time_cutoff)
+                    for i in range(len(nodes)) ])
+        measure("get_tx_value", lambda: [
+                    collector.get_tx_value(conn, cur, nodes, i,
+                        survey_data=survey_data, cache=cache)
+                    for i in range(len(nodes)) ])
+        inst = optimizer.ChannelProblemInstance()
+        measure("collect_data",
+                lambda: inst.collect_data(conn, cur, channels, use_slices))
+        score, assign = measure("solve",
+                lambda: inst.solve_by_components(algorithm, time_budget,
+                            seed, processes, verbose=False))
+    finally:
+        tracemalloc.stop()
+
+    instance = { "nodes": len(nodes),
+                 "edges": sum(len(v) for v in graph.values()) // 2,
+                 "components": len(inst.split_components()),
+                 "score": score }
+    return (phases, instance)
+
+def _usage():
+    print("Collector and optimizer benchmark on a synthetic site")
+    print("")
+    print("   -h          display this help and exit")
+    print("   -d <dbname> name of the throwaway DB to fill; its contents")
+    print("               are replaced (required)")
+    print("   -n          don't fill the DB, reuse its contents")
+    print("   -a #        number of APs [20]")
+    print("   -r #        number of radios per AP [1]")
+    print("   -c <ch>     comma separated list of channels [5180,5200,5220]")
+    print("   -p #        probability two radios see each other [0.2]")
+    print("   -y <types>  comma separated survey types to use [2]")
+    print("   -D #        days of history [1]")
+    print("   -i #        seconds between wrinfo runs [300]")
+    print("   -e #        wrinfo runs between scans [12]")
+    print("   -A <alg>    solver: exhaustive, bnb, anneal [anneal]")
+    print("   -t #        time budget of the anneal solver [2]")
+    print("   -S #        random seed [1]")
+    print("   -P #        number of solver processes [1]")
+    print("   -R          use the slice rollups rather than the raw survey")
+    print("   -L          let the channel score and TX value steps query")
+    print("               the DB per node, through a StatsCache, rather")
+    print("               than batched")
+    print("   -o <file>   append the results to the given file rather than")
+    print("               printing them")
+
+def main():
+    # Default settings
+    dbname = None
+    fill = True
+    params = { "aps": 20, "radios": 1, "channels": [ 5180, 5200, 5220 ],
+               "density": 0.2, "survey_types": [ 2 ], "days": 1.0,
+               "interval": 300, "scan_every": 12, "algorithm": "anneal",
+               "time_budget": 2.0, "seed": 1, "processes": 1,
+               "use_slices": False, "batched": True }
+    output = None
+
+    # Read options
+    import getopt
+    opts, args = getopt.getopt(sys.argv[1:],
+                               'hd:na:r:c:p:y:D:i:e:A:t:S:P:RLo:')
+    for k, v in opts:
+        if k == '-h':
+            _usage()
+            sys.exit(0)
+        elif k == '-d':
+            dbname = v
+        elif k == '-n':
+            fill = False
+        elif k == '-a':
+            params["aps"] = int(v)
+        elif k == '-r':
+            params["radios"] = int(v)
+        elif k == '-c':
+            params["channels"] = [ int(x) for x in v.split(",") ]
+        elif k == '-p':
+            params["density"] = float(v)
+        elif k == '-y':
+            params["survey_types"] = [ int(x) for x in v.split(",") ]
+        elif k == '-D':
+            params["days"] = float(v)
+        elif k == '-i':
+            params["interval"] = int(v)
+        elif k == '-e':
+            params["scan_every"] = int(v)
+        elif k == '-A':
+            params["algorithm"] = v
+        elif k == '-t':
+            params["time_budget"] = float(v)
+        elif k == '-S':
+            params["seed"] = int(v)
+        elif k == '-P':
+            params["processes"] = int(v)
+        elif k == '-R':
+            params["use_slices"] = True
+        elif k == '-L':
+            params["batched"] = False
+        elif k == '-o':
+            output = v
+
+    if dbname is None:
+        sys.stderr.write("Error:  The DB to fill needs to be given with -d.\n")
+        sys.exit(1)
+
+    # The whole history is used
+    collector.hist_size = params["days"]
+
+    result = { "time": int(time.time()),
+               "commit": _commit_id(),
+               "python": platform.python_version(),
+               "params": params }
+    if fill:
+        conn, cursor = setup_db(dbname)
+        t0 = time.perf_counter()
+        result["rows"] = generate(conn, cursor, params["aps"],
+                            params["radios"], params["channels"],
+                            params["density"], params["survey_types"],
+                            params["days"], params["interval"],
+                            params["scan_every"], params["seed"])
+        result["generate_seconds"] = time.perf_counter() - t0
+    else:
+        conn, cursor = collector.open_db(dbname)
+    result["phases"], result["instance"] = run_benchmark(conn, cursor,
+                            params["channels"], params["algorithm"],
+                            params["time_budget"], params["seed"],
+                            params["processes"], params["use_slices"],
+                            params["batched"])
+    conn.close()
+
+    line = json.dumps(result, sort_keys=True)
+    if output is None:
+        print(line)
+    else:
+        with open(output, "a") as f:
+            f.write(line + "\n")
+
+if __name__ == "__main__":
+    main()
+
+# vim:sts=4:et
@@ -9,14 +9,48 @@ optimisation algorithm.
 """
 
 import bisect
+import collections
+import os
 import sys
 import time
 
 import mysql.connector as db
+import numpy as np
+
+# The metrics registry is shared with the data collection tools; the
+# scripts importing this module make it importable, and so does running
+# it standalone.
+if __name__ == "__main__":
+    sys.path.insert(1, os.path.join(os.path.dirname(
+                            os.path.abspath(__file__)), "..", "db_tools"))
+import metrics
 
 # Size of the history in days
 hist_size = 1
 
+# Size of the history of the interference graph in days:  neighbors not
+# seen in a scan for that long are no longer considered neighbors.
+graph_hist_size = 30
+
+# Age in seconds beyond which the latest run of an interface no longer
+# tells the channel it is currently on.
+current_freq_age = 3600
+
+# Length of the slices in the wrinfo_slice table, in seconds.  Must
+# match slice_length in db_tools/rollup.py.
+slice_length = 300
+
+# Length of the time buckets and number of bins of the TX fraction
+# histograms in the wrinfo_tx_hist table.  Must match tx_hist_length
+# and tx_hist_bins in db_tools/rollup.py.
+tx_hist_length = 3600
+tx_hist_bins = 1000
+
+def _quantile(v, num, den):
+    """Return sorted(v)[len(v) * num // den], in linear time."""
+    k = len(v) * num // den
+    return float(np.partition(np.asarray(v, dtype=float), k)[k])
+
 def open_db(dbname = None):
     if dbname is None:
         dbname = 'wifispecman'
@@ -26,6 +60,7 @@ def open_db(dbname = None):
     cursor = conn.cursor()
     return (conn, cursor)
 
+@metrics.timed("collector")
 def get_nodes(conn, cursor):
     """Compute the set of nodes to optimize.
 
@@ -43,49 +78,68 @@ def get_nodes(conn, cursor):
     cursor.execute(sql)
     return list(cursor)
 
-def get_graph(conn, cursor, nodes):
+@metrics.timed("collector")
+def get_graph(conn, cursor, nodes, time_cutoff = None):
     """Return the connectivity graph of the nodes.
 
     The graph is a dict u -> [ neighbors of u ], where all the node
     identifiers (u and the neighbors of u) are indexes into the nodes
-    array.
+    array, and the neighbors are in increasing order.  It is read from
+    the wrinfo_edge table, which run_wrinfo keeps up to date as scan
+    results arrive.
 
     @param  nodes
             the nodes array as computed by get_nodes().
+
+    @param  time_cutoff
+            only the edges seen since this time are included; defaults
+            to graph_hist_size days ago.
     """
 
     mac2index = dict([(mac, i) for (i, (ifid, mac)) in enumerate(nodes)])
-    graph = dict()
+    if time_cutoff is None:
+        time_cutoff = int(time.time() - graph_hist_size * 86400)
 
     sql = """SELECT mac, bssid
-    FROM wrinfo_interface, wrinfo_scan
-    WHERE wrinfo_interface.wrinfo_id = wrinfo_scan.wrinfo_id
-    GROUP BY mac, bssid"""
+    FROM wrinfo_edge
+    WHERE last_seen >= %d""" % (time_cutoff,)
     cursor.execute(sql)
 
+    neighbors = dict()
     for x, y in cursor:
         # Convert to radio_if number
         # skip if no such interface
-        x = mac2index[x]
-        if not y in mac2index:
+        x = mac2index.get(x)
+        y = mac2index.get(y)
+        if x is None or y is None:
             continue
-        y = mac2index[y]
 
         # Add edges
         #
         # We add bidirectional edges since we assume that
         # interference is bidirectional.
-        neigh = graph.get(x, [])
-        if y not in neigh:
-            neigh.append(y)
-        graph[x] = neigh
+        neighbors.setdefault(x, set()).add(y)
+        neighbors.setdefault(y, set()).add(x)
+    return dict((u, sorted(neigh)) for (u, neigh) in neighbors.items())
+
+def graph_to_csr(graph, n):
+    """Convert a graph to CSR form.
 
-        neigh = graph.get(y, [])
-        if x not in neigh:
-            neigh.append(x)
-        graph[y] = neigh
-    return graph
+    @param  n
+            number of nodes.
 
+    @return Tuple (indptr, indices) of arrays; the neighbors of node i
+            are indices[indptr[i]:indptr[i + 1]], in the same order as in
+            the graph dict.
+    """
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    for i in range(n):
+        indptr[i + 1] = indptr[i] + len(graph.get(i, []))
+    indices = np.fromiter((j for i in range(n) for j in graph.get(i, [])),
+                          dtype=np.int64, count=indptr[n])
+    return (indptr, indices)
+
+@metrics.timed("collector")
 def get_ip_ifname_for_ifaces(conn, cursor, ifaces):
     """For interface IDs, produce IP address and interface name.
 
@@ -101,7 +155,39 @@ def get_ip_ifname_for_ifaces(conn, cursor, ifaces):
     cursor.execute(sql)
     d = {}
     for (if_id, ip_addr, ifname) in list(cursor):
-        yield (ip_addr, ifname)
+        d[if_id] = (ip_addr, ifname)
+    for if_id in ifaces:
+        yield d[if_id]
+
+@metrics.timed("collector")
+def get_current_frequencies(conn, cursor, nodes, time_cutoff = None):
+    """Get the channels the nodes are currently on.
+
+    This is the frequency reported by the most recent wrinfo run of
+    each node, if that run is recent enough.
+
+    @param  time_cutoff
+            only the runs since this time are looked at; defaults to
+            current_freq_age seconds ago.
+
+    @return List with the frequency of each node, or None if unknown.
+    """
+    if len(nodes) == 0:
+        return []
+    if time_cutoff is None:
+        time_cutoff = int(time.time() - current_freq_age)
+
+    # The runs of the window, in order, so that the latest one wins
+    sql = """SELECT wrinfo.radio_if_id, wrinfo_interface.frequency
+    FROM wrinfo, wrinfo_interface
+    WHERE wrinfo.wrinfo_id = wrinfo_interface.wrinfo_id
+    AND wrinfo.radio_if_id IN (%s)
+    AND wrinfo.servertime >= %d
+    ORDER BY wrinfo.wrinfo_id""" % (
+        ", ".join("%d" % (ifid,) for (ifid, mac) in nodes), time_cutoff)
+    cursor.execute(sql)
+    d = dict(cursor)
+    return [ d.get(ifid) for (ifid, mac) in nodes ]
 
 
 class ChannelMetrics(object):
@@ -134,12 +220,12 @@ class ChannelStatsRow(object):
         return s
 
     def __sub__(self, b):
-        return ChannelStatsRow(
+        return ChannelStatsRow((
                 self.walltime - b.walltime,
                 self.time - b.time,
                 self.busy - b.busy,
                 self.rx - b.rx,
-                self.tx - b.tx)
+                self.tx - b.tx))
 
     def __lt__(self, b):
         return self.walltime < b.walltime
@@ -162,22 +248,35 @@ class ChannelStatsRows(object):
         2) stats_rows   ordered list of ChannelStatsRows.
     """
 
-    def __init__(self, conn, cursor, radio_if_id, freq, time_cutoff):
+    @metrics.timed("collector")
+    def __init__(self, conn, cursor, radio_if_id, freq, time_cutoff,
+      survey_type = None):
 
         # Get the stats rows themselves
-        sql="""SELECT servertime, time, busy, rx, tx
+        sql="""SELECT wrinfo.servertime, time, busy, rx, tx
         FROM wrinfo, wrinfo_survey
         WHERE wrinfo.wrinfo_id = wrinfo_survey.wrinfo_id
         AND frequency = %d
         AND radio_if_id = %d
-        AND servertime >= %d
+        AND wrinfo.servertime >= %d
+        AND wrinfo_survey.servertime >= %d
         ORDER BY wrinfo.wrinfo_id;""" \
-          % (freq, radio_if_id, time_cutoff)
+          % (freq, radio_if_id, time_cutoff, time_cutoff)
         cursor.execute(sql)
         self.stats_rows = [ ChannelStatsRow(row) for row in cursor ]
 
-        # Get the survey type
-        self.survey_type = get_survey_type(conn, cursor, radio_if_id)
+        # Get the survey type, unless known
+        if survey_type is None:
+            survey_type = get_survey_type(conn, cursor, radio_if_id)
+        self.survey_type = survey_type
+
+    @classmethod
+    def from_rows(cls, survey_type, stats_rows):
+        """Create from already loaded rows, without querying the DB."""
+        self = cls.__new__(cls)
+        self.survey_type = survey_type
+        self.stats_rows = stats_rows
+        return self
 
     def find_index_for_time(self, time):
         """Find the index of a statistics row, given time."""
@@ -257,10 +356,10 @@ class ChannelStatsRows(object):
             def _diff(key, idx_beg, idx_end):
                 if R[idx_end].__dict__[key] is not None and  \
                   R[idx_beg].__dict__[key] is not None:
-                    return R[idx_end] - R[idx_beg]
+                    return R[idx_end].__dict__[key] - R[idx_beg].__dict__[key]
                 return None
             d = _diff("time", idx_beg, idx_end)
-            if d is None:
+            if d is None or d <= 0:
                 return self._get_dummy_metrics()
             d_busy = _diff("busy", idx_beg, idx_end)
             d_rx = _diff("rx", idx_beg, idx_end)
@@ -275,9 +374,9 @@ class ChannelStatsRows(object):
             return ChannelMetrics(R[idx_end].walltime - R[idx_beg].walltime,
                                 is_valid,
                                 d,
-                                _frac(d_busy, d),
-                                _frac(d_rx, d),
-                                _frac(d_tx, d))
+                                _frac(d_busy, d, 0.2),
+                                _frac(d_rx, d, 0.02),
+                                _frac(d_tx, d, 0.05))
         elif self.survey_type == 2:
             # This is the local sampling survey type
             idx_beg = self.find_index_for_time(time_begin)
@@ -332,9 +431,460 @@ class ChannelStatsRows(object):
                 boundaries.append(ent.walltime)
         return boundaries
 
+    def get_boundary_metrics(self, bound):
+        """Get the metrics of all the slices between the given boundaries.
+
+        @return ChannelMetrics object whose members are arrays, with one
+                entry per slice."""
+        return _stack_metrics([ self.get_timeslice_metrics(bound[i],
+                                                           bound[i + 1])
+                                for i in range(len(bound) - 1) ])
+
+def _stack_metrics(metrics):
+    """Combine a list of ChannelMetrics into one holding arrays."""
+    return ChannelMetrics(
+            np.array([ M.delta_wall for M in metrics ]),
+            np.array([ M.is_valid for M in metrics ], dtype=bool),
+            np.array([ M.delta_t for M in metrics ]),
+            np.array([ M.f_busy for M in metrics ], dtype=float),
+            np.array([ M.f_rx for M in metrics ], dtype=float),
+            np.array([ M.f_tx for M in metrics ], dtype=float))
+
+def _frac_array(num, denom, ok, default):
+    """Elementwise num / denom where ok is set, default elsewhere."""
+    ret = np.full(len(num), default)
+    np.divide(num, denom, out=ret, where=ok)
+    return ret
+
+class ColumnarChannelStatsRows(object):
+    """Column oriented variant of ChannelStatsRows.
+
+    Rather than a list of ChannelStatsRow objects, this holds one array
+    per column (walltime, time, busy, rx, tx), with NULL values stored
+    as 0 and flagged in the corresponding <column>_valid mask.  The
+    metrics of all the slices of a node are computed with a few array
+    operations rather than row by row; they are the same as those
+    computed by ChannelStatsRows.
+    """
+
+    _columns = ("time", "busy", "rx", "tx")
+
+    def __init__(self, survey_type, rows):
+        """Create from rows of (walltime, time, busy, rx, tx) tuples,
+        ordered by time."""
+        self.survey_type = survey_type
+        self.walltime = np.array([ r[0] for r in rows ], dtype=np.int64)
+        for (col, name) in enumerate(self._columns, 1):
+            values = [ r[col] for r in rows ]
+            self.__dict__[name + "_valid"] = \
+                np.array([ v is not None for v in values ], dtype=bool)
+            self.__dict__[name] = np.array(
+                [ 0 if v is None else v for v in values ], dtype=np.int64)
+
+        # Prefix sums for the survey type 2 accumulation: for each
+        # column, the sum of the column and of the time, over the rows
+        # where both are valid.
+        if survey_type == 2:
+            def _cumsum(x, valid):
+                return np.concatenate(([0], np.cumsum(np.where(valid, x, 0))))
+            self._time_sum = _cumsum(self.time, self.time_valid)
+            self._num_sum = {}
+            self._denom_sum = {}
+            for name in self._columns[1:]:
+                valid = self.time_valid & self.__dict__[name + "_valid"]
+                self._num_sum[name] = _cumsum(self.__dict__[name], valid)
+                self._denom_sum[name] = _cumsum(self.time, valid)
+
+    def __len__(self):
+        return len(self.walltime)
+
+    def find_indices_for_times(self, times):
+        """Find the indices of the rows closest to the given times.
+
+        Vectorized version of ChannelStatsRows.find_index_for_time().
+        """
+        W = self.walltime
+        times = np.asarray(times, dtype=np.int64)
+        j = np.searchsorted(W, times, side='right')
+        lo = np.clip(j - 1, 0, len(W) - 1)
+        hi = np.clip(j, 0, len(W) - 1)
+        return np.where(times - W[lo] < W[hi] - times, lo, hi)
+
+    def propose_time_boundaries(self, delta):
+        W = self.walltime
+        if len(W) == 0:
+            return W
+        idx = [ 0 ]
+        while True:
+            j = np.searchsorted(W, W[idx[-1]] + delta, side='left')
+            if j == len(W):
+                break
+            idx.append(j)
+        return W[idx]
+
+    def _get_dummy_metrics(self, m):
+        return ChannelMetrics(np.zeros(m, dtype=np.int64),
+                              np.zeros(m, dtype=bool),
+                              np.zeros(m, dtype=np.int64),
+                              np.full(m, 0.2),
+                              np.full(m, 0.02),
+                              np.full(m, 0.05))
+
+    def get_boundary_metrics(self, bound):
+        """Get the metrics of all the slices between the given boundaries.
+
+        @return ChannelMetrics object whose members are arrays, with one
+                entry per slice."""
+        m = max(len(bound) - 1, 0)
+        if self.survey_type not in (1, 2) or len(self) == 0 or m == 0:
+            return self._get_dummy_metrics(m)
+        bound = np.asarray(bound)
+        beg = self.find_indices_for_times(bound[:-1])
+        end = self.find_indices_for_times(bound[1:])
+        defaults = { "busy": 0.2, "rx": 0.02, "tx": 0.05 }
+
+        if self.survey_type == 2:
+            f = {}
+            for name in self._columns[1:]:
+                num = self._num_sum[name][end + 1] - self._num_sum[name][beg]
+                denom = self._denom_sum[name][end + 1] \
+                        - self._denom_sum[name][beg]
+                f[name] = _frac_array(num, denom, denom != 0, defaults[name])
+            return ChannelMetrics(self.walltime[end] - self.walltime[beg],
+                                  np.ones(m, dtype=bool),
+                                  self._time_sum[end + 1] - self._time_sum[beg],
+                                  f["busy"], f["rx"], f["tx"])
+
+        # survey_type 1:  Differences of the accumulated counters; see
+        # ChannelStatsRows.get_timeslice_metrics() for details.
+        ret = self._get_dummy_metrics(m)
+        same = beg == end
+
+        # Slices with a single row:  estimate from that row's averages.
+        t = self.time[beg]
+        ok_t = same & self.time_valid[beg] & (t > 0)
+        ret.delta_t = np.where(ok_t, t, 0)
+
+        # Slices with actual differences
+        d = self.time[end] - self.time[beg]
+        ok_d = ~same & self.time_valid[beg] & self.time_valid[end] & (d > 0)
+        ret.delta_t = np.where(ok_d, d, ret.delta_t)
+        ret.delta_wall = np.where(ok_d,
+                            self.walltime[end] - self.walltime[beg], 0)
+        ret.is_valid = ok_d.copy()
+
+        for name in self._columns[1:]:
+            x = self.__dict__[name]
+            valid = self.__dict__[name + "_valid"]
+            single = _frac_array(x[beg], t, ok_t & valid[beg], defaults[name])
+            ok_x = ok_d & valid[beg] & valid[end]
+            diff = _frac_array(x[end] - x[beg], d, ok_x, defaults[name])
+            ret.is_valid &= ok_x | ~ok_d
+            ret.__dict__["f_" + name] = np.where(ok_d, diff, single)
+        return ret
+
+
+class SurveyData(object):
+    """Survey rows of a set of radio interfaces, loaded in bulk.
+
+    Rather than querying the DB for each node, channel and neighbor, all
+    the rows needed to compute the channel scores and TX values of the
+    given interfaces are fetched with two queries, and partitioned in
+    memory by (radio_if_id, frequency).
+    """
+
+    @metrics.timed("collector")
+    def __init__(self, conn, cursor, radio_if_ids, channel_freqs,
+      time_cutoff):
+        radio_if_ids = list(radio_if_ids)
+        self.survey_types = {}
+        self.channel_stats = {}
+        self.tx_stats = {}
+        if len(radio_if_ids) == 0:
+            return
+        id_list = ", ".join("%d" % (x,) for x in radio_if_ids)
+
+        # Survey types
+        sql = "SELECT id, survey_type FROM radio_if WHERE id IN (%s)" \
+            % (id_list,)
+        cursor.execute(sql)
+        self.survey_types = dict(cursor)
+
+        # Survey rows; those of the channels inspected for the channel
+        # scores, and the in-use ones for the TX values.
+        freq_list = ", ".join("%d" % (x,) for x in channel_freqs)
+        if len(freq_list) == 0:
+            freq_list = "NULL"
+        sql = """SELECT radio_if_id, in_use, wrinfo.servertime, time, busy,
+          rx, tx, frequency
+        FROM wrinfo, wrinfo_survey
+        WHERE wrinfo.wrinfo_id = wrinfo_survey.wrinfo_id
+        AND radio_if_id IN (%s)
+        AND (frequency IN (%s) OR in_use = 1)
+        AND wrinfo.servertime >= %d
+        AND wrinfo_survey.servertime >= %d
+        ORDER BY wrinfo.wrinfo_id;""" \
+          % (id_list, freq_list, time_cutoff, time_cutoff)
+        cursor.execute(sql)
+
+        channel_freqs = set(channel_freqs)
+        rows = {}
+        for row in cursor:
+            radio_if_id, in_use, freq = row[0], row[1], row[7]
+            if freq in channel_freqs:
+                rows.setdefault((radio_if_id, freq), []).append(row[2:7])
+            if in_use == 1:
+                self.tx_stats.setdefault(radio_if_id, []).append(row[2:])
+
+        for (radio_if_id, freq), R in rows.items():
+            self.channel_stats[(radio_if_id, freq)] = \
+                ColumnarChannelStatsRows(self.survey_types.get(radio_if_id), R)
+
+    def get_survey_type(self, radio_if_id):
+        return self.survey_types[radio_if_id]
+
+    def get_channel_stats_rows(self, radio_if_id, freq):
+        """Return the ColumnarChannelStatsRows for the given interface and
+        channel."""
+        ret = self.channel_stats.get((radio_if_id, freq))
+        if ret is None:
+            ret = ColumnarChannelStatsRows(
+                    self.survey_types.get(radio_if_id), [])
+        return ret
+
+    def get_tx_fractions(self, radio_if_id):
+        """Return the TX fractions of the given interface's slices."""
+        return _get_tx_fractions(self.survey_types.get(radio_if_id),
+                                 self.tx_stats.get(radio_if_id, []))
+
+    def get_tx_quantile(self, radio_if_id, num, den):
+        """Return the num/den quantile of the given interface's TX
+        fractions, or None if it has none."""
+        v = self.get_tx_fractions(radio_if_id)
+        if len(v) == 0:
+            return None
+        return _quantile(v, num, den)
+
+class SliceStatsRows(object):
+    """Channel stats of a radio and frequency, from the slice rollups.
+
+    Provides the same propose_time_boundaries() and
+    get_boundary_metrics() as ColumnarChannelStatsRows, but works on
+    the pre-aggregated slices of the wrinfo_slice table rather than on
+    the raw survey rows.  For any time span, the metrics are computed
+    from the totals of the slices starting within that span.
+    """
+
+    _columns = ( "samples", "in_use", "time", "busy", "busy_time",
+                 "rx", "rx_time", "tx", "tx_time" )
+
+    def __init__(self, survey_type, rows):
+        """Create from rows of (slice_start, samples, in_use, time, busy,
+        busy_time, rx, rx_time, tx, tx_time) tuples, ordered by
+        slice_start."""
+        self.survey_type = survey_type
+        self.slice_start = np.array([ r[0] for r in rows ], dtype=np.int64)
+        self._sum = {}
+        for (col, name) in enumerate(self._columns, 1):
+            x = np.array([ r[col] or 0 for r in rows ], dtype=np.int64)
+            self._sum[name] = np.concatenate(([0], np.cumsum(x)))
+
+    def __len__(self):
+        return len(self.slice_start)
+
+    def propose_time_boundaries(self, delta):
+        S = self.slice_start
+        if len(S) == 0:
+            return S
+        idx = [ 0 ]
+        while True:
+            j = np.searchsorted(S, S[idx[-1]] + delta, side='left')
+            if j == len(S):
+                break
+            idx.append(j)
+        return np.append(S[idx], S[-1] + slice_length)
+
+    def get_boundary_metrics(self, bound):
+        """Get the metrics of all the slices between the given boundaries.
+
+        @return ChannelMetrics object whose members are arrays, with one
+                entry per slice."""
+        bound = np.asarray(bound, dtype=np.int64)
+        idx = np.searchsorted(self.slice_start, bound, side='left')
+        beg, end = idx[:-1], idx[1:]
+        def _total(name):
+            return self._sum[name][end] - self._sum[name][beg]
+
+        samples = _total("samples")
+        f = {}
+        valid = np.ones(len(beg), dtype=bool)
+        for (name, default) in (("busy", 0.2), ("rx", 0.02), ("tx", 0.05)):
+            denom = _total(name + "_time")
+            f[name] = _frac_array(_total(name), denom, denom > 0, default)
+            valid &= denom > 0
+        return ChannelMetrics(np.where(samples > 0, np.diff(bound), 0),
+                              valid,
+                              _total("time"),
+                              f["busy"], f["rx"], f["tx"])
+
+class SliceData(object):
+    """Pre-aggregated survey slices of a set of radio interfaces.
+
+    Same interface as SurveyData, but reads the slice rollups and TX
+    fraction histograms maintained by db_tools/rollup.py, so the amount
+    of data read depends on the number of slices and histogram buckets,
+    not on the number of raw survey rows.
+    """
+
+    @metrics.timed("collector")
+    def __init__(self, conn, cursor, radio_if_ids, channel_freqs,
+      time_cutoff):
+        radio_if_ids = list(radio_if_ids)
+        self.survey_types = {}
+        self.channel_stats = {}
+        self.tx_hists = {}
+        if len(radio_if_ids) == 0:
+            return
+        id_list = ", ".join("%d" % (x,) for x in radio_if_ids)
+
+        # Survey types
+        sql = "SELECT id, survey_type FROM radio_if WHERE id IN (%s)" \
+            % (id_list,)
+        cursor.execute(sql)
+        self.survey_types = dict(cursor)
+
+        sql = """SELECT radio_if_id, frequency, slice_start, samples, in_use,
+          time, busy, busy_time, rx, rx_time, tx, tx_time
+        FROM wrinfo_slice
+        WHERE radio_if_id IN (%s)
+        AND slice_start >= %d
+        ORDER BY slice_start;""" \
+          % (id_list, time_cutoff - time_cutoff % slice_length)
+        cursor.execute(sql)
+
+        channel_freqs = set(channel_freqs)
+        rows = {}
+        for row in cursor:
+            radio_if_id, freq = row[0], row[1]
+            if freq in channel_freqs:
+                rows.setdefault((radio_if_id, freq), []).append(row[2:])
+
+        for (radio_if_id, freq), R in rows.items():
+            self.channel_stats[(radio_if_id, freq)] = \
+                SliceStatsRows(self.survey_types.get(radio_if_id), R)
+
+        # The TX fraction histograms of the window, merged over the
+        # frequencies and time buckets.  The bucket holding time_cutoff
+        # is left out, as it would add up to an hour of runs from before
+        # the window of the slices.
+        sql = """SELECT radio_if_id, bin, SUM(count)
+        FROM wrinfo_tx_hist
+        WHERE radio_if_id IN (%s)
+        AND bucket_start >= %d
+        GROUP BY radio_if_id, bin
+        ORDER BY radio_if_id, bin;""" \
+          % (id_list, time_cutoff + (-time_cutoff % tx_hist_length))
+        cursor.execute(sql)
+        for (radio_if_id, b, n) in cursor:
+            bins, counts = self.tx_hists.setdefault(radio_if_id, ([], []))
+            bins.append(b)
+            counts.append(int(n))
+
+    def get_survey_type(self, radio_if_id):
+        return self.survey_types[radio_if_id]
+
+    def get_channel_stats_rows(self, radio_if_id, freq):
+        """Return the SliceStatsRows for the given interface and
+        channel."""
+        ret = self.channel_stats.get((radio_if_id, freq))
+        if ret is None:
+            ret = SliceStatsRows(self.survey_types.get(radio_if_id), [])
+        return ret
+
+    def get_tx_quantile(self, radio_if_id, num, den):
+        """Return the num/den quantile of the given interface's TX
+        fractions, or None if it has none.
+
+        The result is within 0.5 / tx_hist_bins of the quantile of the
+        raw fractions."""
+        bins, counts = self.tx_hists.get(radio_if_id, ([], []))
+        if len(bins) == 0:
+            return None
+        cum = np.cumsum(counts)
+        k = int(cum[-1]) * num // den
+        return bins[int(np.searchsorted(cum, k, side='right'))] \
+                / tx_hist_bins
+
+class StatsCache(object):
+    """Size-bounded LRU cache of the channel stats of a collection run.
+
+    Without a SurveyData (or SliceData) object, get_node_channel_scores()
+    queries the stats of each neighbor again for every node listing it.
+    With a cache, the ChannelStatsRows of each (radio_if_id, frequency,
+    time_cutoff) are loaded once, and the survey types queried once.
+    The least recently used entries are evicted beyond maxsize.  With a
+    SurveyData object, which already holds all the stats, there's
+    nothing to cache.
+
+    Hits and misses are counted per kind of entry, in the hits and
+    misses members and in the collector_cache metrics.
+    """
 
+    def __init__(self, maxsize = 4096):
+        self.maxsize = maxsize
+        self.hits = {}
+        self.misses = {}
+        self._entries = collections.OrderedDict()
+
+    def get(self, kind, key, compute):
+        """Return the entry of the given kind and key, calling compute()
+        to create it if it's missing."""
+        key = (kind,) + key
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+            metrics.registry.add("collector_cache_hits_total", kind=kind)
+            return self._entries[key]
+        self.misses[kind] = self.misses.get(kind, 0) + 1
+        metrics.registry.add("collector_cache_misses_total", kind=kind)
+        value = compute()
+        self._entries[key] = value
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return value
+
+    def get_survey_type(self, conn, cursor, radio_if_id):
+        return self.get("survey_type", (radio_if_id,),
+                lambda: get_survey_type(conn, cursor, radio_if_id))
+
+    def get_channel_stats_rows(self, conn, cursor, radio_if_id, freq,
+      time_cutoff):
+        """Return the stats of an interface and channel, loaded from the
+        DB on a miss."""
+        return self.get("stats_rows", (radio_if_id, freq, time_cutoff),
+                lambda: ChannelStatsRows(conn, cursor, radio_if_id, freq,
+                            time_cutoff,
+                            self.get_survey_type(conn, cursor, radio_if_id)))
+
+    def format_stats(self):
+        """Return the hit and miss counts as a printable string."""
+        return "Stats cache: " + ", ".join("%s %d/%d hits" %
+                (kind, self.hits.get(kind, 0),
+                 self.hits.get(kind, 0) + self.misses.get(kind, 0))
+                for kind in sorted(set(self.hits) | set(self.misses)))
+
+def get_time_cutoff(epoch_start = None):
+    """Compute the time before which data is disregarded."""
+    #  The cutoff is how far into the past we want to dig.
+    time_cutoff = int(time.time()) - hist_size * 86400
+    if epoch_start is not None:
+        time_cutoff = max(epoch_start, time_cutoff)
+    return time_cutoff
+
+@metrics.timed("collector")
 def get_node_channel_scores(conn, cursor, nodes, node_id,
-  neighbors, channel_freqs, epoch_start = None):
+  neighbors, channel_freqs, epoch_start = None, survey_data = None,
+  cache = None, time_cutoff = None):
     """Get the channel baseline scores.
 
     @param  conn, cursor
@@ -355,18 +905,35 @@ def get_node_channel_scores(conn, cursor, nodes, node_id,
 
     @param  epoch_start
             the start of the new epoch, if any.
+
+    @param  survey_data
+            SurveyData or SliceData object holding the node's and its
+            neighbors' data; if None, the rows are queried from the DB.
+
+    @param  cache
+            StatsCache shared by the calls of a run, if any; only used
+            when survey_data is None.
+
+    @param  time_cutoff
+            the time before which data is disregarded; computed from
+            epoch_start if None.  Pass the same one to all the calls
+            sharing a cache.
     """
 
-    #  The cutoff is how far into the past we want to dig.
-    time_cutoff = int(time.time()) - hist_size * 86400
-    if epoch_start is not None:
-        time_cutoff = max(epoch_start, time_cutoff)
+    if time_cutoff is None:
+        time_cutoff = get_time_cutoff(epoch_start)
+    def _get_stats(radio_if_id, freq):
+        if survey_data is not None:
+            return survey_data.get_channel_stats_rows(radio_if_id, freq)
+        if cache is not None:
+            return cache.get_channel_stats_rows(conn, cursor, radio_if_id,
+                        freq, time_cutoff)
+        return ChannelStatsRows(conn, cursor, radio_if_id, freq, time_cutoff)
 
     ret = []
     for freq in channel_freqs:
         # Get the node statistics
-        node_stats = ChannelStatsRows(conn, cursor,
-                        nodes[node_id][0], freq, time_cutoff)
+        node_stats = _get_stats(nodes[node_id][0], freq)
 
         # Compile the section scores
         # (Those are scores for the individual time slots.)
@@ -376,23 +943,15 @@ def get_node_channel_scores(conn, cursor, nodes, node_id,
         # (2) correction from the corresponding TX values of the neighbors
         #     we have control over
 
-        # Time boundaries
+        # Time boundaries, and the baseline values
         bound = node_stats.propose_time_boundaries(300)
-
-        # Get the baseline values
-        section_scores = []
-        for i in range(len(bound) - 1):
-            M = node_stats.get_timeslice_metrics(bound[i], bound[i + 1])
-            section_scores.append( M.f_busy - M.f_tx )
+        M = node_stats.get_boundary_metrics(bound)
+        section_scores = M.f_busy - M.f_tx
 
         # Now subtract compensations from each of the controlled neighbors
         for neigh_id in neighbors:
-            neigh_stats = ChannelStatsRows(conn, cursor,
-                                nodes[neigh_id][0], freq, time_cutoff)
-
-            for i in range(len(bound) - 1):
-                M = neigh_stats.get_timeslice_metrics(bound[i], bound[i + 1])
-                section_scores[i] -= M.f_tx
+            neigh_stats = _get_stats(nodes[neigh_id][0], freq)
+            section_scores -= neigh_stats.get_boundary_metrics(bound).f_tx
 
         # From the section stats, extract a good value
         score = None
@@ -403,35 +962,18 @@ def get_node_channel_scores(conn, cursor, nodes, node_id,
         else:
             # Choose a channel with fairly high load; we take the
             # 7/8-th quantile
-            score = sorted(section_scores)[len(section_scores) * 7 // 8]
+            score = _quantile(section_scores, 7, 8)
         ret.append(score)
     return ret
 
-def get_tx_value(conn, cursor, nodes, node_id, epoch_start = None):
-    """For a node, return its TX fraction."""
+def _get_tx_fractions(survey_type, stats):
+    """Compute the TX fractions of a node's in-use survey rows.
 
-    survey_type = get_survey_type(conn, cursor, nodes[node_id][0])
-    if survey_type == 0:
-        # We don't have survey data; just make a guess.
-        # XXX
-        return 0.05
+    @param  stats
+            list of tuples (servertime, time, busy, rx, tx, frequency).
 
-    # Get the slices of the TX value
-    time_cutoff = int(time.time()) - hist_size  * 86400
-    if epoch_start is not None:
-        time_cutoff = max(epoch_start, time_cutoff)
-    sql = """SELECT servertime, time, busy, rx, tx, frequency
-    FROM wrinfo, wrinfo_survey
-    WHERE wrinfo.wrinfo_id = wrinfo_survey.wrinfo_id
-    AND in_use = 1
-    AND radio_if_id = %d
-    AND servertime >= %d
-    ORDER BY wrinfo.wrinfo_id;""" \
-      % (nodes[node_id][0], time_cutoff)
-    cursor.execute(sql)
-    stats = list(cursor)
-
-    # Evaluate slices
+    @return list of TX values, one for each slice.
+    """
     # A TX value is computed for each slice and put into the v[] array.
     v = []
     if survey_type == 1:
@@ -456,6 +998,49 @@ def get_tx_value(conn, cursor, nodes, node_id, epoch_start = None):
                 continue
             v.append(stats[i][4] / stats[i][1])
 
+    return v
+
+@metrics.timed("collector")
+def get_tx_value(conn, cursor, nodes, node_id, epoch_start = None,
+  survey_data = None, cache = None):
+    """For a node, return its TX fraction.
+
+    If survey_data (a SurveyData or SliceData object) is given, the data
+    is taken from there rather than queried from the DB.  If a StatsCache
+    is given, the survey type is looked up there.
+    """
+
+    radio_if_id = nodes[node_id][0]
+    if survey_data is not None:
+        survey_type = survey_data.get_survey_type(radio_if_id)
+    elif cache is not None:
+        survey_type = cache.get_survey_type(conn, cursor, radio_if_id)
+    else:
+        survey_type = get_survey_type(conn, cursor, radio_if_id)
+    if survey_type == 0:
+        # We don't have survey data; just make a guess.
+        # XXX
+        return 0.05
+
+    # Get the slices of the TX value; the SurveyData and SliceData
+    # objects answer the quantile below themselves.
+    if survey_data is not None:
+        q = survey_data.get_tx_quantile(radio_if_id, 7, 8)
+        return 0 if q is None else q
+    else:
+        time_cutoff = get_time_cutoff(epoch_start)
+        sql = """SELECT wrinfo.servertime, time, busy, rx, tx, frequency
+        FROM wrinfo, wrinfo_survey
+        WHERE wrinfo.wrinfo_id = wrinfo_survey.wrinfo_id
+        AND in_use = 1
+        AND radio_if_id = %d
+        AND wrinfo.servertime >= %d
+        AND wrinfo_survey.servertime >= %d
+        ORDER BY wrinfo.wrinfo_id;""" \
+          % (radio_if_id, time_cutoff, time_cutoff)
+        cursor.execute(sql)
+        v = _get_tx_fractions(survey_type, list(cursor))
+
     # Compute the statistic to return
     #
     # Right now we use the 7/8-th percentile with the hope to capture a
@@ -464,7 +1049,7 @@ def get_tx_value(conn, cursor, nodes, node_id, epoch_start = None):
     # none.
     if len(v) == 0:
         return 0
-    return sorted(v)[len(v) * 7 // 8]
+    return _quantile(v, 7, 8)
 
 def _usage():
     print("Data collector.  Extracts data from DB and postprocesses it")
@@ -474,17 +1059,19 @@ def _usage():
     print("   -c #      channel frequencies to consider, comma separated")
     print("   -e #      epoch start, if any (disregard data before that point)")
     print("   -r #      set history size to the given number of days")
+    print("   -R        use the slice rollups rather than the raw survey")
 
 if __name__ == "__main__":
     # Default settings
     dbname = 'wifispecman'
     channels = [ 5180, 5200, 5220 ]
     epoch_start = None
+    use_slices = False
 
     # Read options
     import sys
     import getopt
-    opts, args = getopt.getopt(sys.argv[1:], 'hd:c:e:r:')
+    opts, args = getopt.getopt(sys.argv[1:], 'hd:c:e:r:R')
     for k, v in opts:
         if k == '-h':
             _usage()
@@ -497,6 +1084,8 @@ if __name__ == "__main__":
             epoch_start = int(v)
         elif k == '-r':
             hist_size = float(v)
+        elif k == '-R':
+            use_slices = True
 
     # Open DB
     conn, cursor = open_db(dbname)
@@ -507,6 +1096,13 @@ if __name__ == "__main__":
     graph = get_graph(conn, cursor, nodes)
     print("Graph:", graph)
 
+    time_cutoff = get_time_cutoff(epoch_start)
+    loader = SliceData if use_slices else SurveyData
+    survey_data = loader(conn, cursor,
+                    [ ifid for (ifid, mac) in nodes ],
+                    channels,
+                    time_cutoff)
+
     # channel scores
     scores = []
     for i in range(len(nodes)):
@@ -514,14 +1110,16 @@ if __name__ == "__main__":
                     i,
                     graph.get(i, []),
                     channels,
-                    epoch_start)
+                    epoch_start,
+                    survey_data,
+                    time_cutoff=time_cutoff)
         print("Channel scores for node", i, ":", sc_this_if)
         scores.append(sc_this_if)
 
     # channel TX values
     tx_values = []
     for i in range(len(nodes)):
-        tx = get_tx_value(conn, cursor, nodes, i, epoch_start)
+        tx = get_tx_value(conn, cursor, nodes, i, epoch_start, survey_data)
         print("TX value for node", i, ":", tx)
         tx_values.append(tx)
 
@@ -1,17 +1,94 @@
 #!/usr/bin/env python3
 
+import os
+import sys
+
+# The SSH session manager and the metrics are shared with the data
+# collection tools; run as a script, they're imported from there, after
+# the modules of this directory.
+if __name__ == "__main__":
+    sys.path.insert(1, os.path.join(os.path.dirname(
+                            os.path.abspath(__file__)), "..", "db_tools"))
+
 import collector
-import subprocess
+import concurrent.futures
+import math
+import numpy as np
+import random
+import rollout
+import snapshot
+import time
+
+import metrics
+import sshsession
+
+class CompiledInstance(object):
+    """Array representation of a ChannelProblemInstance.
+
+    Has the following members:
+        chan_scores     (n x k) array of baseline scores.
+        tx_values       length n array of TX values.
+        indptr, indices CSR representation of the graph: the neighbors
+                        of node i are indices[indptr[i]:indptr[i + 1]],
+                        in the same order as in the graph dict.
+    """
+
+    def __init__(self, chan_scores, tx_values, indptr, indices):
+        self.chan_scores = chan_scores
+        self.tx_values = tx_values
+        self.indptr = indptr
+        self.indices = indices
+        n = len(tx_values)
+        self._edge_src = np.repeat(np.arange(n), np.diff(indptr))
+        self._edge_tx = tx_values[self._edge_src]
+
+    def evaluate_batch(self, A):
+        """Evaluate a batch of assignments.
+
+        @param  A
+                (m x n) integer array; each row is an assignment.
+
+        @return length m array of scores.  Up to floating point rounding,
+                these are the values evaluate_assignment() returns.
+        """
+        A = np.asarray(A)
+        n = len(self.tx_values)
+        score = self.chan_scores[np.arange(n), A].sum(axis=1)
+        same = A[:, self._edge_src] == A[:, self.indices]
+        score += same @ self._edge_tx
+        return score
+
+# Initial temperature of a warm-started anneal, relative to that of a
+# cold start; low enough not to randomize the start assignment away.
+_WARM_TEMPERATURE = 0.1
 
 class ChannelProblemInstance(object):
     def __init__(self):
-        pass
+        # Frequency each node is currently on, None if unknown
+        self.current_freqs = None
+
+    def collect_data(self, conn, cursor, channels, use_slices=False):
+        """Collect the instance from the DB.
 
-    def collect_data(self, conn, cursor, channels):
+        If use_slices is set, the survey data is read from the slice
+        rollups rather than from the raw survey rows.
+        """
+        self.collected = int(time.time())
         self.nodes = collector.get_nodes(conn, cursor)
         self.channels = channels
 
         self.graph = collector.get_graph(conn, cursor, self.nodes)
+        self.current_freqs = collector.get_current_frequencies(conn, cursor,
+                                                               self.nodes)
+
+        # All the survey rows needed below, in one go
+        time_cutoff = collector.get_time_cutoff()
+        loader = collector.SliceData if use_slices \
+                    else collector.SurveyData
+        survey_data = loader(conn, cursor,
+                        self.get_interface_ids(),
+                        channels,
+                        time_cutoff)
 
         # channel scores
         self.chan_scores = []
@@ -21,15 +98,85 @@ class ChannelProblemInstance(object):
                         self.nodes,
                         i,
                         self.graph.get(i, []),
-                        channels)
+                        channels,
+                        survey_data=survey_data,
+                        time_cutoff=time_cutoff)
             self.chan_scores.append(sc_this_if)
 
         # channel TX values
         self.tx_values = []
         for i in range(len(self.nodes)):
-            tx = collector.get_tx_value(conn, cursor, self.nodes, i)
+            tx = collector.get_tx_value(conn, cursor, self.nodes, i,
+                        survey_data=survey_data)
             self.tx_values.append(tx)
 
+    def save_snapshot(self, path):
+        """Save the collected data to a snapshot file."""
+        n = len(self.nodes)
+        indptr, indices = collector.graph_to_csr(self.graph, n)
+        header = { "collected": self.collected,
+                   "channels": list(self.channels),
+                   "macs": [ mac for (_, mac) in self.nodes ],
+                   "current_freqs": self.current_freqs }
+        arrays = { "radio_if_ids": np.array([ ifid for (ifid, _)
+                                              in self.nodes ],
+                                            dtype=np.int64),
+                   "indptr": indptr,
+                   "indices": indices,
+                   "chan_scores": np.array(self.chan_scores, dtype=float)
+                                    .reshape(n, len(self.channels)),
+                   "tx_values": np.array(self.tx_values, dtype=float) }
+        snapshot.write(path, header, arrays)
+
+    @classmethod
+    def load_snapshot(cls, path):
+        """Load an instance from a snapshot file, as written by
+        save_snapshot(), instead of collecting it from the DB."""
+        header, arrays = snapshot.read(path)
+        self = cls()
+        self.collected = header["collected"]
+        self.channels = header["channels"]
+        self.nodes = list(zip(arrays["radio_if_ids"].tolist(),
+                              header["macs"]))
+        indptr = arrays["indptr"].tolist()
+        indices = arrays["indices"]
+        self.graph = dict((i, indices[indptr[i]:indptr[i + 1]].tolist())
+                          for i in range(len(self.nodes))
+                          if indptr[i + 1] > indptr[i])
+        self.chan_scores = arrays["chan_scores"].tolist()
+        self.tx_values = arrays["tx_values"].tolist()
+        self.current_freqs = header.get("current_freqs")
+        return self
+
+    def get_start_assignment(self):
+        """Return the assignment the nodes are currently on.
+
+        @return List of channel indexes, with None for the nodes whose
+                current frequency is unknown or not one of the channels;
+                None if the current frequencies are unknown altogether.
+        """
+        if self.current_freqs is None:
+            return None
+        index = dict((f, c) for (c, f) in enumerate(self.channels))
+        return [ index.get(f) for f in self.current_freqs ]
+
+    def add_switch_cost(self, cost):
+        """Add a switching penalty to the objective.
+
+        cost is added to the baseline score of every channel but the
+        current one of each node (if known), so that the solvers weigh
+        the gain of a channel switch against its disruption.
+        """
+        start = self.get_start_assignment()
+        if start is None:
+            return
+        for (i, a) in enumerate(start):
+            if a is None:
+                continue
+            self.chan_scores[i] = [ sc + (cost if c != a else 0)
+                                    for (c, sc) in
+                                    enumerate(self.chan_scores[i]) ]
+
     def get_interface_ids(self):
         """Return the radio_if_id values of all the nodes."""
         for (ifid, _) in self.nodes:
@@ -54,36 +201,489 @@ class ChannelProblemInstance(object):
 
         return score
 
+    def set_assignment(self, assign):
+        """Set the current assignment.
+
+        The current assignment is held in the assignment member and its
+        score in the score member.  It can be modified with apply_move()
+        and apply_swap(); move_delta() and swap_delta() tell the score
+        change such a modification would incur.
+        """
+        assert len(assign) == len(self.nodes)
+        self._weights, _ = self._pair_weights()
+        self.assignment = list(assign)
+        self.score = self.evaluate_assignment(self.assignment)
+
+    def move_delta(self, i, c):
+        """Score change if node i is moved to channel c.
+
+        Only node i's baseline score and the interference terms on the
+        edges incident to i change, so this is O(degree of i).
+        """
+        assign = self.assignment
+        a = assign[i]
+        if a == c:
+            return 0
+        d = self.chan_scores[i][c] - self.chan_scores[i][a]
+        for (j, w) in self._weights[i].items():
+            if assign[j] == c:
+                d += w
+            elif assign[j] == a:
+                d -= w
+        return d
+
+    def swap_delta(self, i, j):
+        """Score change if nodes i and j swap their channels."""
+        a, b = self.assignment[i], self.assignment[j]
+        if a == b:
+            return 0
+
+        # The edge between i and j, if any, is unaffected by a swap;
+        # but both move_delta() calls count it as newly interfering.
+        return self.move_delta(i, b) + self.move_delta(j, a) \
+                - 2 * self._weights[i].get(j, 0)
+
+    def apply_move(self, i, c):
+        """Move node i to channel c.  Returns the score change."""
+        d = self.move_delta(i, c)
+        self.assignment[i] = c
+        self.score += d
+        return d
+
+    def apply_swap(self, i, j):
+        """Swap the channels of nodes i and j.  Returns the score change."""
+        d = self.swap_delta(i, j)
+        A = self.assignment
+        A[i], A[j] = A[j], A[i]
+        self.score += d
+        return d
+
+    def compile(self):
+        """Return the CompiledInstance for this instance."""
+        n = len(self.nodes)
+        chan_scores = np.array(self.chan_scores, dtype=float) \
+                        .reshape(n, len(self.channels))
+        tx_values = np.array(self.tx_values, dtype=float)
+        indptr, indices = collector.graph_to_csr(self.graph, n)
+        return CompiledInstance(chan_scores, tx_values, indptr, indices)
+
     def find_best_assignment(self, verbose=True):
         """Find the best possible assignment (exhaustive search)
 
         Note that this is an exponential algorithm, and is practical
         only for tiny instances.  For larger networks, a better method
-        is needed.
+        is needed.  Only the 10 best assignments are kept, so memory use
+        is bounded by the batch size.
+
+        @raise  ValueError if the assignments can't be numbered in 64
+                bit integers.
         """
-        score_assign_pairs = []
-        for ass in _cartesian(len(self.nodes), len(self.channels)):
-            v = self.evaluate_assignment(ass)
-            score_assign_pairs.append( (v, ass) )
-        score_assign_pairs.sort()
+        n, k = len(self.nodes), len(self.channels)
+        total = k ** n
+        if total > np.iinfo(np.int64).max:
+            raise ValueError("Exhaustive search over %d^%d assignments is"
+                             " out of reach; use the bnb or anneal solver."
+                             % (k, n))
+        compiled = self.compile()
+        best_scores = np.empty(0)
+        best_idx = np.empty(0, dtype=np.int64)
+        for start in range(0, total, _BATCH_SIZE):
+            stop = min(start + _BATCH_SIZE, total)
+            scores = compiled.evaluate_batch(_cartesian(n, k, start, stop))
+            best_scores, best_idx = _lowest(
+                np.concatenate((best_scores, scores)),
+                np.concatenate((best_idx,
+                                np.arange(start, stop, dtype=np.int64))),
+                10)
+        metrics.registry.add("solver_iterations_total", total,
+                             algorithm="exhaustive")
         if verbose:
             print("Best assignments, by score (lower is better):")
-            for sc, ass in score_assign_pairs[0:10]:
-                print("  %.2g  %r" % (sc, ass))
-        return score_assign_pairs[0][1]
+            for (score, idx) in zip(best_scores, best_idx):
+                ass = _cartesian(n, k, idx, idx + 1)[0].tolist()
+                print("  %.2g  %r" % (score, ass))
+        return _cartesian(n, k, best_idx[0], best_idx[0] + 1)[0].tolist()
+
+    def find_good_assignment(self, time_budget=10.0, seed=None,
+      verbose=True, warm_start=False):
+        """Find a good assignment (simulated annealing)
+
+        Performs simulated annealing over single-node channel moves
+        for time_budget seconds of wall clock time.  Only the current
+        and the best assignment are held, so memory use is linear in
+        the number of nodes.  The best score is recorded over time in
+        the solver_best_score metrics series.
+
+        @param  time_budget
+                wall clock time to spend, in seconds.
+
+        @param  seed
+                seed for the random number generator, for reproducible
+                runs.
+
+        @param  warm_start
+                if set, start from the current channels of the nodes
+                (see get_start_assignment()) at a lower temperature,
+                rather than from a random assignment.
+
+        @return Tuple (score, assignment) of the best assignment found.
+        """
+        n, k = len(self.nodes), len(self.channels)
+        rng = random.Random(seed)
+        start = self.get_start_assignment() if warm_start else None
+        if start is None:
+            start = [ None ] * n
+        self.set_assignment([ rng.randrange(k) if a is None else a
+                              for a in start ])
+        assign = self.assignment
+        best_score, best_assign = self.score, list(assign)
+        if n == 0 or k < 2:
+            return (best_score, best_assign)
+
+        # Initial temperature:  the typical magnitude of a move.
+        deltas = [ abs(self.move_delta(rng.randrange(n), rng.randrange(k)))
+                    for _ in range(100) ]
+        t_start = max(sum(deltas) / len(deltas), 1e-3)
+        if warm_start:
+            t_start *= _WARM_TEMPERATURE
+        t_end = t_start * 1e-3
+
+        t0 = time.monotonic()
+        temp = t_start
+        iterations = 0
+        recorded = None
+        while True:
+            # Check the clock (and cool down) only every so often
+            if iterations % 256 == 0:
+                if best_score != recorded:
+                    metrics.registry.point("solver_best_score", best_score,
+                                           algorithm="anneal")
+                    recorded = best_score
+                frac = (time.monotonic() - t0) / time_budget \
+                        if time_budget > 0 else 1
+                if frac >= 1:
+                    break
+                temp = t_start * (t_end / t_start) ** frac
+            iterations += 1
+
+            i = rng.randrange(n)
+            c = rng.randrange(k - 1)
+            if c >= assign[i]:
+                c += 1
+            d = self.move_delta(i, c)
+            if d <= 0 or rng.random() < math.exp(-d / temp):
+                self.apply_move(i, c)
+                if self.score < best_score:
+                    best_score = self.score
+                    best_assign[:] = assign
+
+        # Recompute to get rid of accumulated rounding error
+        best_score = self.evaluate_assignment(best_assign)
+        metrics.registry.add("solver_iterations_total", iterations,
+                             algorithm="anneal")
+        if verbose:
+            print("Simulated annealing: %d iterations in %.1fs"
+                    % (iterations, time.monotonic() - t0))
+            print("  %.2g  %r" % (best_score, best_assign))
+        return (best_score, best_assign)
 
-def _cartesian(n, k):
+    def _pair_weights(self):
+        """Interference penalty between pairs of nodes.
+
+        @return Tuple (W, const).  W[i] is a dict j -> penalty incurred
+                if nodes i and j share a channel; const is the penalty
+                from self loops in the graph, which is always incurred.
+        """
+        W = [ dict() for i in range(len(self.nodes)) ]
+        const = 0
+        for i in range(len(self.nodes)):
+            tx = self.tx_values[i]
+            for j in self.graph.get(i, []):
+                if i == j:
+                    const += tx
+                    continue
+                W[i][j] = W[i].get(j, 0) + tx
+                W[j][i] = W[j].get(i, 0) + tx
+        return (W, const)
+
+    def _channel_predecessors(self):
+        """Find interchangeable channels for symmetry breaking.
+
+        Two channels are interchangeable if every node has the same
+        baseline score on both, since the interference terms only
+        depend on whether channels are equal.  For each channel, return
+        the previous channel of its class of interchangeable channels,
+        or None if it is the first one of its class.
+        """
+        prev = []
+        last_of_class = dict()
+        for c in range(len(self.channels)):
+            column = tuple(sc[c] for sc in self.chan_scores)
+            prev.append(last_of_class.get(column))
+            last_of_class[column] = c
+        return prev
+
+    def find_optimal_assignment(self, verbose=True, warm_start=False):
+        """Find the best possible assignment (branch and bound)
+
+        Nodes are assigned in order of decreasing degree.  A partial
+        assignment is pruned if its committed score plus, for every
+        unassigned node, its cheapest channel given the committed
+        neighbors already reaches the incumbent score.  Among
+        interchangeable channels, only the first unused one is tried.
+
+        This is still exponential in the worst case, but memory use is
+        linear in the number of nodes.  With warm_start, the current
+        channels of the nodes are the incumbent if better than the
+        greedy one, which prunes more when they are close to optimal.
+
+        @return Tuple (score, assignment) of an optimal assignment.
+        """
+        n, k = len(self.nodes), len(self.channels)
+        t0 = time.monotonic()
+        W, const = self._pair_weights()
+        prev = self._channel_predecessors()
+        order = sorted(range(n), key=lambda i: (-len(W[i]), i))
+        depth_of = [ 0 ] * n
+        for d, v in enumerate(order):
+            depth_of[v] = d
+
+        # cost[u][c]:  score of putting u onto c, given the nodes
+        # assigned so far.
+        cost = [ list(sc) for sc in self.chan_scores ]
+        used = [ 0 ] * k
+        assign = [ 0 ] * n
+
+        # Greedy incumbent
+        best_assign = [ 0 ] * n
+        for v in order:
+            best_assign[v] = min(range(k), key=lambda c:
+                    self.chan_scores[v][c] + sum(w for (u, w) in W[v].items()
+                        if depth_of[u] < depth_of[v] and best_assign[u] == c))
+        best_score = self.evaluate_assignment(best_assign)
+        start = self.get_start_assignment() if warm_start else None
+        if start is not None and None not in start:
+            start_score = self.evaluate_assignment(start)
+            if start_score < best_score:
+                best_score = start_score
+                best_assign[:] = start
+        metrics.registry.point("solver_best_score", best_score,
+                               algorithm="bnb")
+
+        # Lower bound contribution of edges between unassigned nodes;
+        # only negative penalties can lower the score.
+        neg_rest = sum(min(0, w) for i in range(n)
+                                 for (j, w) in W[i].items() if i < j)
+
+        explored = 0
+        def _search(depth, committed, neg_rest):
+            nonlocal explored, best_score
+            explored += 1
+            if depth == n:
+                if committed < best_score:
+                    best_score = committed
+                    best_assign[:] = assign
+                    metrics.registry.point("solver_best_score", best_score,
+                                           algorithm="bnb")
+                return
+            bound = committed + neg_rest
+            for u in order[depth:]:
+                bound += min(cost[u])
+            if bound >= best_score:
+                return
+
+            v = order[depth]
+            nb = [ (u, w) for (u, w) in W[v].items() if depth_of[u] > depth ]
+            neg_v = sum(min(0, w) for (u, w) in nb)
+            cands = [ c for c in range(k)
+                        if prev[c] is None or used[prev[c]] > 0 ]
+            cands.sort(key=lambda c: cost[v][c])
+            for c in cands:
+                assign[v] = c
+                used[c] += 1
+                for (u, w) in nb:
+                    cost[u][c] += w
+                _search(depth + 1, committed + cost[v][c], neg_rest - neg_v)
+                for (u, w) in nb:
+                    cost[u][c] -= w
+                used[c] -= 1
+
+        if k > 0:
+            _search(0, const, neg_rest)
+
+        # Recompute to get rid of accumulated rounding error
+        best_score = self.evaluate_assignment(best_assign)
+        metrics.registry.add("solver_iterations_total", explored,
+                             algorithm="bnb")
+        if verbose:
+            print("Branch and bound: %d nodes explored in %.1fs"
+                    % (explored, time.monotonic() - t0))
+            print("  %.2g  %r" % (best_score, best_assign))
+        return (best_score, best_assign)
+
+    def solve(self, algorithm='exhaustive', time_budget=10.0, seed=None,
+      verbose=True, warm_start=False):
+        """Find a good assignment with the given algorithm.
+
+        @param  algorithm
+                one of 'exhaustive', 'bnb' or 'anneal'.
+
+        @param  time_budget, seed
+                settings of the anneal solver, see find_good_assignment().
+
+        @param  warm_start
+                start from the current channels; see
+                find_good_assignment() and find_optimal_assignment().
+                The exhaustive search ignores it.
+
+        @return Tuple (score, assignment).
+        """
+        if algorithm == 'anneal':
+            return self.find_good_assignment(time_budget, seed, verbose,
+                                             warm_start)
+        elif algorithm == 'bnb':
+            return self.find_optimal_assignment(verbose, warm_start)
+        assign = self.find_best_assignment(verbose)
+        return (self.evaluate_assignment(assign), assign)
+
+    def split_components(self):
+        """Split the instance into its connected components.
+
+        The score of an assignment is the sum of the scores of its
+        restrictions to the components, so these can be solved
+        independently.
+
+        @return List of tuples (indices, instance), where indices are
+                the indexes of the component's nodes in this instance,
+                and instance is the ChannelProblemInstance of the
+                component.
+        """
+        n = len(self.nodes)
+        W, _ = self._pair_weights()
+        seen = [ False ] * n
+        ret = []
+        for root in range(n):
+            if seen[root]:
+                continue
+            seen[root] = True
+            indices = [ root ]
+            for u in indices:
+                for v in W[u]:
+                    if not seen[v]:
+                        seen[v] = True
+                        indices.append(v)
+            indices.sort()
+            pos = dict((i, p) for (p, i) in enumerate(indices))
+
+            sub = ChannelProblemInstance()
+            sub.nodes = [ self.nodes[i] for i in indices ]
+            sub.channels = self.channels
+            sub.graph = dict((pos[i], [ pos[j] for j in self.graph[i] ])
+                             for i in indices if i in self.graph)
+            sub.chan_scores = [ self.chan_scores[i] for i in indices ]
+            sub.tx_values = [ self.tx_values[i] for i in indices ]
+            if self.current_freqs is not None:
+                sub.current_freqs = [ self.current_freqs[i]
+                                      for i in indices ]
+            ret.append( (indices, sub) )
+        return ret
+
+    def solve_by_components(self, algorithm='exhaustive', time_budget=10.0,
+      seed=None, processes=None, verbose=True, warm_start=False):
+        """Find a good assignment, solving each component on its own.
+
+        The connected components are solved in parallel on a pool of
+        processes, and their assignments combined.  The anneal solver's
+        time budget is split among the components in proportion to
+        their size, such that the whole run takes about time_budget.
+
+        @param  processes
+                number of worker processes; defaults to the number of
+                CPUs.  With 1, the components are solved in this
+                process.
+
+        @param  warm_start
+                start each component from its current channels, see
+                solve().
+
+        @return Tuple (score, assignment).
+        """
+        n = len(self.nodes)
+        if processes is None:
+            processes = os.cpu_count() or 1
+        t0 = time.monotonic()
+        components = self.split_components()
+        assign = [ 0 ] * n
+
+        # Single nodes are trivial; pick the best channel right away.
+        jobs = []
+        for (c, (indices, sub)) in enumerate(components):
+            if len(indices) == 1:
+                assign[indices[0]] = _solve_component(
+                        (indices, sub, 'bnb', 0, None, False))[0][0]
+                continue
+            budget = time_budget
+            if algorithm == 'anneal':
+                budget *= min(1, len(indices) / n *
+                                 min(processes, len(components)))
+            jobs.append( (indices, sub, algorithm, budget,
+                          None if seed is None else seed + c, warm_start) )
+
+        if processes == 1 or len(jobs) <= 1:
+            results = list(map(_solve_component, jobs))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+                results = list(pool.map(_solve_component, jobs))
+        for (c, ((indices, _, _, _, _, _), (sub_assign, sub_metrics))) \
+                in enumerate(zip(jobs, results)):
+            for (i, v) in zip(indices, sub_assign):
+                assign[i] = v
+            metrics.registry.merge(sub_metrics, component=c)
+
+        score = self.evaluate_assignment(assign)
+        if verbose:
+            print("Solved %d components (%d nontrivial) in %.1fs"
+                    % (len(components), len(jobs), time.monotonic() - t0))
+            print("  %.2g  %r" % (score, assign))
+        return (score, assign)
+
+def _solve_component(job):
+    """Solve one component; worker of solve_by_components().
+
+    The solver metrics are recorded into a registry of their own, and
+    returned along with the assignment to be merged by the caller.
+    """
+    _, sub, algorithm, time_budget, seed, warm_start = job
+    saved = metrics.registry
+    metrics.registry = metrics.Metrics()
+    try:
+        assign = sub.solve(algorithm, time_budget, seed, verbose=False,
+                           warm_start=warm_start)[1]
+        return (assign, metrics.registry.dump())
+    finally:
+        metrics.registry = saved
+
+# Number of assignments evaluated per batch in exhaustive search
+_BATCH_SIZE = 4096
+
+def _lowest(scores, idx, m):
+    """Return the m lowest scores and their indexes, in order; ties go
+    to the lower index."""
+    if len(scores) > m:
+        keep = scores <= np.partition(scores, m - 1)[m - 1]
+        scores, idx = scores[keep], idx[keep]
+    order = np.lexsort((idx, scores))[:m]
+    return (scores[order], idx[order])
+
+def _cartesian(n, k, start, stop):
     """Cartesian product.
 
-    Generator producing the all the length n vectors
-    with values [0,...k - 1].
+    Return the rows start to stop - 1 of the lexicographically ordered
+    array of all the length n vectors with values [0,...k - 1].
     """
-    if n == 0:
-        yield []
-        return
-    for i in range(k):
-        for ass0 in _cartesian(n - 1, k):
-            yield [ i ] + ass0
+    idx = np.arange(start, stop, dtype=np.int64)
+    weights = k ** np.arange(n - 1, -1, -1, dtype=np.int64)
+    return (idx[:, None] // weights[None, :]) % k
 
 def _usage():
     print("Wifi spectrum optimizer")
@@ -94,17 +694,46 @@ def _usage():
     print("   -s          perform channel assignments after finding")
     print("               good solution")
     print("   -r #        set collector history size to given value")
+    print("   -a <alg>    solver to use: exhaustive, bnb (branch and bound),")
+    print("               anneal [exhaustive]")
+    print("   -t #        time budget of the anneal solver, in seconds [10]")
+    print("   -S #        random seed of the anneal solver")
+    print("   -R          use the slice rollups rather than the raw survey")
+    print("   -p #        number of processes solving the connected")
+    print("               components of the graph [number of CPUs]")
+    print("   -M          don't keep SSH connections to the APs open")
+    print("   -j #        number of channel switches run concurrently [16]")
+    print("   -w <file>   save the collected data to a snapshot file")
+    print("   -l <file>   solve the instance of a snapshot file rather than")
+    print("               collecting it from the DB; -c is ignored")
+    print("   -C #        switching penalty added to the score of each")
+    print("               interface moved off its current channel [0]")
+    print("   -F          solve from scratch, rather than starting from the")
+    print("               current channels")
+    print("   -m <file>   write metrics to the file; Prometheus text format")
+    print("               if it ends in .prom, else a JSON line is appended")
 
 def main():
     # Default settings
     dbname = 'wifispecman'
     channels = [ 5180, 5220, 5240 ]
     do_set = False
+    algorithm = 'exhaustive'
+    time_budget = 10.0
+    seed = None
+    use_slices = False
+    processes = None
+    multiplex = True
+    concurrency = 16
+    save_path = None
+    load_path = None
+    metrics_path = None
+    switch_cost = 0.0
+    warm_start = True
 
     # Read options
-    import sys
     import getopt
-    opts, args = getopt.getopt(sys.argv[1:], 'hd:c:sr:')
+    opts, args = getopt.getopt(sys.argv[1:], 'hd:c:sr:a:t:S:Rp:Mj:w:l:m:C:F')
     for k, v in opts:
         if k == '-h':
             _usage()
@@ -117,33 +746,107 @@ def main():
             do_set = True
         elif k == '-r':
             collector.hist_size = float(v)
+        elif k == '-a':
+            algorithm = v
+        elif k == '-t':
+            time_budget = float(v)
+        elif k == '-S':
+            seed = int(v)
+        elif k == '-R':
+            use_slices = True
+        elif k == '-p':
+            processes = int(v)
+        elif k == '-M':
+            multiplex = False
+        elif k == '-j':
+            concurrency = int(v)
+        elif k == '-w':
+            save_path = v
+        elif k == '-l':
+            load_path = v
+        elif k == '-m':
+            metrics_path = v
+        elif k == '-C':
+            switch_cost = float(v)
+        elif k == '-F':
+            warm_start = False
+
+    if algorithm not in ('exhaustive', 'bnb', 'anneal'):
+        sys.stderr.write("Error:  Unknown solver `%s'.\n" % (algorithm,))
+        sys.exit(1)
 
-    # Open DB
-    conn, cursor = collector.open_db(dbname)
+    # Open DB; a snapshot is solved without it, unless channels are set
+    conn, cursor = None, None
+    if load_path is None or do_set:
+        conn, cursor = collector.open_db(dbname)
+        cursor = metrics.CountingCursor(cursor)
 
     # Get values for instance
-    inst = ChannelProblemInstance()
-    inst.collect_data(conn, cursor, channels)
+    if load_path is not None:
+        inst = ChannelProblemInstance.load_snapshot(load_path)
+        channels = inst.channels
+        print("Loaded snapshot of %d nodes collected at %s"
+                % (len(inst.nodes), time.ctime(inst.collected)))
+    else:
+        inst = ChannelProblemInstance()
+        with metrics.registry.timer("optimizer_collect"):
+            inst.collect_data(conn, cursor, channels, use_slices)
+    metrics.registry.set("optimizer_nodes", len(inst.nodes))
+    if save_path is not None:
+        inst.save_snapshot(save_path)
+    if switch_cost != 0:
+        inst.add_switch_cost(switch_cost)
 
-    # Evaluate the different assignments,
-    best_ass = inst.find_best_assignment()
+    # Evaluate the different assignments, one connected component at a
+    # time
+    try:
+        with metrics.registry.timer("optimizer_solve"):
+            best_score, best_ass = inst.solve_by_components(algorithm,
+                                        time_budget, seed, processes,
+                                        warm_start=warm_start)
+    except ValueError as e:
+        sys.stderr.write("Error:  %s\n" % (e,))
+        sys.exit(1)
+    metrics.registry.set("optimizer_best_score", best_score)
+    if inst.current_freqs is not None:
+        # Only the interfaces whose current channel is known can be
+        # told to move
+        known = [ (f, inst.channels[c]) for (f, c)
+                  in zip(inst.current_freqs, best_ass) if f is not None ]
+        moved = sum(1 for (f, g) in known if f != g)
+        unknown = len(best_ass) - len(known)
+        print("%d of %d interfaces change channel" % (moved, len(known))
+              + (", %d more are on an unknown channel" % (unknown,)
+                 if unknown > 0 else ""))
+        metrics.registry.set("optimizer_moved", moved)
+        metrics.registry.set("optimizer_current_unknown", unknown)
     print("The best assignment is", best_ass)
 
     # Apply the settings to the nodes
     if do_set:
+        # Only switch the interfaces whose channel changes
+        sessions = sshsession.SSHSessions() if multiplex else None
+        current = collector.get_current_frequencies(conn, cursor, inst.nodes)
         ip_ifnames = collector.get_ip_ifname_for_ifaces(
                         conn, cursor, inst.get_interface_ids())
+        changes = {}
         for i, (ip, ifname) in enumerate(ip_ifnames):
-            cmd = [ "ssh", "-n", "-T", "root@%s" % (ip,),
-                    "./setchan.sh", ifname, str(channels[best_ass[i]]) ]
-            print("Running", " ".join(cmd))
-            result = subprocess.run(cmd,
-                            stdin=subprocess.DEVNULL,
-                            timeout=25)
-            print("--> Got exitcode", result.returncode)
+            freq = channels[best_ass[i]]
+            if current[i] != freq:
+                changes[i] = (ip, ifname, freq)
+        print("Switching %d of %d interfaces" % (len(changes), len(current)))
+        metrics.registry.set("optimizer_switches", len(changes))
+        with metrics.registry.timer("optimizer_rollout"):
+            rollout.rollout(inst.graph, changes, sessions, concurrency)
+        if sessions is not None:
+            print(sessions.format_stats())
 
     # Finish
-    conn.close()
+    if conn is not None:
+        conn.close()
+    if metrics_path is not None:
+        metrics.registry.write(metrics_path, program="optimizer",
+                               algorithm=algorithm)
 
 if __name__ == "__main__":
     main()
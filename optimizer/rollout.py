@@ -0,0 +1,107 @@
+"""
+Staged rollout of a channel assignment.
+
+Only the interfaces whose channel actually changes are switched.  They
+are switched in waves:  within a wave, the channel switches run
+concurrently, but no two neighbors in the interference graph are in
+the same wave, so that neighboring APs never switch at the same moment.
+"""
+
+import concurrent.futures
+import subprocess
+import time
+
+def plan_waves(graph, nodes):
+    """Partition nodes into waves of pairwise non-neighboring nodes.
+
+    This is a greedy coloring of the graph restricted to nodes, taking
+    the nodes in order of decreasing degree.
+
+    @param  graph
+            the graph, as computed by collector.get_graph().
+
+    @param  nodes
+            the nodes to partition (indexes into the nodes array).
+
+    @return list of waves; each wave is a list of nodes.
+    """
+    nodes = sorted(nodes, key=lambda i: (-len(graph.get(i, [])), i))
+    wave_of = {}
+    waves = []
+    for i in nodes:
+        taken = set(wave_of.get(j) for j in graph.get(i, []))
+        w = 0
+        while w in taken:
+            w += 1
+        if w == len(waves):
+            waves.append([])
+        waves[w].append(i)
+        wave_of[i] = w
+    for wave in waves:
+        wave.sort()
+    return waves
+
+def _switch_channel(sessions, ip, ifname, freq, timeout):
+    """Run setchan.sh on an AP.
+
+    @return Tuple (success, message).
+    """
+    args = [ "./setchan.sh", ifname, str(freq) ]
+    try:
+        if sessions is not None:
+            result = sessions.run(ip, args, timeout)
+        else:
+            result = subprocess.run(
+                        [ "ssh", "-n", "-T", "root@%s" % (ip,) ] + args,
+                        stdin=subprocess.DEVNULL,
+                        capture_output=True,
+                        text=True,
+                        timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return (False, "timeout")
+    return (result.returncode == 0, "exit code %d" % (result.returncode,))
+
+def rollout(graph, changes, sessions=None, concurrency=16, timeout=25,
+  verbose=True):
+    """Switch the channels of the given interfaces, in waves.
+
+    @param  graph
+            the graph, as computed by collector.get_graph().
+
+    @param  changes
+            dict node index -> (ip_addr, ifname, frequency) of the
+            interfaces to switch.
+
+    @param  sessions
+            sshsession.SSHSessions object to run the commands with, or
+            None to use a new ssh connection for each.
+
+    @param  concurrency
+            maximum number of channel switches running at the same time.
+
+    @return list with one tuple (nodes, failed) per wave, where failed
+            is a dict node index -> error message.
+    """
+    report = []
+    waves = plan_waves(graph, changes.keys())
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        for (w, wave) in enumerate(waves):
+            t0 = time.monotonic()
+            futures = [ pool.submit(_switch_channel, sessions,
+                                    *(changes[i] + (timeout,)))
+                        for i in wave ]
+            failed = {}
+            for (i, f) in zip(wave, futures):
+                ok, msg = f.result()
+                if not ok:
+                    failed[i] = msg
+            report.append( (wave, failed) )
+            if verbose:
+                print("Wave %d: %d switched, %d failed in %.1fs"
+                        % (w + 1, len(wave) - len(failed), len(failed),
+                           time.monotonic() - t0))
+                for i in wave:
+                    ip, ifname, freq = changes[i]
+                    print("  %s %s -> %d: %s" % (ip, ifname, freq,
+                            failed.get(i, "ok")))
+    return report
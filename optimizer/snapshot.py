@@ -0,0 +1,100 @@
+"""
+Snapshot files of problem instances.
+
+A snapshot holds the data collected for a ChannelProblemInstance, so
+that the solver can be rerun without the database.  The file layout is
+
+    magic           8 bytes, "WSMSNAP1"
+    header length   little endian uint64
+    header          JSON object:  the scalar data, and for each array
+                    its dtype, shape and offset in the file
+    arrays          raw little endian array data, each aligned to
+                    _ALIGN bytes
+
+so that the arrays can be memory-mapped rather than read.
+"""
+
+import json
+import struct
+
+import numpy as np
+
+_MAGIC = b"WSMSNAP1"
+
+# Alignment of the arrays in the file
+_ALIGN = 64
+
+def _pad(offset):
+    return -offset % _ALIGN
+
+def write(path, header, arrays):
+    """Write a snapshot.
+
+    @param  header
+            dict of JSON serializable data.
+
+    @param  arrays
+            dict name -> numpy array.
+    """
+    arrays = dict((name, np.ascontiguousarray(a, a.dtype.newbyteorder('<')))
+                  for (name, a) in arrays.items())
+
+    # The header size depends on the offsets and vice versa; lay out the
+    # arrays after a header of a given size, and grow it until it fits.
+    size = 256
+    while True:
+        offset = len(_MAGIC) + 8 + size
+        layout = {}
+        for (name, a) in arrays.items():
+            offset += _pad(offset)
+            layout[name] = { "dtype": a.dtype.str, "shape": list(a.shape),
+                             "offset": offset }
+            offset += a.nbytes
+        data = json.dumps(dict(header, arrays=layout)).encode("utf-8")
+        if len(data) <= size:
+            break
+        size = 2 * len(data)
+
+    with open(path, "wb") as f:
+        f.write(_MAGIC)
+        f.write(struct.pack("<Q", size))
+        f.write(data.ljust(size))
+        for (name, a) in arrays.items():
+            f.write(b"\0" * (layout[name]["offset"] - f.tell()))
+            f.write(a.tobytes())
+
+def read(path, mmap=True):
+    """Read a snapshot.
+
+    @param  mmap
+            if set, the arrays are read-only views of the memory-mapped
+            file; otherwise they are read into memory.
+
+    @return Tuple (header, arrays) as given to write().
+    """
+    with open(path, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("%s: not a snapshot file" % (path,))
+        size, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(size).decode("utf-8"))
+
+    layout = header.pop("arrays")
+    arrays = {}
+    if mmap:
+        buf = np.memmap(path, dtype=np.uint8, mode='r')
+        for (name, d) in layout.items():
+            dtype = np.dtype(d["dtype"])
+            count = int(np.prod(d["shape"], dtype=np.int64))
+            arrays[name] = np.frombuffer(buf, dtype, count, d["offset"]) \
+                            .reshape(d["shape"])
+    else:
+        with open(path, "rb") as f:
+            for (name, d) in layout.items():
+                dtype = np.dtype(d["dtype"])
+                count = int(np.prod(d["shape"], dtype=np.int64))
+                f.seek(d["offset"])
+                arrays[name] = np.fromfile(f, dtype, count) \
+                                .reshape(d["shape"])
+    return (header, arrays)
+
+# vim:sts=4:et
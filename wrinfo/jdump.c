@@ -31,6 +31,8 @@ static jdump_stack_entry* push(jdump_state* ds)
 
 static void indent(jdump_state* ds)
 {
+	if (ds->compact)
+		return;
 	putc('\n', ds->fp);
 	for (int i = 0; i < ds->stack_depth; ++i) {
 		fprintf(ds->fp, "  ");
@@ -48,6 +50,13 @@ jdump_state jdump_create(FILE* fp)
 	return ret;
 }
 
+jdump_state jdump_create_compact(FILE* fp)
+{
+	jdump_state ret = jdump_create(fp);
+	ret.compact = true;
+	return ret;
+}
+
 static void write_str(FILE* fp, const char* str, ssize_t len, bool quot_marks)
 {
 	if (quot_marks)
@@ -41,11 +41,19 @@ typedef struct {
 
 typedef struct jdump_state_S {
 	FILE* fp;
+
+	/** If set, the output is put on a single line rather than
+	 *  pretty-printed; the newline of jdump_done() then terminates
+	 *  the document, as in newline delimited JSON.
+	 */
+	bool compact;
+
 	int stack_depth;
 	jdump_stack_entry stack[JDUMP_MAX_STACK_DEPTH];
 } jdump_state;
 
 jdump_state jdump_create(FILE* fp);
+jdump_state jdump_create_compact(FILE* fp);
 int jdump_put_pod(jdump_state* ds, const char* rep, ssize_t len, bool quot_marks);
 int jdump_put_array(jdump_state* ds);
 int jdump_close_array(jdump_state* ds);
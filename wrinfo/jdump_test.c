@@ -75,5 +75,15 @@ int main(int argc, char** argv)
 	CHECKED(jdump_close_object(j));
 	CHECKED(jdump_done(j));
 
+	puts("\nCompact jdump output for object of arrays and objects:");
+	Jd = jdump_create_compact(stdout);
+	CHECKED(jdump_put_object(j));
+	jdump_put_key(j, "arr");
+	simple_array(j);
+	jdump_put_key(j, "obj");
+	simple_object(j);
+	CHECKED(jdump_close_object(j));
+	CHECKED(jdump_done(j));
+
 	return 0;
 }
@@ -9,6 +9,7 @@
 
 #include "jdump.h"
 #include "nlcctx.h"
+#include "wbin.h"
 #include "wifi_interface.h"
 #include "wifi_scan.h"
 #include "wifi_survey.h"
@@ -23,6 +24,12 @@ static void usage()
 		"\n"
 		"  -h       display this help and exit\n"
 		"  -i <if>  wifi networ interface to query\n"
+		"  -s       perform a channel scan\n"
+		"  -l <s>   keep running, and output a record every <s>\n"
+		"           seconds, one per line (newline delimited JSON).\n"
+		"           Only the first record has scan results.\n"
+		"  -b       output the record in the compact binary format\n"
+		"           of wbin.h rather than as JSON\n"
 	);
 }
 
@@ -55,15 +62,65 @@ static void dump_meta_info(jdump_state* jd, int argc, char** argv)
 	jdump_close_object(jd);
 }
 
+static void dump_record(struct nlcctx* ctx, jdump_state* jd,
+			bool do_scan, bool with_scan, int argc, char** argv)
+{
+	jdump_put_object(jd);
+
+	/* Get interface information */
+	jdump_put_key(jd, "interface");
+	wifi_get_interface_info(ctx, jd);
+
+	/* Perform channel scan + Record results */
+	if (do_scan)
+		wifi_scan(ctx);
+	jdump_put_key(jd, "scan");
+	if (with_scan) {
+		wifi_get_scan_results(ctx, jd);
+	} else {
+		jdump_put_array(jd);
+		jdump_close_array(jd);
+	}
+
+	/* Get Survey */
+	jdump_put_key(jd, "survey");
+	wifi_get_survey_results(ctx, jd);
+
+	/* Get meta information */
+	jdump_put_key(jd, "meta");
+	dump_meta_info(jd, argc, argv);
+
+	jdump_close_object(jd); // end of global object
+	jdump_done(jd);
+}
+
+static int dump_record_bin(struct nlcctx* ctx, bool do_scan,
+			   int argc, char** argv)
+{
+	wbin_state wb = wbin_create(stdout);
+
+	wifi_get_interface_info_bin(ctx, &wb);
+	if (do_scan)
+		wifi_scan(ctx);
+	wifi_get_scan_results_bin(ctx, &wb);
+	wifi_get_survey_results_bin(ctx, &wb);
+
+	const int ret = wbin_done(&wb, argc, argv);
+	wbin_free(&wb);
+	return ret;
+}
+
 int main(int argc, char** argv)
 {
 	/* Settings, default values */
 	char* net_if = strdup("wlan0");
 	bool do_scan = false;
+	int interval = 0;
+	bool binary = false;
 
 	/* Parse command line arguments */
 	int c;
-	while ((c = getopt(argc, argv, "hi:s")) != -1) {
+	while ((c = getopt(argc, argv, "hi:sl:b")) != -1) {
 		switch (c) {
 		case 'h':
 			usage();
@@ -79,11 +136,27 @@ int main(int argc, char** argv)
 		case 's':
 			do_scan = true;
 			break;
+		case 'l':
+			interval = atoi(optarg);
+			if (interval <= 0) {
+				fprintf(stderr, "Error:  Invalid interval `%s'.\n",
+				  optarg);
+				return EXIT_FAILURE;
+			}
+			break;
+		case 'b':
+			binary = true;
+			break;
 		case '?':
 			return EXIT_FAILURE;
 		};
 	}
 
+	if (binary && interval != 0) {
+		fprintf(stderr, "Error:  -b can't be combined with -l.\n");
+		return EXIT_FAILURE;
+	}
+
 	/* Create the context */
 	struct nlcctx* ctx = nlcctx_create(net_if);
 	if (ctx == NULL) {
@@ -91,31 +164,28 @@ int main(int argc, char** argv)
 		return EXIT_FAILURE;
 	}
 
-	/* Create output */
-	jdump_state jd = jdump_create(stdout);
-	jdump_put_object(&jd);
-
-	/* Get interface information */
-	jdump_put_key(&jd, "interface");
-	wifi_get_interface_info(ctx, &jd);
-
-	/* Perform channel scan + Record results */
-	if (do_scan)
-		wifi_scan(ctx);
-	jdump_put_key(&jd, "scan");
-	wifi_get_scan_results(ctx, &jd);
-
-	/* Get Survey */
-	jdump_put_key(&jd, "survey");
-	wifi_get_survey_results(ctx, &jd);
-
-	/* Get meta information */
-	jdump_put_key(&jd, "meta");
-	dump_meta_info(&jd, argc, argv);
-
-	jdump_close_object(&jd); // end of global object
-	jdump_done(&jd);
+	int ret = EXIT_SUCCESS;
+	if (binary) {
+		/* Single binary record */
+		if (dump_record_bin(ctx, do_scan, argc, argv) < 0)
+			ret = EXIT_FAILURE;
+	} else if (interval == 0) {
+		/* Single record */
+		jdump_state jd = jdump_create(stdout);
+		dump_record(ctx, &jd, do_scan, true, argc, argv);
+	} else {
+		/* Streaming mode:  one record per line, until killed */
+		jdump_state jd = jdump_create_compact(stdout);
+		dump_record(ctx, &jd, do_scan, true, argc, argv);
+		fflush(stdout);
+		for (;;) {
+			sleep(interval);
+			dump_record(ctx, &jd, false, false, argc, argv);
+			if (fflush(stdout) != 0)
+				break;	// Reader went away
+		}
+	}
 
 	nlcctx_free(ctx);
-	return EXIT_SUCCESS;
+	return ret;
 }
@@ -0,0 +1,202 @@
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#include "wbin.h"
+
+/* Buffer helpers */
+
+static void put_bytes(wbin_state* wb, wbin_buf* b, const void* data,
+			size_t len)
+{
+	if (len == 0)
+		return;
+	if (b->len + len > b->cap) {
+		size_t cap = (b->cap > 0 ? 2 * b->cap : 256);
+		while (cap < b->len + len)
+			cap *= 2;
+		unsigned char* p = realloc(b->data, cap);
+		if (p == NULL) {
+			if (!wb->failed)
+				fprintf(stderr, "Error (wbin):  realloc "
+				  "failed.\n");
+			wb->failed = true;
+			return;
+		}
+		b->data = p;
+		b->cap = cap;
+	}
+	memcpy(b->data + b->len, data, len);
+	b->len += len;
+}
+
+/* Little endian integers, independent of the byte order of the AP */
+static void put_uint(wbin_state* wb, wbin_buf* b, uint64_t v, int size)
+{
+	unsigned char bytes[8];
+	for (int i = 0; i < size; ++i) {
+		bytes[i] = v & 0xff;
+		v >>= 8;
+	}
+	put_bytes(wb, b, bytes, size);
+}
+
+#define put_u8(wb, b, v)	put_uint(wb, b, v, 1)
+#define put_u16(wb, b, v)	put_uint(wb, b, v, 2)
+#define put_u32(wb, b, v)	put_uint(wb, b, v, 4)
+#define put_u64(wb, b, v)	put_uint(wb, b, v, 8)
+
+static void put_str(wbin_state* wb, wbin_buf* b, const char* str, int len)
+{
+	if (str == NULL)
+		len = 0;
+	else if (len == -1)
+		len = strlen(str);
+	if (len > 0xffff)
+		len = 0xffff;
+	put_u16(wb, b, len);
+	put_bytes(wb, b, str, len);
+}
+
+/* Index of an SSID in the dictionary; it's added if not there yet. */
+static int ssid_index(wbin_state* wb, const char* ssid, int len)
+{
+	if (wb->failed)
+		return 0;
+	size_t pos = 0;
+	for (int i = 0; i < wb->n_ssids; ++i) {
+		const unsigned char* p = wb->ssids.data + pos;
+		const int l = p[0] | p[1] << 8;
+		if (l == len && memcmp(p + 2, ssid, len) == 0)
+			return i;
+		pos += 2 + l;
+	}
+	if (wb->n_ssids >= 0xffff) {
+		fprintf(stderr, "Error (wbin):  Too many SSIDs.\n");
+		wb->failed = true;
+		return 0;
+	}
+	put_str(wb, &wb->ssids, ssid, len);
+	return wb->n_ssids++;
+}
+
+/* API implementation */
+
+wbin_state wbin_create(FILE* fp)
+{
+	wbin_state ret = {
+		.fp = fp,
+		.failed = false,
+	};
+	return ret;
+}
+
+void wbin_free(wbin_state* wb)
+{
+	free(wb->interface.data);
+	free(wb->ssids.data);
+	free(wb->scan.data);
+	free(wb->survey.data);
+	*wb = wbin_create(wb->fp);
+}
+
+int wbin_put_interface(wbin_state* wb, const wbin_interface* ifc)
+{
+	if (wb->n_interface > 0) {
+		fprintf(stderr, "Error (wbin):  More than one interface.\n");
+		return -1;
+	}
+	wbin_buf* b = &wb->interface;
+	put_u16(wb, b, ifc->flags);
+	put_str(wb, b, ifc->interface, -1);
+	put_u32(wb, b, ifc->ifindex);
+	put_bytes(wb, b, ifc->mac, 6);
+	put_str(wb, b, ifc->ssid, -1);
+	put_u32(wb, b, ifc->frequency);
+	put_u32(wb, b, ifc->channel_width_enum);
+	put_u32(wb, b, ifc->center_freq1);
+	put_u32(wb, b, ifc->center_freq2);
+	put_u32(wb, b, ifc->channel_type_enum);
+	++wb->n_interface;
+	return (wb->failed ? -1 : 0);
+}
+
+int wbin_put_scan(wbin_state* wb, const wbin_scan* scan)
+{
+	if (wb->n_scan >= 0xffff) {
+		fprintf(stderr, "Error (wbin):  Too many scan entries.\n");
+		return -1;
+	}
+	const int idx = ((scan->flags & WBIN_SCAN_SSID)
+			? ssid_index(wb, scan->ssid, scan->ssid_len) : 0);
+	wbin_buf* b = &wb->scan;
+	put_u8(wb, b, scan->flags);
+	put_bytes(wb, b, scan->bssid, 6);
+	put_u32(wb, b, scan->frequency);
+	put_u16(wb, b, idx);
+	++wb->n_scan;
+	return (wb->failed ? -1 : 0);
+}
+
+int wbin_put_survey(wbin_state* wb, const wbin_survey* survey)
+{
+	if (wb->n_survey >= 0xffff) {
+		fprintf(stderr, "Error (wbin):  Too many survey entries.\n");
+		return -1;
+	}
+	wbin_buf* b = &wb->survey;
+	put_u16(wb, b, survey->flags);
+	put_u32(wb, b, survey->frequency);
+	put_u8(wb, b, (uint8_t)survey->noise);
+	put_u64(wb, b, survey->time);
+	put_u64(wb, b, survey->busy);
+	put_u64(wb, b, survey->ext_busy);
+	put_u64(wb, b, survey->rx);
+	put_u64(wb, b, survey->tx);
+	++wb->n_survey;
+	return (wb->failed ? -1 : 0);
+}
+
+int wbin_done(wbin_state* wb, int argc, char** argv)
+{
+	wbin_buf rec = { 0 };
+
+	/* Meta information:  time the sample was taken, command line */
+	const time_t t = time(NULL);
+	put_u64(wb, &rec, (uint64_t)(int64_t)t);
+	put_str(wb, &rec, ctime(&t), -1);
+	{
+		wbin_buf cmdline = { 0 };
+		for (int i = 0; i < argc; ++i) {
+			if (i > 0)
+				put_bytes(wb, &cmdline, " ", 1);
+			put_bytes(wb, &cmdline, argv[i], strlen(argv[i]));
+		}
+		put_str(wb, &rec, (char*)cmdline.data, cmdline.len);
+		free(cmdline.data);
+	}
+
+	/* Sections */
+	put_u8(wb, &rec, wb->n_interface);
+	put_bytes(wb, &rec, wb->interface.data, wb->interface.len);
+	put_u16(wb, &rec, wb->n_ssids);
+	put_bytes(wb, &rec, wb->ssids.data, wb->ssids.len);
+	put_u16(wb, &rec, wb->n_scan);
+	put_bytes(wb, &rec, wb->scan.data, wb->scan.len);
+	put_u16(wb, &rec, wb->n_survey);
+	put_bytes(wb, &rec, wb->survey.data, wb->survey.len);
+
+	if (wb->failed) {
+		free(rec.data);
+		return -1;
+	}
+
+	/* Write header and record */
+	unsigned char hdr[8] = { 'W', 'R', 'B', '1' };
+	for (int i = 0; i < 4; ++i)
+		hdr[4 + i] = (rec.len >> (8 * i)) & 0xff;
+	fwrite(hdr, 1, sizeof(hdr), wb->fp);
+	fwrite(rec.data, 1, rec.len, wb->fp);
+	free(rec.data);
+	return 0;
+}
@@ -0,0 +1,146 @@
+#ifndef WBIN_H
+#define WBIN_H
+
+/**	@file	wbin.h
+ *
+ *	Compact binary output, the alternative to jdump selected with
+ *	wrinfo -b.  A record holds the same data as the JSON one, but the
+ *	survey and scan entries are fixed-width, and the SSIDs of the scan
+ *	are stored once each in a dictionary.  All integers are little
+ *	endian:
+ *
+ *	  magic		"WRB1"
+ *	  length	u32, number of bytes of the record after this
+ *	  meta		i64 time_unix, str time_human, str cmdline
+ *	  interface	u8 count (0 or 1), then if 1:
+ *			u16 flags, str interface, u32 ifindex, 6 bytes
+ *			mac, str ssid, u32 frequency, u32
+ *			channel_width_enum, u32 center_freq1, u32
+ *			center_freq2, u32 channel_type_enum
+ *	  ssids		u16 count, then count str
+ *	  scan		u16 count, then count entries of
+ *			u8 flags, 6 bytes bssid, u32 frequency, u16
+ *			index of the ssid in ssids
+ *	  survey	u16 count, then count entries of
+ *			u16 flags, u32 frequency, i8 noise, u64 time,
+ *			u64 busy, u64 ext_busy, u64 rx, u64 tx
+ *
+ *	where str is a u16 length followed by the bytes of the string.
+ *	The flags tell which fields are present, as in the JSON output a
+ *	field is left out if the attribute is missing; absent fields are
+ *	zero.  db_tools/wrbin.py decodes the records.
+ */
+
+#include <stdbool.h>
+#include <stdint.h>
+#include <stdio.h>
+
+/* Field flags of the interface entry */
+enum {
+	WBIN_IF_INTERFACE		= 1 << 0,
+	WBIN_IF_IFINDEX			= 1 << 1,
+	WBIN_IF_MAC			= 1 << 2,
+	WBIN_IF_SSID			= 1 << 3,
+	WBIN_IF_FREQUENCY		= 1 << 4,
+	WBIN_IF_CHANNEL_WIDTH_ENUM	= 1 << 5,
+	WBIN_IF_CENTER_FREQ1		= 1 << 6,
+	WBIN_IF_CENTER_FREQ2		= 1 << 7,
+	WBIN_IF_CHANNEL_TYPE_ENUM	= 1 << 8,
+};
+
+/* Field flags of the scan entries */
+enum {
+	WBIN_SCAN_BSSID			= 1 << 0,
+	WBIN_SCAN_FREQUENCY		= 1 << 1,
+	WBIN_SCAN_SSID			= 1 << 2,
+};
+
+/* Field flags of the survey entries; WBIN_SURVEY_IN_USE is the value
+ * of the in_use flag, which is always present.
+ */
+enum {
+	WBIN_SURVEY_FREQUENCY		= 1 << 0,
+	WBIN_SURVEY_IN_USE		= 1 << 1,
+	WBIN_SURVEY_NOISE		= 1 << 2,
+	WBIN_SURVEY_TIME		= 1 << 3,
+	WBIN_SURVEY_BUSY		= 1 << 4,
+	WBIN_SURVEY_EXT_BUSY		= 1 << 5,
+	WBIN_SURVEY_RX			= 1 << 6,
+	WBIN_SURVEY_TX			= 1 << 7,
+};
+
+/** Set a field of an entry from a netlink attribute, if it's present,
+ *  and its flag.
+ */
+#define wbin_get_attr(entry, flag, field, attr, getter) \
+	do { \
+		if (attr) { \
+			(entry).flags |= (flag); \
+			(entry).field = getter(attr); \
+		} \
+	} while(0)
+
+typedef struct {
+	unsigned flags;
+	const char* interface;
+	uint32_t ifindex;
+	unsigned char mac[6];
+	const char* ssid;
+	uint32_t frequency;
+	uint32_t channel_width_enum;
+	uint32_t center_freq1;
+	uint32_t center_freq2;
+	uint32_t channel_type_enum;
+} wbin_interface;
+
+typedef struct {
+	unsigned flags;
+	unsigned char bssid[6];
+	uint32_t frequency;
+	const char* ssid;
+	int ssid_len;
+} wbin_scan;
+
+typedef struct {
+	unsigned flags;
+	uint32_t frequency;
+	int8_t noise;
+	uint64_t time;
+	uint64_t busy;
+	uint64_t ext_busy;
+	uint64_t rx;
+	uint64_t tx;
+} wbin_survey;
+
+/** Growable byte buffer */
+typedef struct {
+	unsigned char* data;
+	size_t len;
+	size_t cap;
+} wbin_buf;
+
+typedef struct wbin_state_S {
+	FILE* fp;
+
+	/** Set if a buffer could not be grown; wbin_done() then fails. */
+	bool failed;
+
+	/* The sections of the record, collected until wbin_done() */
+	int n_interface;
+	wbin_buf interface;
+	int n_ssids;
+	wbin_buf ssids;
+	int n_scan;
+	wbin_buf scan;
+	int n_survey;
+	wbin_buf survey;
+} wbin_state;
+
+wbin_state wbin_create(FILE* fp);
+void wbin_free(wbin_state* wb);
+int wbin_put_interface(wbin_state* wb, const wbin_interface* ifc);
+int wbin_put_scan(wbin_state* wb, const wbin_scan* scan);
+int wbin_put_survey(wbin_state* wb, const wbin_survey* survey);
+int wbin_done(wbin_state* wb, int argc, char** argv);
+
+#endif /* WBIN_H */
@@ -1,26 +1,32 @@
 #include <assert.h>
 #include <stdbool.h>
 #include <inttypes.h>
+#include <string.h>
 
 #include "jdump.h"
 #include "jdattr.h"
+#include "wbin.h"
 
 #include "nl_inc.h"
 #include "nlcctx.h"
 
 #include "wifi_interface.h"
 
-static int cb_dump(struct nl_msg* msg, void* arg)
+static void parse(struct nl_msg* msg, struct nlattr** tb)
 {
 	struct genlmsghdr* gnlh = nlmsg_data(nlmsg_hdr(msg));
-	struct nlattr* tb[NL80211_ATTR_MAX + 1];
 
-	/* Parse */
 	nla_parse(tb,				// Array to be filled
 		NL80211_ATTR_MAX,		// Maximum array type to be expected
 		genlmsg_attrdata(gnlh, 0),	// Head of attribute stream to parse
 		genlmsg_attrlen(gnlh, 0),	// Length of attribute stream
 		NULL);				// Validation policy
+}
+
+static int cb_dump(struct nl_msg* msg, void* arg)
+{
+	struct nlattr* tb[NL80211_ATTR_MAX + 1];
+	parse(msg, tb);
 
 	/* Output into JSON */
 	jdump_state* jd = (jdump_state*)arg;
@@ -43,3 +49,41 @@ int wifi_get_interface_info(struct nlcctx* ctx, jdump_state* jd)
 {
 	return nlcctx_msg_exchange(ctx, NL80211_CMD_GET_INTERFACE, cb_dump, jd);
 }
+
+/* Binary output */
+
+static int cb_dump_bin(struct nl_msg* msg, void* arg)
+{
+	struct nlattr* tb[NL80211_ATTR_MAX + 1];
+	parse(msg, tb);
+
+	wbin_interface ifc = { 0 };
+	wbin_get_attr(ifc, WBIN_IF_INTERFACE, interface,
+	  tb[NL80211_ATTR_IFNAME], nla_get_string);
+	wbin_get_attr(ifc, WBIN_IF_IFINDEX, ifindex,
+	  tb[NL80211_ATTR_IFINDEX], nla_get_u32);
+	if (tb[NL80211_ATTR_MAC]) {
+		ifc.flags |= WBIN_IF_MAC;
+		memcpy(ifc.mac, nla_data(tb[NL80211_ATTR_MAC]), 6);
+	}
+	wbin_get_attr(ifc, WBIN_IF_SSID, ssid,
+	  tb[NL80211_ATTR_SSID], nla_get_string);
+	wbin_get_attr(ifc, WBIN_IF_FREQUENCY, frequency,
+	  tb[NL80211_ATTR_WIPHY_FREQ], nla_get_u32);
+	wbin_get_attr(ifc, WBIN_IF_CHANNEL_WIDTH_ENUM, channel_width_enum,
+	  tb[NL80211_ATTR_CHANNEL_WIDTH], nla_get_u32);
+	wbin_get_attr(ifc, WBIN_IF_CENTER_FREQ1, center_freq1,
+	  tb[NL80211_ATTR_CENTER_FREQ1], nla_get_u32);
+	wbin_get_attr(ifc, WBIN_IF_CENTER_FREQ2, center_freq2,
+	  tb[NL80211_ATTR_CENTER_FREQ2], nla_get_u32);
+	wbin_get_attr(ifc, WBIN_IF_CHANNEL_TYPE_ENUM, channel_type_enum,
+	  tb[NL80211_ATTR_WIPHY_CHANNEL_TYPE], nla_get_u32);
+	wbin_put_interface((wbin_state*)arg, &ifc);
+
+	return NL_SKIP;
+}
+
+int wifi_get_interface_info_bin(struct nlcctx* ctx, wbin_state* wb)
+{
+	return nlcctx_msg_exchange(ctx, NL80211_CMD_GET_INTERFACE, cb_dump_bin, wb);
+}
@@ -1,9 +1,11 @@
 #include <ctype.h>
 #include <stdbool.h>
 #include <inttypes.h>
+#include <string.h>
 
 #include "jdump.h"
 #include "jdattr.h"
+#include "wbin.h"
 
 #include "nl_inc.h"
 #include "nlcctx.h"
@@ -99,31 +101,43 @@ cleanup:
 
 /* Implementation of wifi_get_scan_results */
 
-/* Extract the SSID from the information elements and prints it */
-static void dump_ssid(jdump_state* jd, unsigned char *ie, int ielen)
+/* Find the SSID in the information elements; returns NULL if there's
+ * none, else the SSID, with its length in *plen.
+ */
+static const char* find_ssid(unsigned char *ie, int ielen, int *plen)
 {
 	while (ielen >= 2 && ielen >= ie[1] + 2) {
 		const int len = ie[1];
 		if (ie[0] == 0)
 		{
-			/* Information element with ID 0 is the SSID;
-			 * print it and terminate loop.
-			 */
-			jdump_put_pod(jd, (char*)ie + 2, len, true);
-			break;
+			/* Information element with ID 0 is the SSID */
+			*plen = len;
+			return (char*)ie + 2;
 		}
 
 		/* Move to next IE */
 		ielen -= len + 2;
 		ie += len + 2;
 	}
+	return NULL;
 }
 
-static int cb_dump(struct nl_msg *msg, void *uptr)
+/* Extract the SSID from the information elements and prints it */
+static void dump_ssid(jdump_state* jd, unsigned char *ie, int ielen)
+{
+	int len;
+	const char* ssid = find_ssid(ie, ielen, &len);
+	if (ssid)
+		jdump_put_pod(jd, ssid, len, true);
+}
+
+/* Parse the BSS info of a message into bss; returns false if it's
+ * missing or invalid.
+ */
+static bool parse(struct nl_msg *msg, struct nlattr **bss)
 {
 	struct genlmsghdr *gnlh = nlmsg_data(nlmsg_hdr(msg));
 	struct nlattr *tb[NL80211_ATTR_MAX + 1];
-	struct nlattr *bss[NL80211_BSS_MAX + 1];
 	static struct nla_policy bss_policy[NL80211_BSS_MAX + 1] = {
 		[NL80211_BSS_TSF] = { .type = NLA_U64 },
 		[NL80211_BSS_FREQUENCY] = { .type = NLA_U32 },
@@ -146,12 +160,20 @@ static int cb_dump(struct nl_msg *msg, void *uptr)
 		NULL);				// Validation policy
 	if (!tb[NL80211_ATTR_BSS]) {
 		fprintf(stderr, "Error:  BSS info missing.\n");
-		return NL_SKIP;
+		return false;
 	}
 	if (nla_parse_nested(bss, NL80211_BSS_MAX, tb[NL80211_ATTR_BSS], bss_policy)) {
 		fprintf(stderr, "Error:  Could not parse BSS attribute.\n");
-		return NL_SKIP;
+		return false;
 	}
+	return true;
+}
+
+static int cb_dump(struct nl_msg *msg, void *uptr)
+{
+	struct nlattr *bss[NL80211_BSS_MAX + 1];
+	if (!parse(msg, bss))
+		return NL_SKIP;
 
 	/* Print output
 	 * We wrap everyting into a json element.
@@ -179,3 +201,36 @@ int wifi_get_scan_results(struct nlcctx* ctx, jdump_state* jd)
 
 	return ret;
 }
+
+/* Binary output */
+
+static int cb_dump_bin(struct nl_msg *msg, void *uptr)
+{
+	struct nlattr *bss[NL80211_BSS_MAX + 1];
+	if (!parse(msg, bss))
+		return NL_SKIP;
+
+	wbin_scan s = { 0 };
+	if (bss[NL80211_BSS_BSSID]) {
+		s.flags |= WBIN_SCAN_BSSID;
+		memcpy(s.bssid, nla_data(bss[NL80211_BSS_BSSID]), 6);
+	}
+	wbin_get_attr(s, WBIN_SCAN_FREQUENCY, frequency,
+	  bss[NL80211_BSS_FREQUENCY], nla_get_u32);
+	if (bss[NL80211_BSS_INFORMATION_ELEMENTS]) {
+		s.ssid = find_ssid(
+			   nla_data(bss[NL80211_BSS_INFORMATION_ELEMENTS]),
+			   nla_len(bss[NL80211_BSS_INFORMATION_ELEMENTS]),
+			   &s.ssid_len);
+		if (s.ssid)
+			s.flags |= WBIN_SCAN_SSID;
+	}
+	wbin_put_scan((wbin_state*)uptr, &s);
+
+	return NL_SKIP;
+}
+
+int wifi_get_scan_results_bin(struct nlcctx* ctx, wbin_state* wb)
+{
+	return nlcctx_msg_exchange(ctx, NL80211_CMD_GET_SCAN, cb_dump_bin, wb);
+}
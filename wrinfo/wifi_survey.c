@@ -3,17 +3,20 @@
 
 #include "jdump.h"
 #include "jdattr.h"
+#include "wbin.h"
 
 #include "nl_inc.h"
 #include "nlcctx.h"
 
 #include "wifi_survey.h"
 
-static int cb_dump(struct nl_msg* msg, void* arg)
+/* Parse the survey info of a message into survey; returns false if it's
+ * missing or invalid.
+ */
+static bool parse(struct nl_msg* msg, struct nlattr** survey)
 {
 	struct genlmsghdr* gnlh = nlmsg_data(nlmsg_hdr(msg));
 	struct nlattr* tb[NL80211_ATTR_MAX + 1];
-	struct nlattr* survey[NL80211_SURVEY_INFO_MAX + 1];
 	static struct nla_policy survey_info_policy[NL80211_SURVEY_INFO_MAX + 1] = {
 		[NL80211_SURVEY_INFO_FREQUENCY] = { .type = NLA_U32 },
 		[NL80211_SURVEY_INFO_IN_USE] = { .type = NLA_FLAG },
@@ -33,7 +36,7 @@ static int cb_dump(struct nl_msg* msg, void* arg)
 		NULL);				// Validation policy
 	if (!tb[NL80211_ATTR_SURVEY_INFO]) {
 		fprintf(stderr, "Error:  survey_info attribute info missing!\n");
-		return NL_SKIP;
+		return false;
 	}
 	if (nla_parse_nested(survey,
 			NL80211_SURVEY_INFO_MAX,
@@ -41,8 +44,16 @@ static int cb_dump(struct nl_msg* msg, void* arg)
 			survey_info_policy))
 	{
 		fprintf(stderr, "Error:  Failed to parse nested survey_info attribute!\n");
-		return NL_SKIP;
+		return false;
 	}
+	return true;
+}
+
+static int cb_dump(struct nl_msg* msg, void* arg)
+{
+	struct nlattr* survey[NL80211_SURVEY_INFO_MAX + 1];
+	if (!parse(msg, survey))
+		return NL_SKIP;
 
 	/* Output into JSON */
 	jdump_state* jd = (jdump_state*)arg;
@@ -67,3 +78,38 @@ int wifi_get_survey_results(struct nlcctx* ctx, jdump_state* jd)
 	jdump_close_array(jd);
 	return ret;
 }
+
+/* Binary output */
+
+static int cb_dump_bin(struct nl_msg* msg, void* arg)
+{
+	struct nlattr* survey[NL80211_SURVEY_INFO_MAX + 1];
+	if (!parse(msg, survey))
+		return NL_SKIP;
+
+	wbin_survey s = { 0 };
+	wbin_get_attr(s, WBIN_SURVEY_FREQUENCY, frequency,
+	  survey[NL80211_SURVEY_INFO_FREQUENCY], nla_get_u32);
+	if (survey[NL80211_SURVEY_INFO_IN_USE])
+		s.flags |= WBIN_SURVEY_IN_USE;
+	wbin_get_attr(s, WBIN_SURVEY_NOISE, noise,
+	  survey[NL80211_SURVEY_INFO_NOISE], (int8_t)nla_get_u8);
+	wbin_get_attr(s, WBIN_SURVEY_TIME, time,
+	  survey[NL80211_SURVEY_INFO_TIME], nla_get_u64);
+	wbin_get_attr(s, WBIN_SURVEY_BUSY, busy,
+	  survey[NL80211_SURVEY_INFO_TIME_BUSY], nla_get_u64);
+	wbin_get_attr(s, WBIN_SURVEY_EXT_BUSY, ext_busy,
+	  survey[NL80211_SURVEY_INFO_TIME_EXT_BUSY], nla_get_u64);
+	wbin_get_attr(s, WBIN_SURVEY_RX, rx,
+	  survey[NL80211_SURVEY_INFO_TIME_RX], nla_get_u64);
+	wbin_get_attr(s, WBIN_SURVEY_TX, tx,
+	  survey[NL80211_SURVEY_INFO_TIME_TX], nla_get_u64);
+	wbin_put_survey((wbin_state*)arg, &s);
+
+	return NL_SKIP;
+}
+
+int wifi_get_survey_results_bin(struct nlcctx* ctx, wbin_state* wb)
+{
+	return nlcctx_msg_exchange(ctx, NL80211_CMD_GET_SURVEY, cb_dump_bin, wb);
+}
@@ -4,7 +4,10 @@
 struct nlcctx;
 struct jdump_state_S;
 typedef struct jdump_state_S jdump_state;
+struct wbin_state_S;
+typedef struct wbin_state_S wbin_state;
 
 int wifi_get_survey_results(struct nlcctx* ctx, jdump_state* jd);
+int wifi_get_survey_results_bin(struct nlcctx* ctx, wbin_state* wb);
 
 #endif /* WIFI_SURVEY_H */